@@ -4,8 +4,23 @@ from fastapi import APIRouter
 from lnbits.tasks import create_permanent_unique_task
 from loguru import logger
 
+from .bloom import save_payment_filters
 from .crud import db
-from .tasks import wait_for_paid_invoices
+from .services import push_drain
+from .tasks import (
+    SHUTDOWN_DRAIN_SECONDS,
+    checkpoint_intake,
+    wait_for_deferred_payments,
+    wait_for_orphan_recovery,
+    wait_for_outgoing_payments,
+    wait_for_paid_invoices,
+    wait_for_payment_filters,
+    wait_for_retention,
+    wait_for_token_refresh,
+    wait_for_xero_webhooks,
+)
+from .tracing import shutdown_tracing
+from .transport import close_http_client
 from .views import xerosync_generic_router
 from .views_api import xerosync_api_router
 
@@ -24,17 +39,47 @@ xerosync_static_files = [
 scheduled_tasks: list[asyncio.Task] = []
 
 
-def xerosync_stop():
+async def xerosync_stop():
+    # Let running pushes finish their bookkeeping (new ones are deferred), then stop the tasks
+    # and keep whatever live payments are still queued for the next start.
+    await push_drain.close(SHUTDOWN_DRAIN_SECONDS)
     for task in scheduled_tasks:
         try:
             task.cancel()
         except Exception as ex:
             logger.warning(ex)
+    await asyncio.gather(*scheduled_tasks, return_exceptions=True)
+    scheduled_tasks.clear()
+    try:
+        await checkpoint_intake()
+    except Exception as ex:
+        logger.warning(f"Xero Sync: could not checkpoint the intake queue: {ex}")
+    try:
+        await save_payment_filters()
+    except Exception as ex:
+        logger.warning(f"Xero Sync: could not save the payment filters: {ex}")
+    await close_http_client()
+    shutdown_tracing()
 
 
 def xerosync_start():
+    push_drain.open()
     task = create_permanent_unique_task("ext_xerosync", wait_for_paid_invoices)
     scheduled_tasks.append(task)
+    outgoing_task = create_permanent_unique_task("ext_xerosync_outgoing", wait_for_outgoing_payments)
+    scheduled_tasks.append(outgoing_task)
+    deferred_task = create_permanent_unique_task("ext_xerosync_deferred", wait_for_deferred_payments)
+    scheduled_tasks.append(deferred_task)
+    token_task = create_permanent_unique_task("ext_xerosync_tokens", wait_for_token_refresh)
+    scheduled_tasks.append(token_task)
+    retention_task = create_permanent_unique_task("ext_xerosync_retention", wait_for_retention)
+    scheduled_tasks.append(retention_task)
+    webhooks_task = create_permanent_unique_task("ext_xerosync_webhooks", wait_for_xero_webhooks)
+    scheduled_tasks.append(webhooks_task)
+    recovery_task = create_permanent_unique_task("ext_xerosync_recovery", wait_for_orphan_recovery)
+    scheduled_tasks.append(recovery_task)
+    filters_task = create_permanent_unique_task("ext_xerosync_filters", wait_for_payment_filters)
+    scheduled_tasks.append(filters_task)
 
 
 __all__ = [
@@ -0,0 +1,207 @@
+import base64
+import hashlib
+import math
+from collections.abc import Iterable
+from datetime import timedelta, timezone
+
+from loguru import logger
+
+from .crud import (
+    count_synced_payment_hashes,
+    get_payment_filter,
+    get_push_wallets,
+    iter_synced_payment_hashes,
+    save_payment_filter,
+)
+from .models import PaymentFilter
+
+# About 1% false positives at capacity: 10 bits and 7 probes per payment.
+FILTER_BITS_PER_ENTRY = 10
+FILTER_PROBES = 7
+FILTER_MIN_CAPACITY = 1024
+# A rebuilt filter has room for this many times the wallet's current payments.
+FILTER_HEADROOM = 2
+# Payments reserved this long before a persisted filter was saved are added again on load,
+# covering reservations that were committed while another worker saved it.
+FILTER_CATCH_UP = timedelta(minutes=5)
+
+
+class PaymentHashFilter:
+    """
+    Bloom filter of a wallet's synced payment hashes. A miss means the hash was never added;
+    a hit may be a false positive (or a payment that failed since), so it still needs a lookup.
+    """
+
+    def __init__(self, capacity: int, size: int | None = None, probes: int = FILTER_PROBES):
+        self.capacity = capacity
+        self.size = size or capacity * FILTER_BITS_PER_ENTRY
+        self.probes = probes
+        self.bits = bytearray(math.ceil(self.size / 8))
+        self.entries = 0
+        self.dirty = False
+
+    def _positions(self, payment_hash: str) -> list[int]:
+        digest = hashlib.blake2b(payment_hash.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "big")
+        step = int.from_bytes(digest[8:], "big") | 1
+        return [(first + i * step) % self.size for i in range(self.probes)]
+
+    def add(self, payment_hash: str) -> None:
+        # Hashes already present (reclaimed reservations, catch-up on load) are not counted again.
+        added = False
+        for position in self._positions(payment_hash):
+            mask = 1 << (position & 7)
+            if not self.bits[position >> 3] & mask:
+                self.bits[position >> 3] |= mask
+                added = True
+        if added:
+            self.entries += 1
+            self.dirty = True
+
+    def might_contain(self, payment_hash: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(payment_hash))
+
+    @property
+    def full(self) -> bool:
+        return self.entries > self.capacity
+
+    def merge(self, other: "PaymentHashFilter") -> None:
+        """
+        Add everything `other` holds, e.g. another worker's saved filter of the same geometry.
+        """
+        self.bits = bytearray(a | b for a, b in zip(self.bits, other.bits, strict=True))
+        # The union's size is not known exactly; estimate it from the bits set.
+        ones = int.from_bytes(self.bits, "big").bit_count()
+        if ones < self.size:
+            estimate = -self.size / self.probes * math.log(1 - ones / self.size)
+            self.entries = max(self.entries, other.entries, round(estimate))
+
+    def same_geometry(self, other: "PaymentHashFilter") -> bool:
+        return (self.size, self.probes) == (other.size, other.probes)
+
+    def to_model(self, wallet_id: str) -> PaymentFilter:
+        return PaymentFilter(
+            wallet_id=wallet_id,
+            bits=base64.b64encode(bytes(self.bits)).decode(),
+            size=self.size,
+            probes=self.probes,
+            capacity=self.capacity,
+            entries=self.entries,
+        )
+
+    @classmethod
+    def from_model(cls, model: PaymentFilter) -> "PaymentHashFilter":
+        payment_filter = cls(model.capacity, model.size, model.probes)
+        bits = base64.b64decode(model.bits)
+        if len(bits) != len(payment_filter.bits):
+            raise ValueError(f"filter of wallet {model.wallet_id} has {len(bits)} bytes, expected {model.size} bits")
+        payment_filter.bits = bytearray(bits)
+        payment_filter.entries = model.entries
+        return payment_filter
+
+
+_filters: dict[str, PaymentHashFilter] = {}
+
+
+def might_be_synced(wallet_id: str, payment_hash: str) -> bool:
+    """
+    False only if the payment is certainly not synced; wallets without a filter yet always say True.
+    """
+    payment_filter = _filters.get(wallet_id)
+    return payment_filter is None or payment_filter.might_contain(payment_hash)
+
+
+def record_synced(wallet_id: str, payment_hashes: Iterable[str]) -> None:
+    payment_filter = _filters.get(wallet_id)
+    if payment_filter is None:
+        return
+    for payment_hash in payment_hashes:
+        payment_filter.add(payment_hash)
+
+
+async def build_payment_filter(wallet_id: str) -> PaymentHashFilter:
+    """
+    A filter of the wallet's synced hashes read from the database a chunk at a time.
+    """
+    total = await count_synced_payment_hashes(wallet_id)
+    payment_filter = PaymentHashFilter(max(FILTER_MIN_CAPACITY, total * FILTER_HEADROOM))
+    async for payment_hashes in iter_synced_payment_hashes(wallet_id):
+        for payment_hash in payment_hashes:
+            payment_filter.add(payment_hash)
+    return payment_filter
+
+
+async def load_payment_filter(wallet_id: str) -> PaymentHashFilter:
+    """
+    The wallet's saved filter caught up with later reservations, or a new one if none fits.
+    """
+    saved = await get_payment_filter(wallet_id)
+    if saved:
+        try:
+            payment_filter = PaymentHashFilter.from_model(saved)
+        except ValueError as e:
+            logger.warning(f"Xero Sync: rebuilding payment filter: {e}")
+        else:
+            saved_at = saved.saved_at if saved.saved_at.tzinfo else saved.saved_at.replace(tzinfo=timezone.utc)
+            async for payment_hashes in iter_synced_payment_hashes(wallet_id, saved_at - FILTER_CATCH_UP):
+                for payment_hash in payment_hashes:
+                    payment_filter.add(payment_hash)
+            if not payment_filter.full:
+                return payment_filter
+    payment_filter = await build_payment_filter(wallet_id)
+    await _save(wallet_id, payment_filter)
+    return payment_filter
+
+
+async def _save(wallet_id: str, payment_filter: PaymentHashFilter) -> None:
+    payment_filter.dirty = False
+    await save_payment_filter(payment_filter.to_model(wallet_id))
+
+
+async def save_payment_filters() -> None:
+    """
+    Save the filters changed since their last save, merged with what other workers saved.
+    """
+    for wallet_id, payment_filter in list(_filters.items()):
+        if not payment_filter.dirty:
+            continue
+        saved = await get_payment_filter(wallet_id)
+        if saved:
+            try:
+                other = PaymentHashFilter.from_model(saved)
+            except ValueError:
+                other = None
+            if other and payment_filter.same_geometry(other):
+                payment_filter.merge(other)
+        await _save(wallet_id, payment_filter)
+
+
+async def refresh_payment_filters() -> int:
+    """
+    Load filters of newly pushing wallets, rebuild those past capacity, and save the rest.
+    Returns the number of filters held.
+    """
+    wallet_ids = {wallet_cfg.wallet for wallet_cfg in await get_push_wallets()}
+    for wallet_id in list(_filters):
+        if wallet_id not in wallet_ids:
+            del _filters[wallet_id]
+    for wallet_id in wallet_ids:
+        payment_filter = _filters.get(wallet_id)
+        try:
+            if payment_filter is None:
+                _filters[wallet_id] = await load_payment_filter(wallet_id)
+            elif payment_filter.full:
+                _filters[wallet_id] = await build_payment_filter(wallet_id)
+                await _save(wallet_id, _filters[wallet_id])
+        except Exception as e:
+            logger.warning(f"Xero Sync: could not load the payment filter of wallet {wallet_id}: {e}")
+    await save_payment_filters()
+    return len(_filters)
+
+
+def get_payment_filter_metrics() -> dict:
+    return {
+        "wallets": len(_filters),
+        "entries": sum(payment_filter.entries for payment_filter in _filters.values()),
+        "bytes": sum(len(payment_filter.bits) for payment_filter in _filters.values()),
+    }
@@ -0,0 +1,143 @@
+from collections import OrderedDict
+
+from loguru import logger
+
+from .crud import delete_xero_contacts_by_id, get_xero_contacts, save_xero_contact
+from .models import XeroContact
+from .transport import idempotency_key, xero_request
+
+# Resolved ContactIDs kept in memory, least recently used evicted first.
+CONTACT_CACHE_SIZE = 2000
+# Names per Contacts lookup; each becomes a clause of the `where` filter in the query string.
+CONTACT_LOOKUP_CHUNK = 20
+
+_contact_cache: OrderedDict[tuple[str, str], str] = OrderedDict()
+
+
+def contact_name_key(name: str) -> str:
+    # Xero contact names are unique regardless of case and surrounding whitespace.
+    return " ".join(name.split()).lower()
+
+
+def _cache_get(tenant_id: str, name_key: str) -> str | None:
+    contact_id = _contact_cache.get((tenant_id, name_key))
+    if contact_id:
+        _contact_cache.move_to_end((tenant_id, name_key))
+    return contact_id
+
+
+def _cache_put(tenant_id: str, name_key: str, contact_id: str) -> None:
+    _contact_cache[(tenant_id, name_key)] = contact_id
+    _contact_cache.move_to_end((tenant_id, name_key))
+    while len(_contact_cache) > CONTACT_CACHE_SIZE:
+        _contact_cache.popitem(last=False)
+
+
+async def forget_xero_contact(tenant_id: str, contact_id: str) -> None:
+    """
+    Drop every name resolved to this contact, so the next push looks it up in Xero again.
+    """
+    for key in [key for key, cached_id in _contact_cache.items() if key[0] == tenant_id and cached_id == contact_id]:
+        del _contact_cache[key]
+    await delete_xero_contacts_by_id(tenant_id, contact_id)
+
+
+async def resolve_contact_ids(access_token: str, tenant_id: str, names: list[str]) -> dict[str, str]:
+    """
+    Map contact names to Xero ContactIDs: from the cache, then the local table, then Xero,
+    creating the contacts Xero does not have. Names that cannot be resolved are left out.
+    """
+    wanted: dict[str, str] = {}
+    for name in names:
+        if name and name.strip():
+            wanted.setdefault(contact_name_key(name), name.strip())
+
+    resolved: dict[str, str] = {}
+    for key in list(wanted):
+        contact_id = _cache_get(tenant_id, key)
+        if contact_id:
+            resolved[key] = contact_id
+
+    missing = [key for key in wanted if key not in resolved]
+    if missing:
+        for contact in await get_xero_contacts(tenant_id, missing):
+            resolved[contact.name_key] = contact.contact_id
+            _cache_put(tenant_id, contact.name_key, contact.contact_id)
+
+    missing = [key for key in wanted if key not in resolved]
+    if missing:
+        resolved.update(await _resolve_from_xero(access_token, tenant_id, {key: wanted[key] for key in missing}))
+
+    return {name: resolved[contact_name_key(name)] for name in names if contact_name_key(name) in resolved}
+
+
+async def _resolve_from_xero(access_token: str, tenant_id: str, wanted: dict[str, str]) -> dict[str, str]:
+    found = await _find_xero_contacts(access_token, tenant_id, list(wanted.values()))
+    missing = [key for key in wanted if key not in found]
+    if missing:
+        found.update(await _create_xero_contacts(access_token, tenant_id, [wanted[key] for key in missing]))
+
+    resolved: dict[str, str] = {}
+    for key, (name, contact_id) in found.items():
+        if key not in wanted:
+            continue
+        await save_xero_contact(XeroContact(tenant_id=tenant_id, name_key=key, name=name, contact_id=contact_id))
+        _cache_put(tenant_id, key, contact_id)
+        resolved[key] = contact_id
+    return resolved
+
+
+async def _find_xero_contacts(access_token: str, tenant_id: str, names: list[str]) -> dict[str, tuple[str, str]]:
+    # Names with a double quote cannot be expressed in the filter; they fall through to creation.
+    names = [name for name in names if '"' not in name]
+    found: dict[str, tuple[str, str]] = {}
+    for start in range(0, len(names), CONTACT_LOOKUP_CHUNK):
+        chunk = names[start : start + CONTACT_LOOKUP_CHUNK]
+        where = " OR ".join(f'Name=="{name}"' for name in chunk)
+        resp = await xero_request("GET", "Contacts", access_token, tenant_id, params={"where": where})
+        resp.raise_for_status()
+        for contact in resp.json().get("Contacts", []):
+            if contact.get("ContactID") and contact.get("Name"):
+                found[contact_name_key(contact["Name"])] = (contact["Name"], contact["ContactID"])
+    return found
+
+
+async def _create_xero_contacts(access_token: str, tenant_id: str, names: list[str]) -> dict[str, tuple[str, str]]:
+    resp = await xero_request(
+        "POST",
+        "Contacts",
+        access_token,
+        tenant_id,
+        json={"Contacts": [{"Name": name} for name in names]},
+        params={"summarizeErrors": "false"},
+        idempotency_key=idempotency_key(tenant_id, "contacts", *sorted(contact_name_key(n) for n in names)),
+    )
+    if resp.status_code >= 300:
+        logger.warning(f"Xero Sync: failed to create {len(names)} contact(s) ({resp.status_code}): {resp.text}")
+        return {}
+    created: dict[str, tuple[str, str]] = {}
+    for contact in resp.json().get("Contacts", []):
+        if contact.get("HasValidationErrors") or not contact.get("ContactID") or not contact.get("Name"):
+            continue
+        created[contact_name_key(contact["Name"])] = (contact["Name"], contact["ContactID"])
+    return created
+
+
+async def apply_contact_ids(access_token: str, tenant_id: str, bank_txs: list[dict]) -> None:
+    """
+    Replace contact names with resolved ContactIDs in the payloads, in place.
+    On failure the names are kept and Xero matches the contacts by name as before.
+    """
+    names = [tx["Contact"]["Name"] for tx in bank_txs if tx.get("Contact", {}).get("Name")]
+    if not names:
+        return
+    try:
+        contact_ids = await resolve_contact_ids(access_token, tenant_id, names)
+    except Exception as exc:
+        logger.warning(f"Xero Sync: could not resolve Xero contacts, sending names: {exc}")
+        return
+    for tx in bank_txs:
+        contact_id = contact_ids.get(tx.get("Contact", {}).get("Name", ""))
+        if contact_id:
+            # Replace rather than update: the contact dict is shared with the push plan's template.
+            tx["Contact"] = {"ContactID": contact_id}
@@ -1,21 +1,46 @@
-from datetime import datetime, timezone
+from collections.abc import AsyncIterator
+from datetime import datetime, timedelta, timezone
 
-from lnbits.db import Database, Filters, Page
+from lnbits.db import SQLITE, Database, Filters, Page
 from lnbits.helpers import urlsafe_short_hash
 
 from .models import (
+    PARTITION_ABANDONED,
+    PARTITION_DONE,
+    PARTITION_PENDING,
+    SYNC_JOB_RUNNING,
+    SYNC_STATUS_FAILED,
+    SYNC_STATUS_OK,
+    SYNC_STATUS_PENDING,
     CreateWallets,
     CreateXeroConnection,
+    DeferredPayment,
     ExtensionSettings,  #
+    FeeEntry,
+    FiatSnapshot,
+    PaymentFilter,
     SyncedPayment,
+    SyncedPaymentDay,
+    SyncedPaymentsFilters,
+    SyncHorizon,
+    SyncJob,
+    SyncPartition,
     UserExtensionSettings,  #
     Wallets,
     WalletsFilters,
     XeroConnection,
+    XeroContact,
+    XeroMetadataSnapshot,
 )
 
 db = Database("ext_xerosync")
 
+# Keep IN (...) lists and multi-row inserts below SQLite's bound-parameter limit.
+IN_CLAUSE_CHUNK = 500
+RESERVE_CHUNK = 100
+# Rows fetched per query when streaming an export or a wallet's synced hashes.
+EXPORT_CHUNK = 1000
+
 
 ########################### Wallets ############################
 async def create_wallets(user_id: str, data: CreateWallets) -> Wallets:
@@ -62,6 +87,53 @@ async def get_wallet_by_wallet_id(wallet_id: str) -> Wallets | None:
     )
 
 
+async def get_mapped_wallet(wallet_id: str) -> Wallets | None:
+    """
+    Any mapping for this LNbits wallet, whether or not auto-push is enabled.
+    """
+    return await db.fetchone(
+        """
+        SELECT * FROM xerosync.wallets
+        WHERE wallet = :wallet
+        ORDER BY push_payments DESC
+        LIMIT 1
+        """,
+        {"wallet": wallet_id},
+        Wallets,
+    )
+
+
+async def get_outgoing_sync_wallets() -> list[Wallets]:
+    return await db.fetchall(
+        """
+        SELECT * FROM xerosync.wallets
+        WHERE push_payments = TRUE AND (push_outgoing = TRUE OR fee_handling = TRUE)
+        """,
+        model=Wallets,
+    )
+
+
+async def get_push_wallets() -> list[Wallets]:
+    return await db.fetchall(
+        """
+        SELECT * FROM xerosync.wallets
+        WHERE push_payments = TRUE
+        ORDER BY user_id
+        """,
+        model=Wallets,
+    )
+
+
+async def get_retention_wallets() -> list[Wallets]:
+    return await db.fetchall(
+        """
+        SELECT * FROM xerosync.wallets
+        WHERE last_synced IS NOT NULL
+        """,
+        model=Wallets,
+    )
+
+
 async def get_wallets_ids_by_user(
     user_id: str,
 ) -> list[str]:
@@ -137,6 +209,16 @@ async def update_extension_settings(user_id: str, data: ExtensionSettings) -> Ex
     return settings
 
 
+async def get_webhook_settings() -> list[UserExtensionSettings]:
+    return await db.fetchall(
+        """
+        SELECT * FROM xerosync.extension_settings
+        WHERE xero_webhook_key IS NOT NULL AND xero_webhook_key != ''
+        """,
+        model=UserExtensionSettings,
+    )
+
+
 ######################## Xero Connections ########################
 async def create_xero_connection(user_id: str, data: CreateXeroConnection) -> XeroConnection:
     now = datetime.now(timezone.utc)
@@ -174,6 +256,31 @@ async def get_xero_connection(user_id: str) -> XeroConnection | None:
     )
 
 
+async def get_xero_connection_by_id(connection_id: str) -> XeroConnection | None:
+    return await db.fetchone(
+        "SELECT * FROM xerosync.connections WHERE id = :id",
+        {"id": connection_id},
+        XeroConnection,
+    )
+
+
+async def get_expiring_xero_connections(after: datetime, before: datetime) -> list[XeroConnection]:
+    """
+    Connections whose access token expires between `after` and `before`, soonest first.
+    """
+    return await db.fetchall(
+        f"""
+        SELECT *
+        FROM xerosync.connections
+        WHERE expires_at > {db.timestamp_placeholder("after")}
+        AND expires_at <= {db.timestamp_placeholder("before")}
+        ORDER BY expires_at
+        """,
+        {"after": after, "before": before},
+        XeroConnection,
+    )
+
+
 async def upsert_xero_connection(
     user_id: str,
     data: CreateXeroConnection,
@@ -207,52 +314,276 @@ async def create_synced_payment(
         xero_bank_transaction_id=xero_bank_transaction_id,
         currency=currency,
         amount=amount,
+        status=SYNC_STATUS_OK if xero_bank_transaction_id else SYNC_STATUS_PENDING,
     )
     await db.insert("xerosync.synced_payments", rec)
     return rec
 
 
-async def get_synced_payment(payment_hash: str) -> SyncedPayment | None:
+async def reserve_synced_payments(
+    user_id: str,
+    wallet_id: str,
+    reservations: list[tuple[str, str | None, float | None, datetime | None]],
+    lease: timedelta,
+) -> set[str]:
+    """
+    Insert pending rows for (payment_hash, currency, amount, paid_at) in multi-row statements,
+    leased to the caller for `lease`.
+    Hashes that are pending or pushed are left alone; failed rows are reclaimed,
+    keeping any Xero invoice already created for them.
+    Returns the payment hashes reserved by this call.
+    """
+    ids: list[str] = []
+    for start in range(0, len(reservations), RESERVE_CHUNK):
+        rows = []
+        values: dict = {
+            "user_id": user_id,
+            "wallet_id": wallet_id,
+            "pending": SYNC_STATUS_PENDING,
+            "leased_until": datetime.now(timezone.utc) + lease,
+        }
+        for i, (payment_hash, currency, amount, paid_at) in enumerate(reservations[start : start + RESERVE_CHUNK]):
+            row_id = urlsafe_short_hash()
+            ids.append(row_id)
+            rows.append(
+                f"(:id_{i}, :user_id, :wallet_id, :payment_hash_{i}, :currency_{i}, :amount_{i}, :pending, "
+                f"{db.timestamp_placeholder(f'paid_at_{i}')}, {db.timestamp_placeholder('leased_until')})"
+            )
+            values.update(
+                {
+                    f"id_{i}": row_id,
+                    f"payment_hash_{i}": payment_hash,
+                    f"currency_{i}": currency,
+                    f"amount_{i}": amount,
+                    f"paid_at_{i}": paid_at,
+                }
+            )
+        await db.execute(
+            f"""
+            INSERT INTO xerosync.synced_payments AS sp
+            (id, user_id, wallet_id, payment_hash, currency, amount, status, paid_at, leased_until)
+            VALUES {", ".join(rows)}
+            ON CONFLICT (wallet_id, payment_hash) DO UPDATE
+            SET id = excluded.id, user_id = excluded.user_id,
+                currency = excluded.currency, amount = excluded.amount, status = excluded.status,
+                paid_at = excluded.paid_at, leased_until = excluded.leased_until,
+                xero_bank_transaction_id = NULL, created_at = excluded.created_at
+            WHERE sp.status = :failed
+            """,
+            {**values, "failed": SYNC_STATUS_FAILED},
+        )
+
+    reserved: set[str] = set()
+    for start in range(0, len(ids), IN_CLAUSE_CHUNK):
+        placeholders, values = _in_clause("id", ids[start : start + IN_CLAUSE_CHUNK])
+        found: list[dict] = await db.fetchall(
+            f"""
+            SELECT payment_hash FROM xerosync.synced_payments
+            WHERE id IN ({placeholders})
+            """,
+            values,
+        )
+        reserved.update(row["payment_hash"] for row in found)
+    return reserved
+
+
+async def get_synced_payment(wallet_id: str, payment_hash: str) -> SyncedPayment | None:
     return await db.fetchone(
         """
         SELECT * FROM xerosync.synced_payments
-        WHERE payment_hash = :payment_hash
+        WHERE wallet_id = :wallet_id AND payment_hash = :payment_hash
         """,
-        {"payment_hash": payment_hash},
+        {"wallet_id": wallet_id, "payment_hash": payment_hash},
         SyncedPayment,
     )
 
 
 async def update_synced_payment(
+    wallet_id: str,
     payment_hash: str,
     xero_bank_transaction_id: str | None,
     currency: str | None,
     amount: float | None,
+    xero_invoice_id: str | None = None,
+    xero_payment_id: str | None = None,
 ) -> None:
     await db.execute(
         """
         UPDATE xerosync.synced_payments
         SET xero_bank_transaction_id = :xero_bank_transaction_id,
+            xero_invoice_id = COALESCE(:xero_invoice_id, xero_invoice_id),
+            xero_payment_id = :xero_payment_id,
             currency = :currency,
-            amount = :amount
-        WHERE payment_hash = :payment_hash
+            amount = :amount,
+            status = :status
+        WHERE wallet_id = :wallet_id AND payment_hash = :payment_hash
         """,
         {
+            "status": SYNC_STATUS_OK,
+            "wallet_id": wallet_id,
             "payment_hash": payment_hash,
             "xero_bank_transaction_id": xero_bank_transaction_id,
+            "xero_invoice_id": xero_invoice_id,
+            "xero_payment_id": xero_payment_id,
             "currency": currency,
             "amount": amount,
         },
     )
 
 
-async def delete_synced_payment(payment_hash: str) -> None:
+async def set_synced_payment_invoice(wallet_id: str, payment_hash: str, xero_invoice_id: str) -> None:
+    """
+    Record the invoice as soon as it exists, so a failed payment is retried against it.
+    """
+    await db.execute(
+        """
+        UPDATE xerosync.synced_payments
+        SET xero_invoice_id = :xero_invoice_id
+        WHERE wallet_id = :wallet_id AND payment_hash = :payment_hash
+        """,
+        {"wallet_id": wallet_id, "payment_hash": payment_hash, "xero_invoice_id": xero_invoice_id},
+    )
+
+
+async def get_invoice_push_states(wallet_id: str, payment_hashes: list[str]) -> dict[str, tuple[str | None, int]]:
+    """
+    (unpaid Xero invoice id, re-push count) by payment hash, for the payments that have
+    an invoice already created but not paid, or that are being posted again.
+    """
+    states: dict[str, tuple[str | None, int]] = {}
+    for start in range(0, len(payment_hashes), IN_CLAUSE_CHUNK):
+        placeholders, values = _in_clause("payment_hash", payment_hashes[start : start + IN_CLAUSE_CHUNK])
+        rows: list[dict] = await db.fetchall(
+            f"""
+            SELECT payment_hash, xero_invoice_id, repushes FROM xerosync.synced_payments
+            WHERE wallet_id = :wallet_id AND payment_hash IN ({placeholders}) AND xero_payment_id IS NULL
+            AND (xero_invoice_id IS NOT NULL OR repushes > 0)
+            """,
+            {**values, "wallet_id": wallet_id},
+        )
+        states.update({row["payment_hash"]: (row["xero_invoice_id"], row["repushes"] or 0) for row in rows})
+    return states
+
+
+async def get_failed_synced_payment_hashes(wallet_id: str, payment_hashes: list[str]) -> set[str]:
+    """
+    The hashes whose earlier push failed, i.e. that are about to be posted again.
+    """
+    failed: set[str] = set()
+    for start in range(0, len(payment_hashes), IN_CLAUSE_CHUNK):
+        placeholders, values = _in_clause("payment_hash", payment_hashes[start : start + IN_CLAUSE_CHUNK])
+        rows: list[dict] = await db.fetchall(
+            f"""
+            SELECT payment_hash FROM xerosync.synced_payments
+            WHERE wallet_id = :wallet_id AND payment_hash IN ({placeholders}) AND status = :failed
+            """,
+            {**values, "wallet_id": wallet_id, "failed": SYNC_STATUS_FAILED},
+        )
+        failed.update(row["payment_hash"] for row in rows)
+    return failed
+
+
+async def get_synced_payment_by_invoice(xero_invoice_id: str) -> SyncedPayment | None:
+    return await db.fetchone(
+        """
+        SELECT * FROM xerosync.synced_payments
+        WHERE xero_invoice_id = :xero_invoice_id
+        """,
+        {"xero_invoice_id": xero_invoice_id},
+        SyncedPayment,
+    )
+
+
+async def requeue_synced_payment(wallet_id: str, payment_hash: str, keep_invoice: bool) -> None:
+    """
+    Release a pushed payment to be posted again, forgetting its Xero payment
+    (and, unless `keep_invoice`, its invoice) and counting the re-push.
+    """
+    await db.execute(
+        f"""
+        UPDATE xerosync.synced_payments
+        SET status = :status, xero_bank_transaction_id = NULL, xero_payment_id = NULL,
+            {"" if keep_invoice else "xero_invoice_id = NULL,"} repushes = repushes + 1
+        WHERE wallet_id = :wallet_id AND payment_hash = :payment_hash
+        """,
+        {"wallet_id": wallet_id, "payment_hash": payment_hash, "status": SYNC_STATUS_FAILED},
+    )
+
+
+async def get_orphaned_synced_payments(now: datetime, limit: int) -> list[SyncedPayment]:
+    """
+    Reservations still pending after their lease ran out: their push was cut off before its bookkeeping.
+    """
+    return await db.fetchall(
+        f"""
+        SELECT * FROM xerosync.synced_payments
+        WHERE status = :status AND leased_until < {db.timestamp_placeholder("now")}
+        ORDER BY leased_until
+        LIMIT :limit
+        """,
+        {"status": SYNC_STATUS_PENDING, "now": now, "limit": limit},
+        SyncedPayment,
+    )
+
+
+async def extend_synced_payment_leases(wallet_id: str, payment_hashes: list[str], lease: timedelta) -> None:
+    """
+    Lease pending reservations for another `lease` from now; pushed or released ones are left alone.
+    """
+    leased_until = datetime.now(timezone.utc) + lease
+    for start in range(0, len(payment_hashes), IN_CLAUSE_CHUNK):
+        placeholders, values = _in_clause("payment_hash", payment_hashes[start : start + IN_CLAUSE_CHUNK])
+        await db.execute(
+            f"""
+            UPDATE xerosync.synced_payments
+            SET leased_until = {db.timestamp_placeholder("leased_until")}
+            WHERE wallet_id = :wallet_id AND status = :status AND payment_hash IN ({placeholders})
+            """,
+            {**values, "wallet_id": wallet_id, "status": SYNC_STATUS_PENDING, "leased_until": leased_until},
+        )
+
+
+async def get_synced_xero_ids(xero_ids: list[str]) -> set[str]:
+    """
+    The Xero bank transaction and invoice IDs among `xero_ids` already recorded for a synced payment.
+    """
+    found: set[str] = set()
+    for start in range(0, len(xero_ids), IN_CLAUSE_CHUNK):
+        placeholders, values = _in_clause("xero_id", xero_ids[start : start + IN_CLAUSE_CHUNK])
+        rows: list[dict] = await db.fetchall(
+            f"""
+            SELECT xero_bank_transaction_id, xero_invoice_id FROM xerosync.synced_payments
+            WHERE xero_bank_transaction_id IN ({placeholders}) OR xero_invoice_id IN ({placeholders})
+            """,
+            values,
+        )
+        found.update(row[column] for row in rows for column in ("xero_bank_transaction_id", "xero_invoice_id"))
+    return found & set(xero_ids)
+
+
+async def mark_synced_payments_failed(wallet_id: str, payment_hashes: list[str]) -> None:
+    """
+    Release reservations whose push failed, so a later sync can reclaim them.
+    """
+    for start in range(0, len(payment_hashes), IN_CLAUSE_CHUNK):
+        placeholders, values = _in_clause("payment_hash", payment_hashes[start : start + IN_CLAUSE_CHUNK])
+        await db.execute(
+            f"""
+            UPDATE xerosync.synced_payments
+            SET status = :status
+            WHERE wallet_id = :wallet_id AND payment_hash IN ({placeholders})
+            """,
+            {**values, "wallet_id": wallet_id, "status": SYNC_STATUS_FAILED},
+        )
+
+
+async def delete_synced_payment(wallet_id: str, payment_hash: str) -> None:
     await db.execute(
         """
         DELETE FROM xerosync.synced_payments
-        WHERE payment_hash = :payment_hash
+        WHERE wallet_id = :wallet_id AND payment_hash = :payment_hash
         """,
-        {"payment_hash": payment_hash},
+        {"wallet_id": wallet_id, "payment_hash": payment_hash},
     )
 
 
@@ -267,11 +598,593 @@ async def delete_synced_payments_by_wallet(wallet_id: str) -> None:
 
 
 async def get_synced_payment_hashes(wallet_id: str) -> set[str]:
+    """
+    Hashes that are pushed or being pushed; failed ones are free to be retried.
+    """
     rows: list[dict] = await db.fetchall(
         """
         SELECT payment_hash FROM xerosync.synced_payments
+        WHERE wallet_id = :wallet_id AND status != :failed
+        """,
+        {"wallet_id": wallet_id, "failed": SYNC_STATUS_FAILED},
+    )
+    return {row["payment_hash"] for row in rows}
+
+
+async def iter_synced_payment_hashes(wallet_id: str, since: datetime | None = None) -> AsyncIterator[list[str]]:
+    """
+    Stream the hashes `get_synced_payment_hashes` returns, EXPORT_CHUNK at a time,
+    optionally only those reserved since `since`.
+    """
+    where = "wallet_id = :wallet_id AND status != :failed"
+    values: dict = {"wallet_id": wallet_id, "failed": SYNC_STATUS_FAILED}
+    if since:
+        where += f" AND created_at >= {db.timestamp_placeholder('since')}"
+        values["since"] = since
+    after = ""
+    while True:
+        rows: list[dict] = await db.fetchall(
+            f"""
+            SELECT payment_hash FROM xerosync.synced_payments
+            WHERE {where} AND payment_hash > :after
+            ORDER BY payment_hash
+            LIMIT {EXPORT_CHUNK}
+            """,
+            {**values, "after": after},
+        )
+        if not rows:
+            return
+        yield [row["payment_hash"] for row in rows]
+        if len(rows) < EXPORT_CHUNK:
+            return
+        after = rows[-1]["payment_hash"]
+
+
+async def count_synced_payment_hashes(wallet_id: str) -> int:
+    row: dict = await db.fetchone(
+        """
+        SELECT COUNT(*) AS total FROM xerosync.synced_payments
+        WHERE wallet_id = :wallet_id AND status != :failed
+        """,
+        {"wallet_id": wallet_id, "failed": SYNC_STATUS_FAILED},
+    )
+    return row["total"] if row else 0
+
+
+def _synced_payments_where(user_id: str, has_xero_id: bool | None) -> tuple[list[str], dict]:
+    where = ["user_id = :user_id"]
+    if has_xero_id is True:
+        where.append("(xero_bank_transaction_id IS NOT NULL OR xero_payment_id IS NOT NULL)")
+    elif has_xero_id is False:
+        where.append("xero_bank_transaction_id IS NULL AND xero_payment_id IS NULL")
+    return where, {"user_id": user_id}
+
+
+async def get_synced_payments_paginated(
+    user_id: str,
+    filters: Filters[SyncedPaymentsFilters] | None = None,
+    has_xero_id: bool | None = None,
+) -> Page[SyncedPayment]:
+    where, values = _synced_payments_where(user_id, has_xero_id)
+    return await db.fetch_page(
+        "SELECT * FROM xerosync.synced_payments",
+        where=where,
+        values=values,
+        filters=filters,
+        model=SyncedPayment,
+        table_name="xerosync.synced_payments",
+    )
+
+
+async def iter_synced_payments(
+    user_id: str,
+    filters: Filters[SyncedPaymentsFilters] | None = None,
+    has_xero_id: bool | None = None,
+) -> AsyncIterator[list[SyncedPayment]]:
+    """
+    Stream matching rows oldest first, EXPORT_CHUNK at a time.
+    Pages by (created_at, id) keyset, so deep pages cost the same as the first.
+    Sorting and pagination in `filters` are ignored.
+    """
+    filters = filters or Filters()
+    where, values = _synced_payments_where(user_id, has_xero_id)
+    after: tuple[datetime, str] | None = None
+    while True:
+        page_where = list(where)
+        page_values = filters.values(dict(values))
+        if after:
+            after_ts = db.timestamp_placeholder("after_created_at")
+            page_where.append(f"(created_at > {after_ts} OR (created_at = {after_ts} AND id > :after_id))")
+            page_values.update({"after_created_at": after[0], "after_id": after[1]})
+        rows: list[SyncedPayment] = await db.fetchall(
+            f"""
+            SELECT * FROM xerosync.synced_payments
+            {filters.where(page_where)}
+            ORDER BY created_at, id
+            LIMIT {EXPORT_CHUNK}
+            """,
+            page_values,
+            SyncedPayment,
+        )
+        if not rows:
+            return
+        yield rows
+        if len(rows) < EXPORT_CHUNK:
+            return
+        after = (rows[-1].created_at, rows[-1].id)
+
+
+######################### Sync Retention #########################
+async def get_compaction_horizon(wallet_id: str) -> datetime | None:
+    horizon: SyncHorizon | None = await db.fetchone(
+        "SELECT * FROM xerosync.sync_horizons WHERE wallet_id = :wallet_id",
+        {"wallet_id": wallet_id},
+        SyncHorizon,
+    )
+    return horizon.compacted_before if horizon else None
+
+
+async def set_compaction_horizon(wallet_id: str, compacted_before: datetime) -> None:
+    await db.execute(
+        f"""
+        INSERT INTO xerosync.sync_horizons (wallet_id, compacted_before)
+        VALUES (:wallet_id, {db.timestamp_placeholder("compacted_before")})
+        ON CONFLICT (wallet_id) DO UPDATE SET compacted_before = excluded.compacted_before
+        """,
+        {"wallet_id": wallet_id, "compacted_before": compacted_before},
+    )
+
+
+async def get_compactable_synced_payments(wallet_id: str, before: datetime, limit: int) -> list[SyncedPayment]:
+    """
+    Oldest pushed rows of payments made before `before`; pending and failed rows are left in place.
+    Rows reserved before the payment time was recorded go by their reservation time, which is
+    never earlier than the payment's.
+    """
+    return await db.fetchall(
+        f"""
+        SELECT * FROM xerosync.synced_payments
+        WHERE wallet_id = :wallet_id AND status = :ok
+        AND COALESCE(paid_at, created_at) < {db.timestamp_placeholder("before")}
+        ORDER BY COALESCE(paid_at, created_at)
+        LIMIT {int(limit)}
+        """,
+        {"wallet_id": wallet_id, "ok": SYNC_STATUS_OK, "before": before},
+        SyncedPayment,
+    )
+
+
+async def add_synced_payment_days(days: list[SyncedPaymentDay]) -> None:
+    for entry in days:
+        await db.execute(
+            """
+            INSERT INTO xerosync.synced_payment_days AS d
+            (wallet_id, user_id, day, currency, payments, amount)
+            VALUES (:wallet_id, :user_id, :day, :currency, :payments, :amount)
+            ON CONFLICT (wallet_id, day, currency) DO UPDATE
+            SET payments = d.payments + excluded.payments, amount = d.amount + excluded.amount
+            """,
+            entry.dict(),
+        )
+
+
+async def delete_synced_payments_by_id(ids: list[str]) -> None:
+    for start in range(0, len(ids), IN_CLAUSE_CHUNK):
+        placeholders, values = _in_clause("id", ids[start : start + IN_CLAUSE_CHUNK])
+        await db.execute(
+            f"""
+            DELETE FROM xerosync.synced_payments
+            WHERE id IN ({placeholders})
+            """,
+            values,
+        )
+
+
+########################### Fee Entries ###########################
+async def create_fee_entry(data: FeeEntry) -> FeeEntry:
+    await db.insert("xerosync.fee_entries", data)
+    return data
+
+
+async def get_fee_entry_hashes(wallet_id: str) -> set[str]:
+    rows: list[dict] = await db.fetchall(
+        """
+        SELECT payment_hash FROM xerosync.fee_entries
         WHERE wallet_id = :wallet_id
         """,
         {"wallet_id": wallet_id},
     )
     return {row["payment_hash"] for row in rows}
+
+
+async def get_unposted_fee_entries(wallet_id: str, before_period: str) -> list[FeeEntry]:
+    """
+    Fee entries not yet pushed to Xero for periods strictly before `before_period`.
+    """
+    return await db.fetchall(
+        """
+        SELECT * FROM xerosync.fee_entries
+        WHERE wallet_id = :wallet_id
+        AND period < :before_period
+        AND xero_bank_transaction_id IS NULL
+        ORDER BY period ASC
+        """,
+        {"wallet_id": wallet_id, "before_period": before_period},
+        FeeEntry,
+    )
+
+
+async def mark_fee_entries_posted(entry_ids: list[str], xero_bank_transaction_id: str) -> None:
+    for start in range(0, len(entry_ids), IN_CLAUSE_CHUNK):
+        placeholders, values = _in_clause("entry_id", entry_ids[start : start + IN_CLAUSE_CHUNK])
+        await db.execute(
+            f"""
+            UPDATE xerosync.fee_entries
+            SET xero_bank_transaction_id = :xero_bank_transaction_id
+            WHERE id IN ({placeholders})
+            """,
+            {**values, "xero_bank_transaction_id": xero_bank_transaction_id},
+        )
+
+
+######################### Fiat Snapshots ##########################
+async def create_fiat_snapshot(data: FiatSnapshot) -> FiatSnapshot:
+    await db.insert("xerosync.fiat_snapshots", data)
+    return data
+
+
+async def get_fiat_snapshots(wallet_id: str, payment_hashes: list[str]) -> dict[str, FiatSnapshot]:
+    snapshots: dict[str, FiatSnapshot] = {}
+    for start in range(0, len(payment_hashes), IN_CLAUSE_CHUNK):
+        placeholders, values = _in_clause("payment_hash", payment_hashes[start : start + IN_CLAUSE_CHUNK])
+        rows: list[FiatSnapshot] = await db.fetchall(
+            f"""
+            SELECT * FROM xerosync.fiat_snapshots
+            WHERE wallet_id = :wallet_id AND payment_hash IN ({placeholders})
+            """,
+            {**values, "wallet_id": wallet_id},
+            FiatSnapshot,
+        )
+        snapshots.update({row.payment_hash: row for row in rows})
+    return snapshots
+
+
+######################### Deferred Payments #########################
+async def defer_payments(user_id: str, wallet_id: str, payment_hashes: list[str], reason: str | None = None) -> None:
+    """
+    Park payments for a later push. Payments that are already parked are left alone,
+    except that a claimed one is released to be retried.
+    """
+    for start in range(0, len(payment_hashes), RESERVE_CHUNK):
+        placeholders, values = _in_clause("payment_hash", payment_hashes[start : start + RESERVE_CHUNK])
+        rows = ", ".join(f"({key}, :user_id, :wallet_id, :reason)" for key in placeholders.split(", "))
+        await db.execute(
+            f"""
+            INSERT INTO xerosync.deferred_payments AS dp (payment_hash, user_id, wallet_id, reason)
+            VALUES {rows}
+            ON CONFLICT (wallet_id, payment_hash) DO UPDATE
+            SET reason = excluded.reason, leased_by = NULL, leased_until = NULL
+            WHERE dp.leased_by IS NOT NULL
+            """,
+            {**values, "user_id": user_id, "wallet_id": wallet_id, "reason": reason},
+        )
+
+
+async def get_deferred_user_ids() -> list[str]:
+    rows: list[dict] = await db.fetchall("SELECT DISTINCT user_id FROM xerosync.deferred_payments")
+    return [row["user_id"] for row in rows]
+
+
+async def claim_deferred_payments(user_id: str, limit: int, lease: timedelta) -> tuple[str, list[DeferredPayment]]:
+    """
+    Lease up to `limit` of the user's deferred payments no other worker holds, oldest first.
+    Returns the lease token and the claimed payments.
+    """
+    token = await _claim(
+        "deferred_payments",
+        "wallet_id, payment_hash",
+        "user_id = :user_id",
+        "created_at",
+        limit,
+        lease,
+        {"user_id": user_id},
+    )
+    claimed = await db.fetchall(
+        """
+        SELECT * FROM xerosync.deferred_payments
+        WHERE leased_by = :token
+        ORDER BY created_at
+        """,
+        {"token": token},
+        DeferredPayment,
+    )
+    return token, claimed
+
+
+async def delete_claimed_deferred_payments(token: str) -> None:
+    """
+    Drop the payments still held under the lease; those deferred again meanwhile were released.
+    """
+    await db.execute(
+        """
+        DELETE FROM xerosync.deferred_payments
+        WHERE leased_by = :token
+        """,
+        {"token": token},
+    )
+
+
+########################### Intake Spill ##########################
+async def spill_payment(payment_hash: str, payment_json: str) -> None:
+    await db.execute(
+        """
+        INSERT INTO xerosync.intake_spill (payment_hash, payment)
+        VALUES (:payment_hash, :payment)
+        ON CONFLICT (payment_hash) DO NOTHING
+        """,
+        {"payment_hash": payment_hash, "payment": payment_json},
+    )
+
+
+async def claim_spilled_payments(limit: int, lease: timedelta) -> list[dict]:
+    """
+    Lease up to `limit` spilled payments no other worker is reloading, oldest first.
+    """
+    token = await _claim("intake_spill", "payment_hash", "1 = 1", "created_at", limit, lease)
+    return await db.fetchall(
+        """
+        SELECT payment_hash, payment FROM xerosync.intake_spill
+        WHERE leased_by = :token
+        ORDER BY created_at
+        """,
+        {"token": token},
+    )
+
+
+async def count_spilled_payments() -> int:
+    row: dict = await db.fetchone("SELECT COUNT(*) AS count FROM xerosync.intake_spill")
+    return int(row["count"])
+
+
+async def delete_spilled_payments(payment_hashes: list[str]) -> None:
+    for start in range(0, len(payment_hashes), IN_CLAUSE_CHUNK):
+        placeholders, values = _in_clause("payment_hash", payment_hashes[start : start + IN_CLAUSE_CHUNK])
+        await db.execute(
+            f"""
+            DELETE FROM xerosync.intake_spill
+            WHERE payment_hash IN ({placeholders})
+            """,
+            values,
+        )
+
+
+############################ Sync Jobs ############################
+async def create_sync_job(job: SyncJob, partitions: list[SyncPartition]) -> SyncJob:
+    """
+    Partitions are written first, so a worker joining the running job sees all of them.
+    At most one job per wallet runs at a time; a second one fails with a unique violation.
+    """
+    for partition in partitions:
+        await db.insert("xerosync.sync_partitions", partition)
+    await db.insert("xerosync.sync_jobs", job)
+    return job
+
+
+async def delete_sync_partitions(job_id: str) -> None:
+    await db.execute(
+        """
+        DELETE FROM xerosync.sync_partitions
+        WHERE job_id = :job_id
+        """,
+        {"job_id": job_id},
+    )
+
+
+async def get_running_sync_job(wallet_id: str) -> SyncJob | None:
+    return await db.fetchone(
+        """
+        SELECT * FROM xerosync.sync_jobs
+        WHERE wallet_id = :wallet_id AND status = :status
+        ORDER BY created_at DESC
+        LIMIT 1
+        """,
+        {"wallet_id": wallet_id, "status": SYNC_JOB_RUNNING},
+        SyncJob,
+    )
+
+
+async def update_sync_job(job: SyncJob) -> SyncJob:
+    job.updated_at = datetime.now(timezone.utc)
+    await db.update("xerosync.sync_jobs", job)
+    return job
+
+
+async def get_unfinished_sync_partitions(job_id: str) -> list[SyncPartition]:
+    return await db.fetchall(
+        """
+        SELECT * FROM xerosync.sync_partitions
+        WHERE job_id = :job_id AND status NOT IN (:done, :abandoned)
+        ORDER BY starts_after
+        """,
+        {"job_id": job_id, "done": PARTITION_DONE, "abandoned": PARTITION_ABANDONED},
+        SyncPartition,
+    )
+
+
+async def reopen_sync_job_tail(job_id: str) -> None:
+    """
+    Mark the job's open-ended last partition to be synced again if it finished,
+    so a resumed job also picks up payments settled since it was planned.
+    """
+    await db.execute(
+        """
+        UPDATE xerosync.sync_partitions
+        SET status = :pending, attempts = 0
+        WHERE job_id = :job_id AND ends_at IS NULL AND status = :done
+        """,
+        {"job_id": job_id, "pending": PARTITION_PENDING, "done": PARTITION_DONE},
+    )
+
+
+async def claim_sync_partition(job_id: str, partition_ids: list[str], lease: timedelta) -> SyncPartition | None:
+    """
+    Lease the earliest of these unfinished partitions that no other worker is syncing.
+    """
+    if not partition_ids:
+        return None
+    placeholders, values = _in_clause("partition_id", partition_ids)
+    token = await _claim(
+        "sync_partitions",
+        "id",
+        f"job_id = :job_id AND status NOT IN (:done, :abandoned) AND id IN ({placeholders})",
+        "starts_after",
+        1,
+        lease,
+        {**values, "job_id": job_id, "done": PARTITION_DONE, "abandoned": PARTITION_ABANDONED},
+    )
+    return await db.fetchone(
+        """
+        SELECT * FROM xerosync.sync_partitions
+        WHERE leased_by = :token
+        """,
+        {"token": token},
+        SyncPartition,
+    )
+
+
+async def update_sync_partition(partition: SyncPartition) -> SyncPartition:
+    """
+    Checkpoint the partition, releasing its lease.
+    """
+    partition.updated_at = datetime.now(timezone.utc)
+    partition.leased_by = None
+    partition.leased_until = None
+    await db.update("xerosync.sync_partitions", partition)
+    return partition
+
+
+########################### Xero Contacts ###########################
+async def get_xero_contacts(tenant_id: str, name_keys: list[str]) -> list[XeroContact]:
+    contacts: list[XeroContact] = []
+    for start in range(0, len(name_keys), IN_CLAUSE_CHUNK):
+        placeholders, values = _in_clause("name_key", name_keys[start : start + IN_CLAUSE_CHUNK])
+        contacts.extend(
+            await db.fetchall(
+                f"""
+                SELECT * FROM xerosync.xero_contacts
+                WHERE tenant_id = :tenant_id AND name_key IN ({placeholders})
+                """,
+                {**values, "tenant_id": tenant_id},
+                XeroContact,
+            )
+        )
+    return contacts
+
+
+async def save_xero_contact(contact: XeroContact) -> None:
+    await db.execute(
+        """
+        INSERT INTO xerosync.xero_contacts (tenant_id, name_key, name, contact_id)
+        VALUES (:tenant_id, :name_key, :name, :contact_id)
+        ON CONFLICT (tenant_id, name_key) DO UPDATE
+        SET name = excluded.name, contact_id = excluded.contact_id
+        """,
+        {
+            "tenant_id": contact.tenant_id,
+            "name_key": contact.name_key,
+            "name": contact.name,
+            "contact_id": contact.contact_id,
+        },
+    )
+
+
+async def delete_xero_contacts_by_id(tenant_id: str, contact_id: str) -> None:
+    await db.execute(
+        """
+        DELETE FROM xerosync.xero_contacts
+        WHERE tenant_id = :tenant_id AND contact_id = :contact_id
+        """,
+        {"tenant_id": tenant_id, "contact_id": contact_id},
+    )
+
+
+########################### Payment Filters ###########################
+async def get_payment_filter(wallet_id: str) -> PaymentFilter | None:
+    return await db.fetchone(
+        "SELECT * FROM xerosync.payment_filters WHERE wallet_id = :wallet_id",
+        {"wallet_id": wallet_id},
+        PaymentFilter,
+    )
+
+
+async def save_payment_filter(payment_filter: PaymentFilter) -> None:
+    await db.execute(
+        f"""
+        INSERT INTO xerosync.payment_filters (wallet_id, bits, size, probes, capacity, entries, saved_at)
+        VALUES (:wallet_id, :bits, :size, :probes, :capacity, :entries, {db.timestamp_placeholder("saved_at")})
+        ON CONFLICT (wallet_id) DO UPDATE
+        SET bits = excluded.bits, size = excluded.size, probes = excluded.probes,
+            capacity = excluded.capacity, entries = excluded.entries, saved_at = excluded.saved_at
+        """,
+        payment_filter.dict(),
+    )
+
+
+########################### Xero Metadata ###########################
+async def get_xero_metadata_snapshot(tenant_id: str, kind: str) -> XeroMetadataSnapshot | None:
+    return await db.fetchone(
+        """
+        SELECT * FROM xerosync.xero_metadata
+        WHERE tenant_id = :tenant_id AND kind = :kind
+        """,
+        {"tenant_id": tenant_id, "kind": kind},
+        XeroMetadataSnapshot,
+    )
+
+
+async def save_xero_metadata_snapshot(snapshot: XeroMetadataSnapshot) -> None:
+    await db.execute(
+        f"""
+        INSERT INTO xerosync.xero_metadata (tenant_id, kind, data, fetched_at)
+        VALUES (:tenant_id, :kind, :data, {db.timestamp_placeholder("fetched_at")})
+        ON CONFLICT (tenant_id, kind) DO UPDATE
+        SET data = excluded.data, fetched_at = excluded.fetched_at
+        """,
+        snapshot.dict(),
+    )
+
+
+async def _claim(
+    table: str, key: str, where: str, order_by: str, limit: int, lease: timedelta, values: dict | None = None
+) -> str:
+    """
+    Lease up to `limit` rows of `table` (keyed by the `key` columns) matching `where` that are not
+    leased, or whose lease has expired, under a new token, in one statement. Postgres skips rows
+    another worker is claiming at the same moment; SQLite runs one write at a time, so the
+    statement is exclusive there.
+    Returns the token, to select the claimed rows by.
+    """
+    now = datetime.now(timezone.utc)
+    token = urlsafe_short_hash()
+    skip_locked = "" if db.type == SQLITE else "FOR UPDATE SKIP LOCKED"
+    await db.execute(
+        f"""
+        UPDATE xerosync.{table}
+        SET leased_by = :token, leased_until = {db.timestamp_placeholder("leased_until")}
+        WHERE ({key}) IN (
+            SELECT {key} FROM xerosync.{table}
+            WHERE {where}
+            AND (leased_until IS NULL OR leased_until < {db.timestamp_placeholder("now")})
+            ORDER BY {order_by}
+            LIMIT :limit
+            {skip_locked}
+        )
+        """,
+        {**(values or {}), "token": token, "leased_until": now + lease, "now": now, "limit": limit},
+    )
+    return token
+
+
+def _in_clause(prefix: str, items: list) -> tuple[str, dict]:
+    values = {f"{prefix}_{i}": item for i, item in enumerate(items)}
+    return ", ".join(f":{key}" for key in values), values
@@ -0,0 +1,92 @@
+import asyncio
+from datetime import timedelta
+
+from lnbits.core.models import Payment
+from loguru import logger
+
+from .crud import claim_spilled_payments, count_spilled_payments, delete_spilled_payments, spill_payment
+
+# Above the high watermark new payments are spilled to the database instead of memory;
+# spilled payments are reloaded once the queue has drained to the low watermark.
+INTAKE_HIGH_WATERMARK = 1000
+INTAKE_LOW_WATERMARK = 250
+# Workers sharing the database reload different spilled payments; a reload cut off is retried after this.
+SPILL_RELOAD_LEASE = timedelta(minutes=1)
+
+
+class IntakeQueue:
+    """
+    Bounded queue of live payments waiting to be pushed, spilling overflow to the database.
+    Once spilling starts every new payment is spilled until the backlog has been reloaded,
+    so payments keep their arrival order.
+    """
+
+    def __init__(self, high_watermark: int = INTAKE_HIGH_WATERMARK, low_watermark: int = INTAKE_LOW_WATERMARK):
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self._queue: asyncio.Queue[Payment] = asyncio.Queue()
+        self._spilling = False
+        # Serialises spill writes with reloads, so nothing is spilled after the last reload.
+        self._spill_lock = asyncio.Lock()
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    def empty(self) -> bool:
+        return self._queue.empty()
+
+    @property
+    def spilling(self) -> bool:
+        return self._spilling
+
+    async def restore(self) -> None:
+        """
+        Pick up payments spilled before a restart.
+        """
+        if await count_spilled_payments():
+            self._spilling = True
+
+    async def put(self, payment: Payment) -> None:
+        if not self._spilling and self._queue.qsize() < self.high_watermark:
+            self._queue.put_nowait(payment)
+            return
+        async with self._spill_lock:
+            if not self._spilling:
+                logger.warning(f"Xero Sync: intake queue above {self.high_watermark}, spilling to the database")
+                self._spilling = True
+            await spill_payment(payment.payment_hash, payment.json())
+
+    async def get(self) -> Payment:
+        if self._spilling and self._queue.qsize() <= self.low_watermark:
+            await self._reload()
+        return await self._queue.get()
+
+    def get_nowait(self) -> Payment:
+        return self._queue.get_nowait()
+
+    async def checkpoint(self, payments: list[Payment]) -> int:
+        """
+        Spill `payments`, then everything still queued in memory, so a restart picks them up
+        in that order. Returns the number of payments spilled.
+        """
+        async with self._spill_lock:
+            self._spilling = True
+            payments = list(payments)
+            while not self._queue.empty():
+                payments.append(self._queue.get_nowait())
+            for payment in payments:
+                await spill_payment(payment.payment_hash, payment.json())
+        if payments:
+            logger.info(f"Xero Sync: checkpointed {len(payments)} queued payment(s) for the next start")
+        return len(payments)
+
+    async def _reload(self) -> None:
+        async with self._spill_lock:
+            limit = self.high_watermark - self._queue.qsize()
+            rows = await claim_spilled_payments(limit, SPILL_RELOAD_LEASE)
+            for row in rows:
+                self._queue.put_nowait(Payment.parse_raw(row["payment"]))
+            await delete_spilled_payments([row["payment_hash"] for row in rows])
+            if len(rows) < limit:
+                self._spilling = False
+                logger.info("Xero Sync: intake backlog reloaded from the database")
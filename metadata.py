@@ -0,0 +1,66 @@
+import asyncio
+import json
+from datetime import datetime, timedelta, timezone
+
+from loguru import logger
+
+from .crud import get_xero_metadata_snapshot, save_xero_metadata_snapshot
+from .models import ExtensionSettings, XeroConnection, XeroMetadataSnapshot
+from .services import ensure_xero_access_token, fetch_xero_accounts, fetch_xero_tax_rates_raw
+
+METADATA_ACCOUNTS = "accounts"
+METADATA_TAX_RATES = "tax_rates"
+# Older snapshots are still served, and refreshed from Xero in the background.
+METADATA_MAX_AGE = timedelta(minutes=10)
+
+_fetchers = {
+    METADATA_ACCOUNTS: fetch_xero_accounts,
+    METADATA_TAX_RATES: fetch_xero_tax_rates_raw,
+}
+_refreshes: dict[tuple[str, str], asyncio.Task] = {}
+
+
+async def get_xero_metadata(
+    conn: XeroConnection, settings: ExtensionSettings, kind: str, refresh: bool = False
+) -> tuple[list[dict], datetime]:
+    """
+    The tenant's last fetched Xero `kind` list and when it was fetched, served from the snapshot
+    table; a stale snapshot is refreshed in the background. Only the first load (or `refresh`)
+    waits for Xero.
+    """
+    snapshot = None if refresh else await get_xero_metadata_snapshot(conn.tenant_id, kind)
+    if not snapshot:
+        snapshot = await refresh_xero_metadata(conn, settings, kind)
+    elif _age(snapshot) > METADATA_MAX_AGE:
+        _schedule_refresh(conn, settings, kind)
+    return json.loads(snapshot.data), snapshot.fetched_at
+
+
+async def refresh_xero_metadata(conn: XeroConnection, settings: ExtensionSettings, kind: str) -> XeroMetadataSnapshot:
+    access_token, tenant_id = await ensure_xero_access_token(conn, settings)
+    data = await _fetchers[kind](access_token, tenant_id)
+    snapshot = XeroMetadataSnapshot(tenant_id=tenant_id, kind=kind, data=json.dumps(data))
+    await save_xero_metadata_snapshot(snapshot)
+    return snapshot
+
+
+def _age(snapshot: XeroMetadataSnapshot) -> timedelta:
+    fetched_at = snapshot.fetched_at
+    if fetched_at.tzinfo is None:
+        fetched_at = fetched_at.replace(tzinfo=timezone.utc)
+    return datetime.now(timezone.utc) - fetched_at
+
+
+def _schedule_refresh(conn: XeroConnection, settings: ExtensionSettings, kind: str) -> None:
+    # One refresh per tenant and kind at a time, however many page loads ask for it.
+    task = _refreshes.get((conn.tenant_id, kind))
+    if task and not task.done():
+        return
+    _refreshes[(conn.tenant_id, kind)] = asyncio.create_task(_refresh_in_background(conn, settings, kind))
+
+
+async def _refresh_in_background(conn: XeroConnection, settings: ExtensionSettings, kind: str) -> None:
+    try:
+        await refresh_xero_metadata(conn, settings, kind)
+    except Exception as exc:
+        logger.warning(f"Xero Sync: background refresh of Xero {kind} failed: {exc}")
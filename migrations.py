@@ -193,3 +193,574 @@ async def m009_wallet_payment_type_toggles(db):
         ADD COLUMN push_fiat BOOLEAN DEFAULT TRUE;
         """
     )
+
+
+async def m010_wallet_fee_account_code(db):
+    """
+    Add fee_account_code (Xero expense account for routing fees) to wallet settings.
+    """
+    prefix = "" if getattr(db, "type", "").upper() == "SQLITE" else "xerosync."
+    tbl = f"{prefix}wallets"
+    await db.execute(
+        f"""
+        ALTER TABLE {tbl}
+        ADD COLUMN fee_account_code TEXT;
+        """
+    )
+
+
+async def m011_fee_entries(db):
+    """
+    Routing fees of outgoing payments, aggregated per period before being pushed to Xero.
+    """
+    prefix = "" if getattr(db, "type", "").upper() == "SQLITE" else "xerosync."
+    tbl = f"{prefix}fee_entries"
+
+    await db.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {tbl} (
+            id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            wallet_id TEXT NOT NULL,
+            payment_hash TEXT NOT NULL UNIQUE,
+            period TEXT NOT NULL,
+            fee_msat INTEGER NOT NULL,
+            currency TEXT NOT NULL,
+            amount REAL NOT NULL,
+            xero_bank_transaction_id TEXT,
+            created_at TIMESTAMP NOT NULL DEFAULT {db.timestamp_now}
+        );
+        """
+    )
+
+    await db.execute(
+        f"""
+        CREATE INDEX IF NOT EXISTS xerosync_fee_entries_wallet_period_idx
+        ON {tbl} (wallet_id, period);
+        """
+    )
+
+
+async def m012_wallet_outgoing_payments(db):
+    """
+    Add push_outgoing flag and SPEND account/contact mapping to wallet settings.
+    """
+    prefix = "" if getattr(db, "type", "").upper() == "SQLITE" else "xerosync."
+    tbl = f"{prefix}wallets"
+    await db.execute(
+        f"""
+        ALTER TABLE {tbl}
+        ADD COLUMN push_outgoing BOOLEAN DEFAULT FALSE;
+        """
+    )
+    await db.execute(
+        f"""
+        ALTER TABLE {tbl}
+        ADD COLUMN spend_account_code TEXT;
+        """
+    )
+    await db.execute(
+        f"""
+        ALTER TABLE {tbl}
+        ADD COLUMN spend_contact_name TEXT;
+        """
+    )
+
+
+async def m013_fiat_snapshots(db):
+    """
+    Fiat rate and amount captured at settlement for payments without fiat data in `extra`.
+    """
+    prefix = "" if getattr(db, "type", "").upper() == "SQLITE" else "xerosync."
+    tbl = f"{prefix}fiat_snapshots"
+
+    await db.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {tbl} (
+            payment_hash TEXT PRIMARY KEY,
+            wallet_id TEXT NOT NULL,
+            currency TEXT NOT NULL,
+            rate REAL NOT NULL,
+            amount REAL NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT {db.timestamp_now}
+        );
+        """
+    )
+
+
+async def m014_deferred_payments(db):
+    """
+    Live payments parked while a tenant's Xero circuit breaker is open.
+    """
+    prefix = "" if getattr(db, "type", "").upper() == "SQLITE" else "xerosync."
+    tbl = f"{prefix}deferred_payments"
+
+    await db.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {tbl} (
+            payment_hash TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            wallet_id TEXT NOT NULL,
+            reason TEXT,
+            created_at TIMESTAMP NOT NULL DEFAULT {db.timestamp_now}
+        );
+        """
+    )
+
+    await db.execute(
+        f"""
+        CREATE INDEX IF NOT EXISTS xerosync_deferred_payments_user_idx
+        ON {tbl} (user_id, created_at);
+        """
+    )
+
+
+async def m015_synced_payments_status(db):
+    """
+    Explicit pending/ok/failed status on synced payments, and composite indexes
+    for per-wallet range scans and status counts.
+    """
+    prefix = "" if getattr(db, "type", "").upper() == "SQLITE" else "xerosync."
+    tbl = f"{prefix}synced_payments"
+
+    await db.execute(
+        f"""
+        ALTER TABLE {tbl}
+        ADD COLUMN status TEXT NOT NULL DEFAULT 'ok';
+        """
+    )
+    # Rows without a Xero id were still in flight (or lost mid-push); keep them blocking.
+    await db.execute(
+        f"""
+        UPDATE {tbl}
+        SET status = 'pending'
+        WHERE xero_bank_transaction_id IS NULL;
+        """
+    )
+
+    await db.execute(
+        f"""
+        CREATE INDEX IF NOT EXISTS xerosync_synced_payments_wallet_created_idx
+        ON {tbl} (wallet_id, created_at);
+        """
+    )
+    await db.execute(
+        f"""
+        CREATE INDEX IF NOT EXISTS xerosync_synced_payments_user_wallet_idx
+        ON {tbl} (user_id, wallet_id);
+        """
+    )
+    await db.execute(
+        f"""
+        CREATE INDEX IF NOT EXISTS xerosync_synced_payments_wallet_status_idx
+        ON {tbl} (wallet_id, status);
+        """
+    )
+    # Covered by the composite indexes above.
+    await db.execute(
+        f"""
+        DROP INDEX IF EXISTS {prefix}xerosync_synced_payments_wallet_idx;
+        """
+    )
+
+
+async def m016_sync_jobs(db):
+    """
+    Bulk sync jobs split into date partitions, each checkpointed on completion.
+    """
+    prefix = "" if getattr(db, "type", "").upper() == "SQLITE" else "xerosync."
+
+    await db.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {prefix}sync_jobs (
+            id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            wallet_id TEXT NOT NULL,
+            starts_after TIMESTAMP,
+            status TEXT NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT {db.timestamp_now},
+            updated_at TIMESTAMP NOT NULL DEFAULT {db.timestamp_now}
+        );
+        """
+    )
+    await db.execute(
+        f"""
+        CREATE INDEX IF NOT EXISTS xerosync_sync_jobs_wallet_status_idx
+        ON {prefix}sync_jobs (wallet_id, status);
+        """
+    )
+
+    await db.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {prefix}sync_partitions (
+            id TEXT PRIMARY KEY,
+            job_id TEXT NOT NULL,
+            starts_after TIMESTAMP,
+            ends_at TIMESTAMP,
+            status TEXT NOT NULL,
+            pushed INTEGER NOT NULL DEFAULT 0,
+            skipped INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            updated_at TIMESTAMP NOT NULL DEFAULT {db.timestamp_now}
+        );
+        """
+    )
+    await db.execute(
+        f"""
+        CREATE INDEX IF NOT EXISTS xerosync_sync_partitions_job_idx
+        ON {prefix}sync_partitions (job_id, status);
+        """
+    )
+
+
+async def m017_intake_spill(db):
+    """
+    Live payments spilled from the bounded intake queue while it is above its high watermark.
+    """
+    prefix = "" if getattr(db, "type", "").upper() == "SQLITE" else "xerosync."
+
+    await db.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {prefix}intake_spill (
+            payment_hash TEXT PRIMARY KEY,
+            payment TEXT NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT {db.timestamp_now}
+        );
+        """
+    )
+
+
+async def m018_xero_contacts(db):
+    """
+    Xero ContactIDs resolved by contact name, per tenant.
+    """
+    prefix = "" if getattr(db, "type", "").upper() == "SQLITE" else "xerosync."
+
+    await db.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {prefix}xero_contacts (
+            tenant_id TEXT NOT NULL,
+            name_key TEXT NOT NULL,
+            name TEXT NOT NULL,
+            contact_id TEXT NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT {db.timestamp_now},
+            PRIMARY KEY (tenant_id, name_key)
+        );
+        """
+    )
+
+
+async def m019_invoice_posting_mode(db):
+    """
+    Per-wallet posting mode, and the Xero invoice and payment ids of payments posted as invoices.
+    """
+    prefix = "" if getattr(db, "type", "").upper() == "SQLITE" else "xerosync."
+
+    await db.execute(
+        f"""
+        ALTER TABLE {prefix}wallets
+        ADD COLUMN posting_mode TEXT DEFAULT 'bank_transaction';
+        """
+    )
+    await db.execute(
+        f"""
+        ALTER TABLE {prefix}synced_payments
+        ADD COLUMN xero_invoice_id TEXT;
+        """
+    )
+    await db.execute(
+        f"""
+        ALTER TABLE {prefix}synced_payments
+        ADD COLUMN xero_payment_id TEXT;
+        """
+    )
+
+
+async def m020_sync_history_retention(db):
+    """
+    Per-day summaries of compacted synced payments, and each wallet's compaction horizon.
+    """
+    prefix = "" if getattr(db, "type", "").upper() == "SQLITE" else "xerosync."
+
+    await db.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {prefix}synced_payment_days (
+            wallet_id TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            day TEXT NOT NULL,
+            currency TEXT NOT NULL,
+            payments INTEGER NOT NULL DEFAULT 0,
+            amount REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (wallet_id, day, currency)
+        );
+        """
+    )
+    await db.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {prefix}sync_horizons (
+            wallet_id TEXT PRIMARY KEY,
+            compacted_before TIMESTAMP NOT NULL
+        );
+        """
+    )
+
+
+async def m021_xero_metadata(db):
+    """
+    Last fetched Xero chart of accounts and tax rates per tenant, served to the UI while refreshed.
+    """
+    prefix = "" if getattr(db, "type", "").upper() == "SQLITE" else "xerosync."
+
+    await db.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {prefix}xero_metadata (
+            tenant_id TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            data TEXT NOT NULL,
+            fetched_at TIMESTAMP NOT NULL DEFAULT {db.timestamp_now},
+            PRIMARY KEY (tenant_id, kind)
+        );
+        """
+    )
+
+
+async def m022_xero_webhooks(db):
+    """
+    Webhook signing key per user, and a re-push count on synced payments for changes made in Xero.
+    """
+    prefix = "" if getattr(db, "type", "").upper() == "SQLITE" else "xerosync."
+
+    await db.execute(
+        f"""
+        ALTER TABLE {prefix}extension_settings
+        ADD COLUMN xero_webhook_key TEXT;
+        """
+    )
+    await db.execute(
+        f"""
+        ALTER TABLE {prefix}synced_payments
+        ADD COLUMN repushes INTEGER NOT NULL DEFAULT 0;
+        """
+    )
+    await db.execute(
+        f"""
+        CREATE INDEX IF NOT EXISTS xerosync_synced_payments_invoice_idx
+        ON {prefix}synced_payments (xero_invoice_id);
+        """
+    )
+
+
+async def m023_work_leases(db):
+    """
+    Leases on deferred payments, spilled payments and sync partitions, so several workers can share them.
+    """
+    prefix = "" if getattr(db, "type", "").upper() == "SQLITE" else "xerosync."
+
+    for table in ("deferred_payments", "intake_spill", "sync_partitions"):
+        await db.execute(
+            f"""
+            ALTER TABLE {prefix}{table}
+            ADD COLUMN leased_by TEXT;
+            """
+        )
+        await db.execute(
+            f"""
+            ALTER TABLE {prefix}{table}
+            ADD COLUMN leased_until TIMESTAMP;
+            """
+        )
+
+    # One running sync job per wallet, so workers starting the same sync join one job.
+    await db.execute(
+        f"""
+        UPDATE {prefix}sync_jobs SET status = 'superseded'
+        WHERE status = 'running' AND EXISTS (
+            SELECT 1 FROM {prefix}sync_jobs newer
+            WHERE newer.wallet_id = {prefix}sync_jobs.wallet_id
+            AND newer.status = 'running' AND newer.created_at > {prefix}sync_jobs.created_at
+        );
+        """
+    )
+    await db.execute(
+        f"""
+        CREATE UNIQUE INDEX IF NOT EXISTS xerosync_sync_jobs_running_idx
+        ON {prefix}sync_jobs (wallet_id) WHERE status = 'running';
+        """
+    )
+
+
+async def m024_payment_filters(db):
+    """
+    Persisted Bloom filters of synced payment hashes per wallet, loaded at startup.
+    """
+    prefix = "" if getattr(db, "type", "").upper() == "SQLITE" else "xerosync."
+
+    await db.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {prefix}payment_filters (
+            wallet_id TEXT PRIMARY KEY,
+            bits TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            probes INTEGER NOT NULL,
+            capacity INTEGER NOT NULL,
+            entries INTEGER NOT NULL DEFAULT 0,
+            saved_at TIMESTAMP NOT NULL DEFAULT {db.timestamp_now}
+        );
+        """
+    )
+
+
+async def m025_wallet_payment_keys(db):
+    """
+    Key synced payments, fee entries, fiat snapshots and deferred payments by wallet and payment hash:
+    both sides of an internal transfer between two mapped wallets share the payment hash.
+    """
+    prefix = "" if getattr(db, "type", "").upper() == "SQLITE" else "xerosync."
+
+    tables = {
+        "synced_payments": f"""
+            id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            wallet_id TEXT NOT NULL,
+            payment_hash TEXT NOT NULL,
+            xero_bank_transaction_id TEXT,
+            currency TEXT,
+            amount REAL,
+            created_at TIMESTAMP NOT NULL DEFAULT {db.timestamp_now},
+            status TEXT NOT NULL DEFAULT 'ok',
+            xero_invoice_id TEXT,
+            xero_payment_id TEXT,
+            repushes INTEGER NOT NULL DEFAULT 0,
+            UNIQUE (wallet_id, payment_hash)
+            """,
+        "fee_entries": f"""
+            id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            wallet_id TEXT NOT NULL,
+            payment_hash TEXT NOT NULL,
+            period TEXT NOT NULL,
+            fee_msat INTEGER NOT NULL,
+            currency TEXT NOT NULL,
+            amount REAL NOT NULL,
+            xero_bank_transaction_id TEXT,
+            created_at TIMESTAMP NOT NULL DEFAULT {db.timestamp_now},
+            UNIQUE (wallet_id, payment_hash)
+            """,
+        "fiat_snapshots": f"""
+            payment_hash TEXT NOT NULL,
+            wallet_id TEXT NOT NULL,
+            currency TEXT NOT NULL,
+            rate REAL NOT NULL,
+            amount REAL NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT {db.timestamp_now},
+            PRIMARY KEY (wallet_id, payment_hash)
+            """,
+        "deferred_payments": f"""
+            payment_hash TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            wallet_id TEXT NOT NULL,
+            reason TEXT,
+            created_at TIMESTAMP NOT NULL DEFAULT {db.timestamp_now},
+            leased_by TEXT,
+            leased_until TIMESTAMP,
+            PRIMARY KEY (wallet_id, payment_hash)
+            """,
+    }
+    columns = {
+        "synced_payments": "id, user_id, wallet_id, payment_hash, xero_bank_transaction_id, currency, amount, "
+        "created_at, status, xero_invoice_id, xero_payment_id, repushes",
+        "fee_entries": "id, user_id, wallet_id, payment_hash, period, fee_msat, currency, amount, "
+        "xero_bank_transaction_id, created_at",
+        "fiat_snapshots": "payment_hash, wallet_id, currency, rate, amount, created_at",
+        "deferred_payments": "payment_hash, user_id, wallet_id, reason, created_at, leased_by, leased_until",
+    }
+    # A unique constraint cannot be changed in place on SQLite: rebuild each table.
+    for table, definition in tables.items():
+        await db.execute(
+            f"""
+            CREATE TABLE {prefix}{table}_new ({definition});
+            """
+        )
+        await db.execute(
+            f"""
+            INSERT INTO {prefix}{table}_new ({columns[table]})
+            SELECT {columns[table]} FROM {prefix}{table};
+            """
+        )
+        await db.execute(
+            f"""
+            DROP TABLE {prefix}{table};
+            """
+        )
+        await db.execute(
+            f"""
+            ALTER TABLE {prefix}{table}_new RENAME TO {table};
+            """
+        )
+
+    indexes = {
+        "xerosync_synced_payments_wallet_created_idx": "synced_payments (wallet_id, created_at)",
+        "xerosync_synced_payments_user_wallet_idx": "synced_payments (user_id, wallet_id)",
+        "xerosync_synced_payments_wallet_status_idx": "synced_payments (wallet_id, status)",
+        "xerosync_synced_payments_invoice_idx": "synced_payments (xero_invoice_id)",
+        "xerosync_fee_entries_wallet_period_idx": "fee_entries (wallet_id, period)",
+        "xerosync_deferred_payments_user_idx": "deferred_payments (user_id, created_at)",
+    }
+    for name, target in indexes.items():
+        await db.execute(
+            f"""
+            CREATE INDEX IF NOT EXISTS {name}
+            ON {prefix}{target};
+            """
+        )
+
+
+async def m026_synced_payment_time(db):
+    """
+    The payment's own time on synced payments, so compaction and the sync horizon compare the same time.
+    """
+    prefix = "" if getattr(db, "type", "").upper() == "SQLITE" else "xerosync."
+
+    await db.execute(
+        f"""
+        ALTER TABLE {prefix}synced_payments
+        ADD COLUMN paid_at TIMESTAMP;
+        """
+    )
+
+
+async def m027_synced_payment_lease(db):
+    """
+    A lease on pending synced payments, extended while their push runs, so the orphaned
+    reservation recovery only takes reservations nobody is still posting.
+    """
+    prefix = "" if getattr(db, "type", "").upper() == "SQLITE" else "xerosync."
+
+    await db.execute(
+        f"""
+        ALTER TABLE {prefix}synced_payments
+        ADD COLUMN leased_until TIMESTAMP;
+        """
+    )
+    await db.execute(
+        f"""
+        UPDATE {prefix}synced_payments
+        SET leased_until = created_at
+        WHERE status = 'pending';
+        """
+    )
+
+
+async def m028_sync_partition_attempts(db):
+    """
+    Count the runs of each sync partition, so one that keeps failing cannot hold its job open.
+    """
+    prefix = "" if getattr(db, "type", "").upper() == "SQLITE" else "xerosync."
+
+    await db.execute(
+        f"""
+        ALTER TABLE {prefix}sync_partitions
+        ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0;
+        """
+    )
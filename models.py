@@ -3,20 +3,30 @@ from datetime import datetime, timezone
 from lnbits.db import FilterModel
 from pydantic import BaseModel, Field
 
-
 ########################### Wallets ############################
+# Incoming payments are posted as Receive Money bank transactions, or as
+# sales invoices (ACCREC) each paid in full into the wallet's bank account.
+POSTING_BANK_TRANSACTION = "bank_transaction"
+POSTING_INVOICE = "invoice"
+
+
 class CreateWallets(BaseModel):
     wallet: str
     pull_payments: bool
     push_payments: bool
     push_bitcoin: bool = True
     push_fiat: bool = True
+    push_outgoing: bool = False
     auto_reconcile: bool | None = None
     reconcile_name: str | None
     reconcile_mode: str | None
+    spend_account_code: str | None = None
+    spend_contact_name: str | None = None
     xero_bank_account_id: str | None
     tax_rate: str | None = None
+    posting_mode: str = POSTING_BANK_TRANSACTION
     fee_handling: bool | None
+    fee_account_code: str | None = None
     last_synced: datetime | None
     status: str | None
     notes: str | None
@@ -30,12 +40,17 @@ class Wallets(BaseModel):
     push_payments: bool
     push_bitcoin: bool = True
     push_fiat: bool = True
+    push_outgoing: bool = False
     auto_reconcile: bool | None = None
     reconcile_name: str | None
     reconcile_mode: str | None
+    spend_account_code: str | None = None
+    spend_contact_name: str | None = None
     xero_bank_account_id: str | None
     tax_rate: str | None = None
+    posting_mode: str = POSTING_BANK_TRANSACTION
     fee_handling: bool | None
+    fee_account_code: str | None = None
     last_synced: datetime | None
     status: str | None
     notes: str | None
@@ -51,12 +66,17 @@ class WalletsFilters(FilterModel):
         "push_payments",
         "push_bitcoin",
         "push_fiat",
+        "push_outgoing",
         "auto_reconcile",
         "reconcile_name",
         "reconcile_mode",
+        "spend_account_code",
+        "spend_contact_name",
         "xero_bank_account_id",
         "tax_rate",
+        "posting_mode",
         "fee_handling",
+        "fee_account_code",
         "last_synced",
         "status",
         "notes",
@@ -68,12 +88,17 @@ class WalletsFilters(FilterModel):
         "push_payments",
         "push_bitcoin",
         "push_fiat",
+        "push_outgoing",
         "auto_reconcile",
         "reconcile_name",
         "reconcile_mode",
+        "spend_account_code",
+        "spend_contact_name",
         "xero_bank_account_id",
         "tax_rate",
+        "posting_mode",
         "fee_handling",
+        "fee_account_code",
         "last_synced",
         "status",
         "notes",
@@ -92,6 +117,7 @@ class ExtensionSettings(BaseModel):
     xero_tax_standard: str | None = None
     xero_tax_zero: str | None = None
     xero_tax_exempt: str | None = None
+    xero_webhook_key: str | None = None
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
     @classmethod
@@ -123,12 +149,181 @@ class XeroConnection(BaseModel):
 
 
 ######################## Synced Payments ########################
+# Reserved and being pushed / pushed to Xero / push failed, free to be reclaimed.
+SYNC_STATUS_PENDING = "pending"
+SYNC_STATUS_OK = "ok"
+SYNC_STATUS_FAILED = "failed"
+
+
 class SyncedPayment(BaseModel):
     id: str
     user_id: str
     wallet_id: str
     payment_hash: str
     xero_bank_transaction_id: str | None
+    xero_invoice_id: str | None = None
+    xero_payment_id: str | None = None
     currency: str | None
     amount: float | None
+    status: str = SYNC_STATUS_OK
+    # Times the payment was queued to be posted again after Xero voided or unpaid its invoice.
+    repushes: int = 0
+    # The payment's own time; created_at is when it was reserved.
+    paid_at: datetime | None = None
+    # Until when a pending reservation belongs to the push that made it.
+    leased_until: datetime | None = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+class SyncedPaymentsFilters(FilterModel):
+    __search_fields__ = [
+        "payment_hash",
+        "xero_bank_transaction_id",
+        "xero_invoice_id",
+        "xero_payment_id",
+        "currency",
+        "status",
+    ]
+
+    __sort_fields__ = [
+        "wallet_id",
+        "currency",
+        "amount",
+        "status",
+        "created_at",
+    ]
+
+    wallet_id: str | None
+    payment_hash: str | None
+    xero_bank_transaction_id: str | None
+    xero_invoice_id: str | None
+    xero_payment_id: str | None
+    currency: str | None
+    amount: float | None
+    status: str | None
+    created_at: datetime | None
+
+
+class SyncedPaymentDay(BaseModel):
+    """
+    Per-day totals of synced payments compacted out of synced_payments.
+    """
+
+    wallet_id: str
+    user_id: str
+    day: str
+    currency: str
+    payments: int = 0
+    amount: float = 0
+
+
+class PaymentFilter(BaseModel):
+    """
+    A wallet's persisted Bloom filter of synced payment hashes.
+    """
+
+    wallet_id: str
+    # Bit array, base64 encoded
+    bits: str
+    size: int
+    probes: int
+    capacity: int
+    entries: int = 0
+    saved_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+class SyncHorizon(BaseModel):
+    wallet_id: str
+    # Synced payments pushed before this have been compacted; history before it is not synced again.
+    compacted_before: datetime
+
+
+########################### Fee Entries ###########################
+class FeeEntry(BaseModel):
+    id: str
+    user_id: str
+    wallet_id: str
+    payment_hash: str
+    period: str
+    fee_msat: int
+    currency: str
+    amount: float
+    xero_bank_transaction_id: str | None = None
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+######################### Fiat Snapshots ##########################
+class FiatSnapshot(BaseModel):
+    payment_hash: str
+    wallet_id: str
+    currency: str
+    rate: float
+    amount: float
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+######################### Deferred Payments #########################
+class DeferredPayment(BaseModel):
+    payment_hash: str
+    user_id: str
+    wallet_id: str
+    reason: str | None = None
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    # Claim token and expiry while a worker is pushing it.
+    leased_by: str | None = None
+    leased_until: datetime | None = None
+
+
+############################ Sync Jobs ############################
+SYNC_JOB_RUNNING = "running"
+SYNC_JOB_DONE = "done"
+SYNC_JOB_SUPERSEDED = "superseded"
+PARTITION_PENDING = "pending"
+PARTITION_DONE = "done"
+PARTITION_FAILED = "failed"
+# Failed as many times as a partition is retried; left out so the rest of the job can finish.
+PARTITION_ABANDONED = "abandoned"
+
+
+class SyncJob(BaseModel):
+    id: str
+    user_id: str
+    wallet_id: str
+    starts_after: datetime | None = None
+    status: str = SYNC_JOB_RUNNING
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+class SyncPartition(BaseModel):
+    id: str
+    job_id: str
+    starts_after: datetime | None = None
+    ends_at: datetime | None = None
+    status: str = PARTITION_PENDING
+    pushed: int = 0
+    skipped: int = 0
+    failed: int = 0
+    error: str | None = None
+    attempts: int = 0
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    leased_by: str | None = None
+    leased_until: datetime | None = None
+
+
+########################### Xero Contacts ###########################
+class XeroContact(BaseModel):
+    tenant_id: str
+    name_key: str
+    name: str
+    contact_id: str
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+########################### Xero Metadata ###########################
+class XeroMetadataSnapshot(BaseModel):
+    tenant_id: str
+    kind: str
+    # JSON list as returned by Xero
+    data: str
+    fetched_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
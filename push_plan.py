@@ -0,0 +1,222 @@
+from lnbits.core.models import Payment
+
+from .models import POSTING_INVOICE, ExtensionSettings, Wallets
+
+EMPTY_ACCOUNT_ID = "00000000-0000-0000-0000-000000000000"
+DEFAULT_RECEIVE_ACCOUNT_CODE = "200"  # "Sales" in the default Xero chart of accounts
+DEFAULT_RECEIVE_CONTACT_NAME = "LNbits Customer"
+DEFAULT_SPEND_ACCOUNT_CODE = "429"  # "General Expenses" in the default Xero chart of accounts
+DEFAULT_SPEND_CONTACT_NAME = "LNbits Supplier"
+# A payment can name its own Xero contact in `extra`, overriding the wallet's contact.
+EXTRA_CONTACT_NAME = "xero_contact_name"
+INVOICE_TYPE = "ACCREC"
+
+
+def _payment_is_fiat(payment: Payment) -> bool:
+    extra = payment.extra or {}
+    if payment.fiat_provider:
+        return True
+    if extra.get("paid_in_fiat"):
+        return True
+    if extra.get("fiat_payment_request"):
+        return True
+    return False
+
+
+def _revenue_tax_type(wallet_cfg: Wallets, settings: ExtensionSettings) -> str | None:
+    tr = wallet_cfg.tax_rate
+    if tr == "standard":
+        return settings.xero_tax_standard
+    if tr == "zero":
+        return settings.xero_tax_zero
+    if tr == "exempt":
+        return settings.xero_tax_exempt
+    return None
+
+
+def _plan_fingerprint(wallet_cfg: Wallets, settings: ExtensionSettings) -> tuple:
+    # Everything a plan is compiled from; a change to any of it recompiles the plan.
+    return (
+        wallet_cfg.push_bitcoin,
+        wallet_cfg.push_fiat,
+        wallet_cfg.push_outgoing,
+        wallet_cfg.auto_reconcile,
+        wallet_cfg.reconcile_name,
+        wallet_cfg.reconcile_mode,
+        wallet_cfg.spend_account_code,
+        wallet_cfg.spend_contact_name,
+        wallet_cfg.xero_bank_account_id,
+        wallet_cfg.tax_rate,
+        wallet_cfg.posting_mode,
+        settings.xero_tax_standard,
+        settings.xero_tax_zero,
+        settings.xero_tax_exempt,
+    )
+
+
+def is_invoice_payload(payload: dict) -> bool:
+    return payload.get("Type") == INVOICE_TYPE
+
+
+class PushPlan:
+    """
+    A wallet config compiled for pushing: flags and Xero codes are resolved once,
+    and each payload is a copy of a RECEIVE, SPEND or invoice template with the per-payment fields set.
+    """
+
+    __slots__ = (
+        "_receive_line",
+        "_receive_template",
+        "_spend_line",
+        "_spend_template",
+        "bank_account_id",
+        "post_invoices",
+        "push_bitcoin",
+        "push_fiat",
+        "push_outgoing",
+        "receive_tax_type",
+    )
+
+    push_bitcoin: bool
+    push_fiat: bool
+    push_outgoing: bool
+    bank_account_id: str | None
+    receive_tax_type: str | None
+    post_invoices: bool
+    _receive_template: dict
+    _receive_line: dict
+    _spend_template: dict
+    _spend_line: dict
+
+    def __init__(self, wallet_cfg: Wallets, settings: ExtensionSettings):
+        set_ = object.__setattr__
+        # None means the flag was never set on an older config row.
+        set_(self, "push_bitcoin", wallet_cfg.push_bitcoin is not False)
+        set_(self, "push_fiat", wallet_cfg.push_fiat is not False)
+        set_(self, "push_outgoing", bool(wallet_cfg.push_outgoing))
+        bank_account_id = wallet_cfg.xero_bank_account_id
+        set_(self, "bank_account_id", bank_account_id if bank_account_id != EMPTY_ACCOUNT_ID else None)
+        set_(self, "receive_tax_type", _revenue_tax_type(wallet_cfg, settings))
+        set_(self, "post_invoices", wallet_cfg.posting_mode == POSTING_INVOICE)
+
+        def template(tx_type: str, contact_name: str) -> dict:
+            bank_tx: dict = {
+                "Type": tx_type,
+                "Contact": {"Name": contact_name},
+                "BankAccount": {"AccountID": self.bank_account_id},
+            }
+            if wallet_cfg.auto_reconcile:
+                bank_tx["IsReconciled"] = True
+            return bank_tx
+
+        receive_contact = wallet_cfg.reconcile_name or DEFAULT_RECEIVE_CONTACT_NAME
+        if self.post_invoices:
+            # Line amounts include tax, so the invoice total is what was received and the payment settles it.
+            receive_template = {
+                "Type": INVOICE_TYPE,
+                "Status": "AUTHORISED",
+                "Contact": {"Name": receive_contact},
+                "LineAmountTypes": "Inclusive",
+            }
+        else:
+            receive_template = template("RECEIVE", receive_contact)
+        set_(self, "_receive_template", receive_template)
+        set_(
+            self,
+            "_receive_line",
+            {
+                "Quantity": 1,
+                "AccountCode": wallet_cfg.reconcile_mode or DEFAULT_RECEIVE_ACCOUNT_CODE,
+                "TaxType": self.receive_tax_type,
+            },
+        )
+        set_(
+            self,
+            "_spend_template",
+            template("SPEND", wallet_cfg.spend_contact_name or DEFAULT_SPEND_CONTACT_NAME),
+        )
+        set_(
+            self,
+            "_spend_line",
+            {
+                "Quantity": 1,
+                "AccountCode": wallet_cfg.spend_account_code or DEFAULT_SPEND_ACCOUNT_CODE,
+                # The wallet tax treatment maps to revenue tax types; let Xero apply the account default.
+                "TaxType": None,
+            },
+        )
+
+    def __setattr__(self, name, value):
+        raise AttributeError("PushPlan is immutable")
+
+    def skips_payment_type(self, payment: Payment) -> bool:
+        if _payment_is_fiat(payment):
+            return not self.push_fiat
+        return not self.push_bitcoin
+
+    @staticmethod
+    def payment_contact_name(payment: Payment) -> str | None:
+        name = (payment.extra or {}).get(EXTRA_CONTACT_NAME)
+        if not isinstance(name, str):
+            return None
+        return name.strip() or None
+
+    def direction_skip_reason(self, payment: Payment) -> str | None:
+        if payment.amount == 0:
+            return "payment has no amount"
+        if payment.amount < 0 and not self.push_outgoing:
+            return "outgoing payments disabled"
+        if payment.amount < 0 and not payment.success:
+            return "payment is not settled"
+        return None
+
+    def build(
+        self,
+        is_outgoing: bool,
+        description: str,
+        amount_major: float,
+        currency: str,
+        date: str,
+        contact_name: str | None = None,
+    ) -> dict:
+        """
+        BankTransaction (or, in invoice mode, sales invoice) payload for one payment;
+        `contact_name` overrides the wallet's contact.
+        """
+        if is_outgoing:
+            bank_tx = dict(self._spend_template)
+            line = dict(self._spend_line)
+        else:
+            bank_tx = dict(self._receive_template)
+            line = dict(self._receive_line)
+        line["Description"] = description
+        line["UnitAmount"] = amount_major
+        bank_tx["LineItems"] = [line]
+        bank_tx["Reference"] = description
+        bank_tx["CurrencyCode"] = currency.upper()
+        bank_tx["Date"] = date
+        if is_invoice_payload(bank_tx):
+            bank_tx["DueDate"] = date
+        if contact_name:
+            bank_tx["Contact"] = {"Name": contact_name}
+        return bank_tx
+
+
+_push_plans: dict[str, tuple[tuple, PushPlan]] = {}
+
+
+def get_push_plan(wallet_cfg: Wallets, settings: ExtensionSettings) -> PushPlan:
+    """
+    The cached plan for a wallet config, recompiled whenever the config or tax mapping changed.
+    """
+    fingerprint = _plan_fingerprint(wallet_cfg, settings)
+    cached = _push_plans.get(wallet_cfg.id)
+    if cached and cached[0] == fingerprint:
+        return cached[1]
+    plan = PushPlan(wallet_cfg, settings)
+    _push_plans[wallet_cfg.id] = (fingerprint, plan)
+    return plan
+
+
+def invalidate_push_plan(wallets_id: str) -> None:
+    _push_plans.pop(wallets_id, None)
@@ -0,0 +1,215 @@
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from lnbits.core.crud import get_standalone_payment
+from lnbits.core.models import Payment
+from loguru import logger
+
+from .crud import (
+    defer_payments,
+    extend_synced_payment_leases,
+    get_mapped_wallet,
+    get_orphaned_synced_payments,
+    get_synced_xero_ids,
+    get_xero_connection,
+    mark_synced_payments_failed,
+    requeue_synced_payment,
+    update_synced_payment,
+)
+from .models import POSTING_INVOICE, SyncedPayment, Wallets
+from .push_plan import INVOICE_TYPE
+from .services import ensure_xero_access_token, get_settings, payment_date, payment_reference
+from .transport import xero_request
+from .webhooks import VOIDED_INVOICE_STATUSES
+
+RECOVERY_BATCH = 200
+# Cut-off pushes matching more than one Xero transaction are left pending, to be checked again after this.
+AMBIGUOUS_RECHECK = timedelta(hours=6)
+# References per Xero lookup; each becomes a clause of the `where` filter in the query string.
+RECOVERY_LOOKUP_CHUNK = 10
+RECOVERED_REASON = "push cut off"
+
+
+async def recover_orphaned_reservations(now: datetime | None = None) -> int:
+    """
+    Settle reservations whose push was cut off, e.g. by a shutdown, after checking Xero:
+    payments Xero has are recorded as pushed, the others are released and deferred to be
+    pushed again. Returns the number of reservations settled.
+    """
+    by_wallet: dict[str, list[SyncedPayment]] = {}
+    for row in await get_orphaned_synced_payments(now or datetime.now(timezone.utc), RECOVERY_BATCH):
+        by_wallet.setdefault(row.wallet_id, []).append(row)
+
+    settled = 0
+    for wallet_id, rows in by_wallet.items():
+        try:
+            settled += await _recover_wallet(wallet_id, rows)
+        except Exception as e:
+            logger.warning(f"Xero Sync: could not check cut-off pushes of wallet {wallet_id} against Xero: {e}")
+    if settled:
+        logger.info(f"Xero Sync: settled {settled} cut-off push(es)")
+    return settled
+
+
+async def _recover_wallet(wallet_id: str, rows: list[SyncedPayment]) -> int:
+    hashes = [row.payment_hash for row in rows]
+    wallet_cfg = await get_mapped_wallet(wallet_id)
+    conn = await get_xero_connection(rows[0].user_id) if wallet_cfg else None
+    if not wallet_cfg or not conn:
+        # Nothing to check against; a later sync can reclaim them.
+        await mark_synced_payments_failed(wallet_id, hashes)
+        return len(rows)
+    settings = await get_settings(conn.user_id)
+    access_token, tenant_id = await ensure_xero_access_token(conn, settings)
+
+    payments: dict[str, Payment] = {}
+    for row in rows:
+        payment = await get_standalone_payment(row.payment_hash, wallet_id=wallet_id)
+        if payment:
+            payments[row.payment_hash] = payment
+    found = await _find_invoices_by_id(access_token, tenant_id, [row for row in rows if row.xero_invoice_id])
+    by_reference, ambiguous = await _find_by_reference(
+        access_token,
+        tenant_id,
+        wallet_cfg,
+        [payments[row.payment_hash] for row in rows if not row.xero_invoice_id and row.payment_hash in payments],
+        {row.payment_hash: row.amount for row in rows},
+    )
+    found.update(by_reference)
+
+    release: list[str] = []
+    held: list[str] = []
+    for row in rows:
+        match = found.get(row.payment_hash)
+        if row.payment_hash in ambiguous:
+            # Recording either transaction, or posting again, could book the payment twice.
+            held.append(row.payment_hash)
+        elif match and ("bank_transaction_id" in match or "payment_id" in match):
+            await update_synced_payment(
+                wallet_id,
+                row.payment_hash,
+                match.get("bank_transaction_id"),
+                row.currency,
+                row.amount,
+                match.get("invoice_id"),
+                match.get("payment_id"),
+            )
+        elif row.xero_invoice_id and not match:
+            # The invoice was voided or deleted meanwhile: post a new one.
+            await requeue_synced_payment(wallet_id, row.payment_hash, keep_invoice=False)
+            release.append(row.payment_hash)
+        else:
+            # Not in Xero, or an invoice still to be paid: push it again.
+            release.append(row.payment_hash)
+    if release:
+        await mark_synced_payments_failed(wallet_id, release)
+        await defer_payments(wallet_cfg.user_id, wallet_id, [h for h in release if h in payments], RECOVERED_REASON)
+    if held:
+        logger.warning(
+            f"Xero Sync: {len(held)} cut-off push(es) of wallet {wallet_id} match more than one Xero "
+            f"transaction, leaving them pending: {', '.join(held)}"
+        )
+        await extend_synced_payment_leases(wallet_id, held, AMBIGUOUS_RECHECK)
+    return len(rows) - len(held)
+
+
+async def _find_invoices_by_id(access_token: str, tenant_id: str, rows: list[SyncedPayment]) -> dict[str, dict]:
+    found: dict[str, dict] = {}
+    for start in range(0, len(rows), RECOVERY_LOOKUP_CHUNK):
+        chunk = {
+            row.xero_invoice_id: row.payment_hash
+            for row in rows[start : start + RECOVERY_LOOKUP_CHUNK]
+            if row.xero_invoice_id
+        }
+        resp = await xero_request("GET", "Invoices", access_token, tenant_id, params={"IDs": ",".join(chunk)})
+        resp.raise_for_status()
+        for invoice in resp.json().get("Invoices", []):
+            payment_hash = chunk.get(invoice.get("InvoiceID"))
+            if payment_hash and invoice.get("Status") not in VOIDED_INVOICE_STATUSES:
+                found[payment_hash] = _invoice_match(invoice)
+    return found
+
+
+async def _find_by_reference(
+    access_token: str,
+    tenant_id: str,
+    wallet_cfg: Wallets,
+    payments: list[Payment],
+    amounts: dict[str, float | None],
+) -> tuple[dict[str, dict], set[str]]:
+    """
+    Look the payments up in Xero by Reference, matching date and amount as well. Transactions
+    already recorded for a synced payment are not candidates. Returns the matches, and the
+    payments that match more than one transaction or share their only match with another payment.
+    """
+    found: dict[str, dict] = {}
+    ambiguous: set[str] = set()
+    # References with a double quote cannot be expressed in the filter; those are pushed again.
+    payments = [payment for payment in payments if '"' not in payment_reference(payment)]
+    invoiced = wallet_cfg.posting_mode == POSTING_INVOICE
+    for collection, id_field in (("Invoices", "InvoiceID"), ("BankTransactions", "BankTransactionID")):
+        wanted = [payment for payment in payments if (collection == "Invoices") == (invoiced and payment.amount > 0)]
+        items = await _get_by_reference(access_token, tenant_id, collection, id_field, wanted)
+        synced = await get_synced_xero_ids(list(items))
+        by_reference: dict[str, list[dict]] = {}
+        for xero_id, item in items.items():
+            if xero_id not in synced:
+                by_reference.setdefault(item.get("Reference") or "", []).append(item)
+
+        candidates = {
+            payment.payment_hash: [
+                item
+                for item in by_reference.get(payment_reference(payment), [])
+                if _matches(item, payment, amounts.get(payment.payment_hash))
+            ]
+            for payment in wanted
+        }
+        claims = Counter(item[id_field] for matched in candidates.values() for item in matched)
+        for payment_hash, matched in candidates.items():
+            if not matched:
+                continue
+            if len(matched) > 1 or claims[matched[0][id_field]] > 1:
+                ambiguous.add(payment_hash)
+            elif collection == "Invoices":
+                found[payment_hash] = _invoice_match(matched[0])
+            else:
+                found[payment_hash] = {"bank_transaction_id": matched[0][id_field]}
+    return found, ambiguous
+
+
+async def _get_by_reference(
+    access_token: str, tenant_id: str, collection: str, id_field: str, payments: list[Payment]
+) -> dict[str, dict]:
+    """
+    The live items of a Xero collection with the payments' references, by ID.
+    """
+    items: dict[str, dict] = {}
+    for start in range(0, len(payments), RECOVERY_LOOKUP_CHUNK):
+        chunk = payments[start : start + RECOVERY_LOOKUP_CHUNK]
+        where = " OR ".join(f'Reference=="{payment_reference(payment)}"' for payment in chunk)
+        if collection == "Invoices":
+            where = f'Type=="{INVOICE_TYPE}" AND ({where})'
+        resp = await xero_request("GET", collection, access_token, tenant_id, params={"where": where})
+        resp.raise_for_status()
+        for item in resp.json().get(collection, []):
+            if item.get(id_field) and item.get("Status") not in VOIDED_INVOICE_STATUSES:
+                items[item[id_field]] = item
+    return items
+
+
+def _matches(item: dict, payment: Payment, amount: float | None) -> bool:
+    if item.get("Reference") != payment_reference(payment):
+        return False
+    if (item.get("DateString") or "")[:10] != payment_date(payment)[:10]:
+        return False
+    # Bank transactions are posted tax exclusive and invoices tax inclusive.
+    totals = (item.get("SubTotal"), item.get("Total"))
+    return amount is not None and any(total is not None and abs(float(total) - amount) < 0.005 for total in totals)
+
+
+def _invoice_match(invoice: dict) -> dict:
+    match = {"invoice_id": invoice["InvoiceID"]}
+    paid = [p for p in invoice.get("Payments") or [] if p.get("PaymentID")]
+    if invoice.get("AmountPaid") and paid:
+        match["payment_id"] = paid[0]["PaymentID"]
+    return match
@@ -0,0 +1,99 @@
+import asyncio
+from datetime import datetime, time, timedelta, timezone
+
+from loguru import logger
+
+from .crud import (
+    add_synced_payment_days,
+    delete_synced_payments_by_id,
+    get_compactable_synced_payments,
+    get_compaction_horizon,
+    get_retention_wallets,
+    set_compaction_horizon,
+)
+from .models import SyncedPayment, SyncedPaymentDay, Wallets
+
+# Synced payments are kept row by row for this long (and never past the wallet's sync cursor);
+# older ones are folded into per-day totals. Ages go by the payment's time.
+SYNC_RETENTION = timedelta(days=90)
+# Rows compacted per round; rounds are separated by a short pause so pushes are not held up.
+COMPACTION_CHUNK = 500
+# The horizon is set this far past the newest folded payment: times are stored in whole seconds on SQLite.
+HORIZON_MARGIN = timedelta(seconds=1)
+COMPACTION_PAUSE_SECONDS = 0.1
+
+
+def compaction_cutoff(wallet_cfg: Wallets, now: datetime) -> datetime | None:
+    """
+    Start of the day before which the wallet's synced rows may be compacted.
+    """
+    if not wallet_cfg.last_synced:
+        return None
+    last_synced = wallet_cfg.last_synced
+    if last_synced.tzinfo is None:
+        last_synced = last_synced.replace(tzinfo=timezone.utc)
+    cutoff = min(last_synced, now - SYNC_RETENTION)
+    return datetime.combine(cutoff.date(), time.min, tzinfo=timezone.utc)
+
+
+async def compact_wallet_history(wallet_cfg: Wallets, now: datetime | None = None) -> int:
+    """
+    Fold the wallet's pushed rows of payments older than its cutoff into per-day totals, a chunk
+    at a time. Before each chunk is deleted the horizon is moved just past its newest payment:
+    syncs never reach back past the horizon, so the deleted rows are not needed for
+    de-duplication any more, while older payments that were never pushed stay within reach
+    unless rows after them were folded. Returns the number of rows compacted.
+    """
+    cutoff = compaction_cutoff(wallet_cfg, now or datetime.now(timezone.utc))
+    if not cutoff:
+        return 0
+    current = await get_compaction_horizon(wallet_cfg.wallet)
+
+    compacted = 0
+    while True:
+        rows = await get_compactable_synced_payments(wallet_cfg.wallet, cutoff, COMPACTION_CHUNK)
+        if not rows:
+            break
+        horizon = max(_paid_at(row) for row in rows) + HORIZON_MARGIN
+        if not current or _aware(current) < horizon:
+            await set_compaction_horizon(wallet_cfg.wallet, horizon)
+            current = horizon
+        days: dict[tuple[str, str], SyncedPaymentDay] = {}
+        for row in rows:
+            day = _paid_at(row).date().isoformat()
+            currency = row.currency or ""
+            entry = days.setdefault(
+                (day, currency),
+                SyncedPaymentDay(wallet_id=row.wallet_id, user_id=row.user_id, day=day, currency=currency),
+            )
+            entry.payments += 1
+            entry.amount = round(entry.amount + (row.amount or 0), 2)
+        await add_synced_payment_days(list(days.values()))
+        await delete_synced_payments_by_id([row.id for row in rows])
+        compacted += len(rows)
+        if len(rows) < COMPACTION_CHUNK:
+            break
+        await asyncio.sleep(COMPACTION_PAUSE_SECONDS)
+
+    if compacted:
+        logger.info(f"Xero Sync: compacted {compacted} synced payment(s) of wallet {wallet_cfg.wallet}")
+    return compacted
+
+
+def _aware(value: datetime) -> datetime:
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def _paid_at(row: SyncedPayment) -> datetime:
+    # Rows reserved before the payment time was recorded go by their reservation time.
+    return _aware(row.paid_at or row.created_at)
+
+
+async def compact_synced_history() -> int:
+    compacted = 0
+    for wallet_cfg in await get_retention_wallets():
+        try:
+            compacted += await compact_wallet_history(wallet_cfg)
+        except Exception as e:
+            logger.error(f"Xero Sync: failed to compact sync history of wallet {wallet_cfg.wallet}: {e}")
+    return compacted
@@ -1,32 +1,160 @@
+import asyncio
+import math
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager, contextmanager
 from datetime import date, datetime, time, timedelta, timezone
-from typing import TypedDict
+from typing import Any, TypedDict
 
-import httpx
-from lnbits.core.crud import get_payments_paginated, get_wallet
-from lnbits.core.models import Payment
-from lnbits.db import Filters
+from lnbits.core.crud import get_payments_paginated, get_standalone_payment, get_wallet
+from lnbits.core.models import Payment, PaymentFilters
+from lnbits.db import Filter, Filters
+from lnbits.helpers import urlsafe_short_hash
 from lnbits.settings import settings as lnbits_settings
 from lnbits.utils.exchange_rates import satoshis_amount_as_fiat
 from loguru import logger
 
+from .bloom import might_be_synced, record_synced
+from .contacts import apply_contact_ids
 from .crud import (
+    claim_deferred_payments,
+    claim_sync_partition,
     create_extension_settings,
-    create_synced_payment,
-    delete_synced_payment,
+    create_fee_entry,
+    create_fiat_snapshot,
+    create_sync_job,
+    defer_payments,
+    delete_claimed_deferred_payments,
+    delete_sync_partitions,
+    extend_synced_payment_leases,
+    get_compaction_horizon,
     get_extension_settings,
+    get_failed_synced_payment_hashes,
+    get_fee_entry_hashes,
+    get_fiat_snapshots,
+    get_invoice_push_states,
+    get_mapped_wallet,
+    get_push_wallets,
+    get_running_sync_job,
     get_synced_payment,
     get_synced_payment_hashes,
+    get_unfinished_sync_partitions,
+    get_unposted_fee_entries,
     get_xero_connection,
+    get_xero_connection_by_id,
+    mark_fee_entries_posted,
+    mark_synced_payments_failed,
+    reopen_sync_job_tail,
+    reserve_synced_payments,
+    set_synced_payment_invoice,
     update_extension_settings,
+    update_sync_job,
+    update_sync_partition,
     update_synced_payment,
     update_wallets,
     update_xero_connection,
 )
-from .models import ExtensionSettings, Wallets
+from .models import (
+    PARTITION_ABANDONED,
+    PARTITION_DONE,
+    PARTITION_FAILED,
+    SYNC_JOB_DONE,
+    SYNC_JOB_SUPERSEDED,
+    SYNC_STATUS_FAILED,
+    DeferredPayment,
+    ExtensionSettings,
+    FeeEntry,
+    FiatSnapshot,
+    SyncJob,
+    SyncPartition,
+    Wallets,
+)
+from .push_plan import EMPTY_ACCOUNT_ID, PushPlan, get_push_plan, is_invoice_payload
+from .tracing import push_trace, span
+from .transport import (
+    XeroCircuitOpenError,
+    get_circuit_breaker,
+    idempotency_key,
+    post_bank_transactions,
+    post_invoices,
+    post_payments,
+    xero_request,
+    xero_token_request,
+)
+
+SYNC_PAGE_SIZE = 1000
+# Upper bound on concurrent fiat lookups while building payloads.
+PAYLOAD_CONCURRENCY = 10
+# Prepared pages waiting to be posted while the next one is fetched and priced.
+PIPELINE_DEPTH = 2
+# Bulk syncs are split into date partitions of this span, run concurrently (all sharing
+# the tenant's rate limiter) and checkpointed one by one so a rerun resumes the rest.
+BACKFILL_PARTITION_SPAN = timedelta(days=30)
+BACKFILL_CONCURRENCY = 4
+# Work claimed by one worker is left to the others once its lease runs out, e.g. after a crash.
+DEFERRED_LEASE = timedelta(minutes=5)
+PARTITION_LEASE = timedelta(hours=1)
+# Runs of a failing partition before it is abandoned, e.g. for a payment Xero keeps rejecting.
+PARTITION_MAX_ATTEMPTS = 3
+# Reservations are leased to their push and the lease renewed while it posts, so the orphaned
+# reservation recovery only takes those whose push stopped, however long a bulk post runs.
+PUSH_LEASE = timedelta(minutes=5)
+PUSH_LEASE_RENEWAL = timedelta(minutes=1)
+PAYLOAD_ERROR = "payload error"
+DEFAULT_FEE_ACCOUNT_CODE = "404"  # "Bank Fees" in the default Xero chart of accounts
+FEE_CONTACT_NAME = "Lightning Network"
+# Marks fee entries whose period total rounds to zero, so they are not retried forever.
+FEE_BELOW_MINIMUM = "below-minimum"
+# Tenants synced at once by the admin-wide sync; each stays within its own Xero rate limit.
+ADMIN_SYNC_CONCURRENCY = 4
+ADMIN_SYNC_MAX_ERRORS = 50
+# Refresh an access token on use when it has less than this left.
+TOKEN_MIN_VALIDITY = timedelta(minutes=2)
+
+# Xero rotates the refresh token on every refresh, so two concurrent refreshes of one
+# connection would leave it with a revoked token. Refreshes are serialised per connection.
+_token_locks: dict[str, asyncio.Lock] = {}
+
+
+class PushDrain:
+    """
+    Counts pushes between reservation and bookkeeping, so shutdown can wait for them to finish.
+    Once closed, new pushes are refused with a retryable error instead of starting.
+    """
+
+    def __init__(self):
+        self.closed = False
+        self._active = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    @contextmanager
+    def track(self):
+        self._active += 1
+        self._idle.clear()
+        try:
+            yield
+        finally:
+            self._active -= 1
+            if not self._active:
+                self._idle.set()
+
+    def open(self) -> None:
+        self.closed = False
+
+    async def close(self, timeout: float) -> bool:
+        """
+        Refuse new pushes and wait up to `timeout` seconds for the running ones. Returns True if drained.
+        """
+        self.closed = True
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Xero Sync: {self._active} push(es) still running at shutdown")
+            return False
+        return True
+
 
-XERO_TOKEN_URL = "https://identity.xero.com/connect/token"
-XERO_API_BASE = "https://api.xero.com/api.xro/2.0"
-EMPTY_ACCOUNT_ID = "00000000-0000-0000-0000-000000000000"
+push_drain = PushDrain()
 
 
 # -- Xero API helpers ---------------------------------------------------------
@@ -34,16 +162,7 @@ async def fetch_xero_accounts(access_token: str, tenant_id: str) -> list[dict]:
     """
     Fetch Xero Accounts (chart of accounts).
     """
-    async with httpx.AsyncClient() as client:
-        resp = await client.get(
-            f"{XERO_API_BASE}/Accounts",
-            headers={
-                "Authorization": f"Bearer {access_token}",
-                "xero-tenant-id": tenant_id,
-                "Accept": "application/json",
-            },
-            timeout=10,
-        )
+    resp = await xero_request("GET", "Accounts", access_token, tenant_id)
     resp.raise_for_status()
     body = resp.json()
     return body.get("Accounts", [])
@@ -62,24 +181,17 @@ async def fetch_xero_tax_rates_raw(access_token: str, tenant_id: str) -> list[di
     Low-level helper to fetch TaxRates from Xero.
     Returns the raw Xero dicts.
     """
-    async with httpx.AsyncClient() as client:
-        resp = await client.get(
-            f"{XERO_API_BASE}/TaxRates",
-            headers={
-                "Authorization": f"Bearer {access_token}",
-                "xero-tenant-id": tenant_id,
-                "Accept": "application/json",
-            },
-            timeout=10,
-        )
+    resp = await xero_request("GET", "TaxRates", access_token, tenant_id)
     resp.raise_for_status()
     body = resp.json()
     return body.get("TaxRates", [])
 
 
-async def ensure_xero_access_token(conn, settings: ExtensionSettings) -> tuple[str, str]:
+async def ensure_xero_access_token(
+    conn, settings: ExtensionSettings, min_validity: timedelta = TOKEN_MIN_VALIDITY
+) -> tuple[str, str]:
     """
-    Make sure we have a valid access token.
+    Make sure we have an access token valid for at least `min_validity`.
     Returns (access_token, tenant_id).
     """
 
@@ -87,43 +199,74 @@ async def ensure_xero_access_token(conn, settings: ExtensionSettings) -> tuple[s
     if not settings.xero_client_id or not settings.xero_client_secret:
         raise RuntimeError("Xero Sync: client id/secret not configured in settings")
 
-    # If token is still good for > 2 minutes, use it
-    now = datetime.now(timezone.utc)
-    if conn.expires_at and conn.expires_at > now + timedelta(minutes=2):
+    if _token_is_valid(conn, min_validity):
         return conn.access_token, conn.tenant_id
 
-    # Refresh
-    data = {
-        "grant_type": "refresh_token",
-        "refresh_token": conn.refresh_token,
-        "client_id": settings.xero_client_id,
-        "client_secret": settings.xero_client_secret,
-    }
+    lock = _token_locks.setdefault(conn.id, asyncio.Lock())
+    async with lock:
+        # Another task may have refreshed while we waited; pick up its rotated tokens.
+        latest = await get_xero_connection_by_id(conn.id)
+        if latest:
+            conn.access_token = latest.access_token
+            conn.refresh_token = latest.refresh_token
+            conn.expires_at = latest.expires_at
+        if _token_is_valid(conn, min_validity):
+            return conn.access_token, conn.tenant_id
+
+        data = {
+            "grant_type": "refresh_token",
+            "refresh_token": conn.refresh_token,
+            "client_id": settings.xero_client_id,
+            "client_secret": settings.xero_client_secret,
+        }
+
+        resp = await xero_token_request(conn.tenant_id, data)
+        resp.raise_for_status()
+        body = resp.json()
 
-    async with httpx.AsyncClient() as client:
-        resp = await client.post(XERO_TOKEN_URL, data=data, timeout=10)
+        conn.access_token = body["access_token"]
+        conn.refresh_token = body["refresh_token"]
+        conn.expires_at = datetime.now(timezone.utc) + timedelta(seconds=body["expires_in"])
 
-    resp.raise_for_status()
-    body = resp.json()
+        await update_xero_connection(conn)
 
-    conn.access_token = body["access_token"]
-    conn.refresh_token = body["refresh_token"]
-    conn.expires_at = datetime.now(timezone.utc) + timedelta(seconds=body["expires_in"])
+    return conn.access_token, conn.tenant_id
 
-    await update_xero_connection(conn)
 
-    return conn.access_token, conn.tenant_id
+def _token_is_valid(conn, min_validity: timedelta) -> bool:
+    return bool(conn.expires_at and conn.expires_at > datetime.now(timezone.utc) + min_validity)
 
 
-async def _get_fiat_amount_for_payment(payment: Payment, wallet_cfg: Wallets) -> tuple[str | None, float | None]:
+async def refresh_xero_connection(conn, min_validity: timedelta) -> None:
+    """
+    Refresh the connection's access token ahead of use if it expires within `min_validity`.
+    """
+    settings = await get_settings(conn.user_id)
+    await ensure_xero_access_token(conn, settings, min_validity)
+
+
+def _get_fiat_amount_from_extra(payment: Payment) -> tuple[str | None, float | None]:
     extra = payment.extra or {}
     fiat_currency = extra.get("wallet_fiat_currency") or extra.get("fiat_currency")
     fiat_amount = extra.get("wallet_fiat_amount")
     if fiat_amount is None:
         fiat_amount = extra.get("fiat_amount")
+    return fiat_currency, float(fiat_amount) if fiat_amount is not None else None
+
 
+async def _get_fiat_amount_for_payment(
+    payment: Payment, wallet_cfg: Wallets, snapshot: FiatSnapshot | None = None
+) -> tuple[str | None, float | None]:
+    """
+    Fiat value of a payment: from `extra`, else from the settlement-time snapshot,
+    else converted at the current rate.
+    """
+    fiat_currency, fiat_amount = _get_fiat_amount_from_extra(payment)
     if fiat_currency and fiat_amount is not None:
-        return fiat_currency, float(fiat_amount)
+        return fiat_currency, fiat_amount
+
+    if snapshot:
+        return snapshot.currency, snapshot.amount
 
     wallet = await get_wallet(wallet_cfg.wallet)
     fallback_currency = (
@@ -137,17 +280,22 @@ async def _get_fiat_amount_for_payment(payment: Payment, wallet_cfg: Wallets) ->
 
 
 async def _build_bank_transaction_payload(
-    payment: Payment, wallet_cfg: Wallets, settings: ExtensionSettings
+    payment: Payment,
+    wallet_cfg: Wallets,
+    plan: PushPlan,
+    snapshot: FiatSnapshot | None = None,
 ) -> tuple[dict | None, float | None, str | None, str | None]:
     """
-    Prepare the Xero BankTransaction payload for a payment.
+    Prepare the Xero BankTransaction payload for a payment:
+    RECEIVE for incoming payments, SPEND for outgoing ones.
     Returns (payload, amount_major, currency, skip_reason).
     """
-    if payment.amount <= 0:
-        return None, None, None, "payment is not incoming"
+    direction_skip = plan.direction_skip_reason(payment)
+    if direction_skip:
+        return None, None, None, direction_skip
 
     try:
-        fiat_currency, fiat_amount = await _get_fiat_amount_for_payment(payment, wallet_cfg)
+        fiat_currency, fiat_amount = await _get_fiat_amount_for_payment(payment, wallet_cfg, snapshot)
     except Exception as exc:
         logger.warning(f"Xero Sync: failed to calculate fiat amount for " f"{payment.payment_hash}: {exc}")
         return None, None, None, "missing fiat currency/amount"
@@ -155,54 +303,34 @@ async def _build_bank_transaction_payload(
     if not fiat_currency or fiat_amount is None:
         return None, None, fiat_currency, "missing fiat currency/amount"
 
-    if not wallet_cfg.xero_bank_account_id or wallet_cfg.xero_bank_account_id == EMPTY_ACCOUNT_ID:
+    if not plan.bank_account_id:
         return None, None, None, "wallet missing xero_bank_account_id"
 
-    raw_amount = float(fiat_amount)
+    raw_amount = abs(float(fiat_amount))
     amount_major = round(raw_amount, 2)
     if amount_major <= 0:
         return None, None, None, "fiat amount too small after rounding"
 
-    description = payment.memo or f"LNbits payment {payment.payment_hash}"
-    account_code = wallet_cfg.reconcile_mode or "200"  # Sales by default
-    tax_type: str | None = None
-    tr = getattr(wallet_cfg, "tax_rate", None)
-
-    if tr == "standard":
-        tax_type = settings.xero_tax_standard
-    elif tr == "zero":
-        tax_type = settings.xero_tax_zero
-    elif tr == "exempt":
-        tax_type = settings.xero_tax_exempt
-
-    payment_date = _as_datetime(getattr(payment, "time", None))
-    bank_tx = {
-        "Type": "RECEIVE",
-        "Contact": {
-            "Name": wallet_cfg.reconcile_name or "LNbits Customer",
-        },
-        "BankAccount": {
-            "AccountID": wallet_cfg.xero_bank_account_id,
-        },
-        "LineItems": [
-            {
-                "Description": description,
-                "Quantity": 1,
-                "UnitAmount": amount_major,
-                "AccountCode": account_code,
-                "TaxType": tax_type,
-            }
-        ],
-        "Reference": description,
-        "CurrencyCode": fiat_currency.upper(),
-        "Date": payment_date.strftime("%Y-%m-%dT%H:%M:%S"),
-    }
-    if wallet_cfg.auto_reconcile:
-        bank_tx["IsReconciled"] = True
-
+    bank_tx = plan.build(
+        payment.amount < 0,
+        payment_reference(payment),
+        amount_major,
+        fiat_currency,
+        payment_date(payment),
+        plan.payment_contact_name(payment),
+    )
     return bank_tx, amount_major, fiat_currency, None
 
 
+def payment_reference(payment: Payment) -> str:
+    # Used as both the line description and the Reference of the Xero transaction.
+    return payment.memo or f"LNbits payment {payment.payment_hash}"
+
+
+def payment_date(payment: Payment) -> str:
+    return _as_datetime(getattr(payment, "time", None)).strftime("%Y-%m-%dT%H:%M:%S")
+
+
 def _as_datetime(val) -> datetime:
     if isinstance(val, datetime):
         return val
@@ -212,34 +340,6 @@ def _as_datetime(val) -> datetime:
         return datetime.now(timezone.utc)
 
 
-def _payment_is_fiat(payment: Payment) -> bool:
-    extra = payment.extra or {}
-    if payment.fiat_provider:
-        return True
-    if extra.get("paid_in_fiat"):
-        return True
-    if extra.get("fiat_payment_request"):
-        return True
-    return False
-
-
-def _should_skip_by_payment_type(payment: Payment, wallet_cfg: Wallets) -> bool:
-    raw_push_bitcoin = getattr(wallet_cfg, "push_bitcoin", True)
-    raw_push_fiat = getattr(wallet_cfg, "push_fiat", True)
-    push_bitcoin = True if raw_push_bitcoin is None else bool(raw_push_bitcoin)
-    push_fiat = True if raw_push_fiat is None else bool(raw_push_fiat)
-
-    if not push_bitcoin and not push_fiat:
-        return True
-
-    is_fiat = _payment_is_fiat(payment)
-    if is_fiat and not push_fiat:
-        return True
-    if not is_fiat and not push_bitcoin:
-        return True
-    return False
-
-
 def _is_unique_violation(exc: Exception) -> bool:
     msg = str(exc).lower()
     return "unique" in msg or "duplicate" in msg
@@ -248,227 +348,1108 @@ def _is_unique_violation(exc: Exception) -> bool:
 async def _should_skip_synced(payment: Payment, known_synced_hashes: set[str] | None) -> bool:
     if known_synced_hashes is not None:
         return payment.payment_hash in known_synced_hashes
-    existing = await get_synced_payment(payment.payment_hash)
-    return existing is not None
+    # Nearly every live payment is new; a filter miss is certain, and the reservation
+    # still settles any payment another worker reserved since the filter was loaded.
+    if not might_be_synced(payment.wallet_id, payment.payment_hash):
+        return False
+    existing = await get_synced_payment(payment.wallet_id, payment.payment_hash)
+    return existing is not None and existing.status != SYNC_STATUS_FAILED
 
 
-async def _reserve_synced_payment(
-    payment: Payment,
-    wallet_cfg: Wallets,
-    fiat_currency: str | None,
-    amount_major: float | None,
-) -> bool:
-    try:
-        await create_synced_payment(
-            wallet_cfg.user_id,
-            wallet_cfg.wallet,
-            payment.payment_hash,
-            None,
-            fiat_currency.upper() if fiat_currency else None,
-            amount_major,
-        )
-        return True
-    except Exception as exc:
-        if _is_unique_violation(exc):
-            logger.debug(f"Xero Sync: payment {payment.payment_hash} already reserved, skipping")
-            return False
-        raise
-
-
-async def _post_bank_transaction(access_token: str, tenant_id: str, payload: dict) -> httpx.Response:
-    async with httpx.AsyncClient() as client:
-        return await client.post(
-            f"{XERO_API_BASE}/BankTransactions",
-            json=payload,
-            headers={
-                "Authorization": f"Bearer {access_token}",
-                "xero-tenant-id": tenant_id,
-                "Accept": "application/json",
-                "Content-Type": "application/json",
-            },
-            timeout=10,
-        )
+# (index in the input batch, payment, BankTransaction payload, amount_major, currency)
+PreparedPayment = tuple[int, Payment, dict, float | None, str | None]
 
 
-def _parse_bank_transaction_id(resp: httpx.Response) -> str | None:
-    try:
-        body = resp.json()
-    except Exception:
-        return None
-    if not isinstance(body, dict):
-        return None
-    return body.get("BankTransactions", [{}])[0].get("BankTransactionID")
+class SyncSummary(TypedDict):
+    pushed: int
+    skipped: int
+    failed: int
+    errors: list[str]
 
 
-class SyncSummary(TypedDict):
+class AdminSyncProgress(TypedDict):
+    running: bool
+    started_at: str | None
+    finished_at: str | None
+    tenants: int
+    tenants_done: int
+    wallets: int
+    wallets_done: int
     pushed: int
     skipped: int
     failed: int
     errors: list[str]
 
 
-async def push_payment_to_xero(
-    payment: Payment,
-    conn,
+class SyncPlan(TypedDict):
+    scanned: int
+    would_push: int
+    skipped: int
+    skip_reasons: dict[str, int]
+    totals: dict[str, float]
+    spend_totals: dict[str, float]
+
+
+async def _build_payloads(
+    payments: list[Payment],
     wallet_cfg: Wallets,
     settings: ExtensionSettings,
+    fiat_snapshots: dict[str, FiatSnapshot],
+    semaphore: asyncio.Semaphore,
+) -> list[tuple[dict | None, float | None, str | None, str | None]]:
+    """
+    Build payloads for a page concurrently, at most `semaphore` fiat lookups at a time.
+    Returns one (payload, amount_major, currency, skip_reason) tuple per payment.
+    """
+
+    plan = get_push_plan(wallet_cfg, settings)
+
+    async def _build(payment: Payment) -> tuple[dict | None, float | None, str | None, str | None]:
+        if plan.skips_payment_type(payment):
+            return None, None, None, "payment type disabled"
+        async with semaphore:
+            try:
+                return await _build_bank_transaction_payload(
+                    payment, wallet_cfg, plan, fiat_snapshots.get(payment.payment_hash)
+                )
+            except Exception as exc:
+                logger.warning(f"Xero Sync: failed to build payload for {payment.payment_hash}: {exc}")
+                return None, None, None, PAYLOAD_ERROR
+
+    return await asyncio.gather(*(_build(payment) for payment in payments))
+
+
+async def _prepare_batch(
+    payments: list[Payment],
+    wallet_cfg: Wallets,
+    settings: ExtensionSettings,
+    known_synced_hashes: set[str] | None,
+    fiat_snapshots: dict[str, FiatSnapshot],
+    semaphore: asyncio.Semaphore,
+) -> tuple[list[dict], list[PreparedPayment]]:
+    """
+    Pipeline stage 1: drop already synced payments and build payloads concurrently.
+    Nothing is written. Returns (results, prepared); `results` holds the skips so far.
+    """
+    results: list[dict] = [{} for _ in payments]
+    candidates: list[tuple[int, Payment]] = []
+    with span("dedup"):
+        for index, payment in enumerate(payments):
+            if await _should_skip_synced(payment, known_synced_hashes):
+                results[index] = {"status": "skip", "reason": "already synced"}
+            else:
+                candidates.append((index, payment))
+
+    with span("fiat_conversion"):
+        built = await _build_payloads(
+            [payment for _, payment in candidates], wallet_cfg, settings, fiat_snapshots, semaphore
+        )
+    prepared: list[PreparedPayment] = []
+    for (index, payment), (bank_tx, amount_major, fiat_currency, skip_reason) in zip(candidates, built, strict=True):
+        if skip_reason == PAYLOAD_ERROR:
+            results[index] = {"status": "error", "reason": skip_reason}
+            continue
+        if skip_reason or not bank_tx:
+            logger.debug(f"Xero Sync: skipping payment {payment.payment_hash} ({skip_reason})")
+            results[index] = {"status": "skip", "reason": skip_reason or "no payload"}
+            continue
+        prepared.append((index, payment, bank_tx, amount_major, fiat_currency))
+    return results, prepared
+
+
+async def _post_prepared_batch(
+    results: list[dict],
+    prepared: list[PreparedPayment],
+    wallet_cfg: Wallets,
     access_token: str,
     tenant_id: str,
-    known_synced_hashes: set[str] | None = None,
-) -> dict:
+    known_synced_hashes: set[str] | None,
+) -> list[dict]:
     """
-    Push a single payment to Xero, guarding against duplicates.
-    Returns a dict with status: ok | skip | error and optional message/id.
+    Pipeline stages 2 and 3: reserve the whole batch at once, then post it in rate-limited batches.
     """
-    if await _should_skip_synced(payment, known_synced_hashes):
-        return {"status": "skip", "reason": "already synced"}
-    if _should_skip_by_payment_type(payment, wallet_cfg):
-        return {"status": "skip", "reason": "payment type disabled"}
+    if push_drain.closed:
+        for index, *_ in prepared:
+            results[index] = {"status": "error", "reason": "shutting down", "retryable": True}
+        return results
+    with push_drain.track():
+        return await _reserve_and_post(results, prepared, wallet_cfg, access_token, tenant_id, known_synced_hashes)
 
-    bank_tx, amount_major, fiat_currency, skip_reason = await _build_bank_transaction_payload(
-        payment, wallet_cfg, settings
-    )
-    if skip_reason:
-        logger.debug(f"Xero Sync: skipping payment {payment.payment_hash} ({skip_reason})")
-        return {"status": "skip", "reason": skip_reason}
 
-    reserved = await _reserve_synced_payment(payment, wallet_cfg, fiat_currency, amount_major)
-    if not reserved:
-        return {"status": "skip", "reason": "already synced"}
+async def _reserve_and_post(
+    results: list[dict],
+    prepared: list[PreparedPayment],
+    wallet_cfg: Wallets,
+    access_token: str,
+    tenant_id: str,
+    known_synced_hashes: set[str] | None,
+) -> list[dict]:
+    with span("reserve"):
+        hashes = [payment.payment_hash for _, payment, *_ in prepared]
+        retried = await get_failed_synced_payment_hashes(wallet_cfg.wallet, hashes)
+        reserved = await reserve_synced_payments(
+            wallet_cfg.user_id,
+            wallet_cfg.wallet,
+            [
+                (
+                    payment.payment_hash,
+                    fiat_currency.upper() if fiat_currency else None,
+                    amount_major,
+                    _as_datetime(payment.time),
+                )
+                for _, payment, _, amount_major, fiat_currency in prepared
+            ],
+            PUSH_LEASE,
+        )
+    record_synced(wallet_cfg.wallet, reserved)
+    to_post: list[PreparedPayment] = []
+    for item in prepared:
+        index, payment = item[0], item[1]
+        if payment.payment_hash not in reserved:
+            logger.debug(f"Xero Sync: payment {payment.payment_hash} already reserved, skipping")
+            results[index] = {"status": "skip", "reason": "already synced"}
+            continue
+        if known_synced_hashes is not None:
+            known_synced_hashes.add(payment.payment_hash)
+        to_post.append(item)
+
+    if not to_post:
+        return results
+
+    async with _keep_leased(wallet_cfg.wallet, [item[1].payment_hash for item in to_post]):
+        with span("contacts"):
+            await apply_contact_ids(access_token, tenant_id, [item[2] for item in to_post])
+        bank_items = [item for item in to_post if not is_invoice_payload(item[2])]
+        invoice_items = [item for item in to_post if is_invoice_payload(item[2])]
+        post_results: dict[int, dict] = {}
+        with span("xero_post"):
+            if bank_items:
+                keys = {
+                    item[1].payment_hash: idempotency_key(wallet_cfg.wallet, item[1].payment_hash)
+                    for item in bank_items
+                }
+                bank_results = await post_bank_transactions(
+                    access_token,
+                    tenant_id,
+                    [item[2] for item in bank_items],
+                    list(keys.values()),
+                    {key for payment_hash, key in keys.items() if payment_hash in retried},
+                )
+                post_results.update(zip((item[0] for item in bank_items), bank_results, strict=True))
+            if invoice_items:
+                post_results.update(
+                    await _post_invoices_with_payments(invoice_items, wallet_cfg, access_token, tenant_id, retried)
+                )
+        with span("update"):
+            for index, payment, _, amount_major, fiat_currency in to_post:
+                results[index] = await _finalize_pushed_payment(
+                    payment, post_results[index], amount_major, fiat_currency
+                )
+    return results
+
 
-    if known_synced_hashes is not None:
-        known_synced_hashes.add(payment.payment_hash)
+@asynccontextmanager
+async def _keep_leased(wallet_id: str, payment_hashes: list[str]) -> AsyncIterator[None]:
+    """
+    Renew the lease of the reservations being posted until the block ends.
+    """
 
-    payload = {"BankTransactions": [bank_tx]}
+    async def _renew() -> None:
+        while True:
+            await asyncio.sleep(PUSH_LEASE_RENEWAL.total_seconds())
+            try:
+                await extend_synced_payment_leases(wallet_id, payment_hashes, PUSH_LEASE)
+            except Exception as e:
+                logger.warning(f"Xero Sync: could not renew the lease of {len(payment_hashes)} reservation(s): {e}")
 
+    renewal = asyncio.create_task(_renew())
     try:
-        resp = await _post_bank_transaction(access_token, tenant_id, payload)
-    except Exception:
-        await delete_synced_payment(payment.payment_hash)
-        raise
+        yield
+    finally:
+        renewal.cancel()
 
-    if resp.status_code >= 300:
-        await delete_synced_payment(payment.payment_hash)
+
+async def _post_invoices_with_payments(
+    items: list[PreparedPayment],
+    wallet_cfg: Wallets,
+    access_token: str,
+    tenant_id: str,
+    retried: set[str] | None = None,
+) -> dict[int, dict]:
+    """
+    Invoice mode: post the sales invoices in batches, then one full Payment per invoice in batches,
+    so a page of sales costs two batched calls rather than two calls per sale.
+    Invoices left unpaid by an earlier failure are paid without being created again.
+    Returns results by index in the input batch.
+    """
+    results: dict[int, dict] = {}
+    states = await get_invoice_push_states(wallet_cfg.wallet, [item[1].payment_hash for item in items])
+    invoice_ids = {payment_hash: state[0] for payment_hash, state in states.items() if state[0]}
+
+    def key(payment_hash: str, kind: str) -> str:
+        # A re-push must not be answered with Xero's stored response to the voided original.
+        repushes = states.get(payment_hash, (None, 0))[1]
+        revision = [str(repushes)] if repushes else []
+        return idempotency_key(wallet_cfg.wallet, payment_hash, kind, *revision)
+
+    new_items = [item for item in items if item[1].payment_hash not in invoice_ids]
+    if new_items:
+        invoice_results = await post_invoices(
+            access_token,
+            tenant_id,
+            [item[2] for item in new_items],
+            [key(item[1].payment_hash, "invoice") for item in new_items],
+            {key(item[1].payment_hash, "invoice") for item in new_items if item[1].payment_hash in (retried or ())},
+        )
+        for (index, payment, *_), result in zip(new_items, invoice_results, strict=True):
+            if result["status"] != "ok":
+                results[index] = result
+                continue
+            invoice_ids[payment.payment_hash] = result["invoice_id"]
+            await set_synced_payment_invoice(wallet_cfg.wallet, payment.payment_hash, result["invoice_id"])
+
+    to_pay = [item for item in items if item[1].payment_hash in invoice_ids]
+    if not to_pay:
+        return results
+    payments = []
+    for _, payment, invoice, amount_major, _ in to_pay:
+        xero_payment = {
+            "Invoice": {"InvoiceID": invoice_ids[payment.payment_hash]},
+            "Account": {"AccountID": wallet_cfg.xero_bank_account_id},
+            "Date": invoice["Date"],
+            "Amount": amount_major,
+            "Reference": invoice["Reference"],
+        }
+        if wallet_cfg.auto_reconcile:
+            xero_payment["IsReconciled"] = True
+        payments.append(xero_payment)
+    payment_results = await post_payments(
+        access_token,
+        tenant_id,
+        payments,
+        [key(item[1].payment_hash, "payment") for item in to_pay],
+        {key(item[1].payment_hash, "payment") for item in to_pay if item[1].payment_hash in (retried or ())},
+    )
+    for (index, payment, *_), result in zip(to_pay, payment_results, strict=True):
+        results[index] = {**result, "invoice_id": invoice_ids[payment.payment_hash]}
+    return results
+
+
+async def _finalize_pushed_payment(
+    payment: Payment,
+    result: dict,
+    amount_major: float | None,
+    fiat_currency: str | None,
+) -> dict:
+    if result["status"] != "ok" and result.get("uncertain"):
+        # Xero may have booked it: posting it again would take a new key. The reservation is
+        # kept for the orphaned reservation recovery to check against Xero.
+        logger.warning(
+            f"Xero Sync: outcome of push of {payment.payment_hash} unknown ({result.get('reason')}), "
+            f"leaving it to be checked against Xero"
+        )
+        return {"status": "error", "reason": f"{result.get('reason')} (to be checked against Xero)"}
+    if result["status"] != "ok":
+        await mark_synced_payments_failed(payment.wallet_id, [payment.payment_hash])
         logger.error(
             f"Xero Sync: failed to create bank transaction for wallet "
-            f"{payment.wallet_id} ({resp.status_code}): {resp.text}"
+            f"{payment.wallet_id} ({result.get('code')}): {result.get('reason')}"
         )
-        return {"status": "error", "reason": resp.text, "code": resp.status_code}
-
-    bank_tx_id = _parse_bank_transaction_id(resp)
+        return result
 
+    ids = {key: result[key] for key in ("bank_transaction_id", "invoice_id", "payment_id") if key in result}
     await update_synced_payment(
+        payment.wallet_id,
         payment.payment_hash,
-        bank_tx_id,
+        ids.get("bank_transaction_id"),
         fiat_currency.upper() if fiat_currency else None,
         amount_major,
+        ids.get("invoice_id"),
+        ids.get("payment_id"),
     )
 
     logger.debug(
-        f"Xero Sync: created Xero BankTransaction for payment {payment.payment_hash} "
-        f"{amount_major} {fiat_currency.upper() if fiat_currency else ''}"
+        f"Xero Sync: created Xero {'invoice and payment' if 'invoice_id' in ids else 'BankTransaction'} "
+        f"for payment {payment.payment_hash} {amount_major} {fiat_currency.upper() if fiat_currency else ''}"
     )
-    return {"status": "ok", "bank_transaction_id": bank_tx_id}
-
+    return {"status": "ok", **ids}
 
-async def payment_received_for_client_data(payment: Payment, conn, wallet_cfg) -> bool:
-    # Load Xero app settings (client id/secret) for this user
-    settings = await get_settings(wallet_cfg.user_id)
-    access_token, tenant_id = await ensure_xero_access_token(conn, settings)
 
-    result = await push_payment_to_xero(
-        payment,
-        conn,
+async def push_payments_to_xero(
+    payments: list[Payment],
+    wallet_cfg: Wallets,
+    settings: ExtensionSettings,
+    access_token: str,
+    tenant_id: str,
+    known_synced_hashes: set[str] | None = None,
+    fiat_snapshots: dict[str, FiatSnapshot] | None = None,
+) -> list[dict]:
+    """
+    Push payments (both directions) to Xero in batched, rate-limited calls, guarding against duplicates.
+    Returns one dict per payment with status: ok | skip | error and optional reason/id.
+    """
+    results, prepared = await _prepare_batch(
+        payments,
         wallet_cfg,
         settings,
-        access_token,
-        tenant_id,
+        known_synced_hashes,
+        fiat_snapshots or {},
+        asyncio.Semaphore(PAYLOAD_CONCURRENCY),
     )
+    return await _post_prepared_batch(results, prepared, wallet_cfg, access_token, tenant_id, known_synced_hashes)
 
-    if result["status"] == "ok":
-        wallet_cfg.last_synced = _as_datetime(getattr(payment, "time", None))
-        wallet_cfg.status = f"Auto-synced payment {payment.payment_hash}"
-        await update_wallets(wallet_cfg)
-        return True
-
-    if result["status"] == "skip":
-        return True
 
-    return False
+async def push_payment_to_xero(
+    payment: Payment,
+    conn,
+    wallet_cfg: Wallets,
+    settings: ExtensionSettings,
+    access_token: str,
+    tenant_id: str,
+    known_synced_hashes: set[str] | None = None,
+) -> dict:
+    """
+    Push a single payment to Xero, guarding against duplicates.
+    Returns a dict with status: ok | skip | error and optional message/id.
+    """
+    with push_trace("push_payment_to_xero", wallet=wallet_cfg.wallet, payment_hash=payment.payment_hash):
+        results = await push_payments_to_xero(
+            [payment], wallet_cfg, settings, access_token, tenant_id, known_synced_hashes
+        )
+    return results[0]
 
 
-async def sync_wallet_payments(wallet_cfg: Wallets, start_date: date | None = None) -> SyncSummary:
+async def payments_received_for_client_data(
+    payments: list[Payment],
+    conn,
+    wallet_cfg: Wallets,
+    fiat_snapshots: dict[str, FiatSnapshot] | None = None,
+) -> bool:
     """
-    Push all current successful incoming payments for a wallet to Xero.
+    Push a batch of live payments for one wallet. Returns False if any push failed.
+    While the tenant's circuit is open, and for failures that may clear on their own,
+    the payments are deferred and pushed later by the deferred-payment drain.
     """
-    conn = await get_xero_connection(wallet_cfg.user_id)
-    if not conn:
-        raise RuntimeError("Xero Sync: no Xero connection for this user.")
+    with push_trace("push", wallet=wallet_cfg.wallet, payments=len(payments)):
+        return await _push_live_payments(payments, conn, wallet_cfg, fiat_snapshots)
 
-    settings = await get_settings(wallet_cfg.user_id)
-    access_token, tenant_id = await ensure_xero_access_token(conn, settings)
 
-    synced_hashes = await get_synced_payment_hashes(wallet_cfg.wallet)
-    summary: SyncSummary = {"pushed": 0, "skipped": 0, "failed": 0, "errors": []}
+async def _push_live_payments(
+    payments: list[Payment],
+    conn,
+    wallet_cfg: Wallets,
+    fiat_snapshots: dict[str, FiatSnapshot] | None,
+) -> bool:
+    if get_circuit_breaker(conn.tenant_id).is_open:
+        await _defer(wallet_cfg, payments, "circuit open")
+        return False
+
+    # Load Xero app settings (client id/secret) for this user
+    with span("settings"):
+        settings = await get_settings(wallet_cfg.user_id)
+    try:
+        with span("token"):
+            access_token, tenant_id = await ensure_xero_access_token(conn, settings)
+    except XeroCircuitOpenError:
+        await _defer(wallet_cfg, payments, "circuit open")
+        return False
+
+    if fiat_snapshots is None:
+        with span("fiat_snapshots"):
+            fiat_snapshots = await capture_fiat_snapshots(payments, wallet_cfg)
+    results = await push_payments_to_xero(
+        payments, wallet_cfg, settings, access_token, tenant_id, fiat_snapshots=fiat_snapshots
+    )
+    retry = [payment for payment, result in zip(payments, results, strict=True) if result.get("retryable")]
+    if retry:
+        await _defer(wallet_cfg, retry, next(r["reason"] for r in results if r.get("retryable")))
+
+    pushed = [payment for payment, result in zip(payments, results, strict=True) if result["status"] == "ok"]
+    if pushed:
+        last = pushed[-1]
+        wallet_cfg.last_synced = _as_datetime(getattr(last, "time", None))
+        wallet_cfg.status = f"Auto-synced payment {last.payment_hash}"
+        with span("update"):
+            await update_wallets(wallet_cfg)
+
+    return all(result["status"] in ("ok", "skip") for result in results)
+
 
-    page_size = 1000
+async def payment_received_for_client_data(payment: Payment, conn, wallet_cfg) -> bool:
+    return await payments_received_for_client_data([payment], conn, wallet_cfg)
+
+
+async def _defer(wallet_cfg: Wallets, payments: list[Payment], reason: str) -> None:
+    logger.info(f"Xero Sync: deferring {len(payments)} payment(s) for wallet {wallet_cfg.wallet}: {reason}")
+    await defer_payments(wallet_cfg.user_id, wallet_cfg.wallet, [p.payment_hash for p in payments], reason)
+
+
+async def push_deferred_payments(conn, limit: int) -> bool:
+    """
+    Retry up to `limit` deferred payments for the connection's user, oldest first, leasing them
+    so other workers draining the same user take different ones.
+    While the circuit is half-open the first push is the probe; payments that still
+    cannot be pushed are deferred again. Returns True if every retried payment went through.
+    """
+    if get_circuit_breaker(conn.tenant_id).is_open:
+        return False
+    token, deferred = await claim_deferred_payments(conn.user_id, limit, DEFERRED_LEASE)
+    if not deferred:
+        return False
+    # Left claimed if the push is cut off, so another worker retries them once the lease runs out.
+    ok = await _push_claimed_payments(conn, deferred)
+    await delete_claimed_deferred_payments(token)
+    return ok
+
+
+async def _push_claimed_payments(conn, deferred: list[DeferredPayment]) -> bool:
+    by_wallet: dict[str, list[Payment]] = {}
+    for entry in deferred:
+        payment = await get_standalone_payment(entry.payment_hash, wallet_id=entry.wallet_id)
+        if payment:
+            by_wallet.setdefault(entry.wallet_id, []).append(payment)
+
+    ok = True
+    for wallet_id, payments in by_wallet.items():
+        wallet_cfg = await get_mapped_wallet(wallet_id)
+        if not wallet_cfg or not wallet_cfg.push_payments:
+            continue
+        try:
+            ok = await payments_received_for_client_data(payments, conn, wallet_cfg) and ok
+        except Exception as e:
+            ok = False
+            await _defer(wallet_cfg, payments, str(e))
+    return ok
+
+
+def _tally(summary: SyncSummary, results: list[dict]) -> None:
+    for result in results:
+        if result["status"] == "ok":
+            summary["pushed"] += 1
+        elif result["status"] == "skip":
+            summary["skipped"] += 1
+        else:
+            summary["failed"] += 1
+            summary["errors"].append(result.get("reason") or "unknown error")
+
+
+async def _iter_payment_pages(
+    wallet_cfg: Wallets, since: int | None, outgoing_only: bool = False, until: datetime | None = None
+) -> AsyncIterator[list[Payment]]:
+    """
+    Stream the wallet's settled payments after `since` (and up to `until`), oldest first, one page at a time.
+    """
+    # Outgoing payments are only needed when they are pushed or carry fees to book.
+    incoming_only = not outgoing_only and not (wallet_cfg.push_outgoing or wallet_cfg.fee_handling)
+    time_filters = [Filter.parse_query("time[le]", [until], PaymentFilters)] if until else []
     offset = 0
-    since = None
-    if start_date:
-        start_datetime = datetime.combine(start_date, time.min, tzinfo=timezone.utc)
-        since = int(start_datetime.timestamp()) - 1
     while True:
-        filters = Filters(limit=page_size, offset=offset, sortby="time", direction="asc")
+        filters = Filters(
+            filters=time_filters,
+            limit=SYNC_PAGE_SIZE,
+            offset=offset,
+            sortby="time",
+            direction="asc",
+            model=PaymentFilters,
+        )
         page = await get_payments_paginated(
             wallet_id=wallet_cfg.wallet,
-            incoming=True,
+            incoming=incoming_only,
+            outgoing=outgoing_only,
             complete=True,
             since=since,
             filters=filters,
         )
         if not page.data:
-            break
+            return
+        yield page.data
+        offset += SYNC_PAGE_SIZE
+        if offset >= page.total:
+            return
 
-        for pay in page.data:
-            try:
-                result = await push_payment_to_xero(
-                    pay,
-                    conn,
-                    wallet_cfg,
-                    settings,
-                    access_token,
-                    tenant_id,
-                    known_synced_hashes=synced_hashes,
+
+def _start_date_to_since(start_date: date | None) -> int | None:
+    if not start_date:
+        return None
+    start_datetime = datetime.combine(start_date, time.min, tzinfo=timezone.utc)
+    return int(start_datetime.timestamp()) - 1
+
+
+async def _clamp_to_horizon(wallet_cfg: Wallets, since: int | None) -> tuple[int | None, datetime | None]:
+    """
+    Payments made before the wallet's compaction horizon may have no per-payment row left to
+    de-duplicate against, so a sync never reaches back past it. Returns (since, horizon if it clamped).
+    """
+    horizon = await get_compaction_horizon(wallet_cfg.wallet)
+    if not horizon:
+        return since, None
+    # Payments are listed after `since`; rounding up keeps a fractional horizon exclusive.
+    horizon_since = math.ceil(horizon.timestamp()) - 1
+    if since is not None and since >= horizon_since:
+        return since, None
+    return horizon_since, horizon
+
+
+async def _sync_payment_history(
+    wallet_cfg: Wallets,
+    settings: ExtensionSettings,
+    access_token: str,
+    tenant_id: str,
+    since: int | None,
+    outgoing_only: bool = False,
+    until: datetime | None = None,
+    synced_hashes: set[str] | None = None,
+    fee_hashes: set[str] | None = None,
+    push_fees: bool = True,
+) -> SyncSummary:
+    """
+    Page through the wallet's settled payments in (`since`, `until`], record routing fees and
+    push them through a pipeline: a producer fetches and prices page N+1 (fiat resolved
+    concurrently) while the consumer reserves and posts page N.
+    Pass the known hash sets to share them between concurrent partitions.
+    """
+    if synced_hashes is None:
+        synced_hashes = await get_synced_payment_hashes(wallet_cfg.wallet)
+    if fee_hashes is None:
+        fee_hashes = await get_fee_entry_hashes(wallet_cfg.wallet) if wallet_cfg.fee_handling else set()
+    summary: SyncSummary = {"pushed": 0, "skipped": 0, "failed": 0, "errors": []}
+    semaphore = asyncio.Semaphore(PAYLOAD_CONCURRENCY)
+    prepared_pages: asyncio.Queue[tuple[list[dict], list[PreparedPayment]] | None] = asyncio.Queue(
+        maxsize=PIPELINE_DEPTH
+    )
+
+    async def _produce() -> None:
+        try:
+            async for payments in _iter_payment_pages(wallet_cfg, since, outgoing_only, until):
+                if outgoing_only:
+                    # The sweep is the first time outgoing payments are seen: snapshot them now.
+                    snapshots = await capture_fiat_snapshots(payments, wallet_cfg)
+                else:
+                    snapshots = await get_fiat_snapshots(wallet_cfg.wallet, [pay.payment_hash for pay in payments])
+                if wallet_cfg.fee_handling:
+                    await _record_fees(payments, wallet_cfg, fee_hashes, snapshots)
+                await prepared_pages.put(
+                    await _prepare_batch(payments, wallet_cfg, settings, synced_hashes, snapshots, semaphore)
                 )
-            except Exception as exc:  # keep iterating on errors
-                logger.error(f"Xero Sync: failed to push payment {pay.payment_hash}: {exc}")
-                summary["failed"] += 1
-                summary["errors"].append(str(exc))
-                continue
+        finally:
+            await prepared_pages.put(None)
 
-            if result["status"] == "ok":
-                summary["pushed"] += 1
-            elif result["status"] == "skip":
-                summary["skipped"] += 1
-            else:
-                summary["failed"] += 1
-                summary["errors"].append(result.get("reason") or "unknown error")
+    producer = asyncio.create_task(_produce())
+    try:
+        while (prepared_page := await prepared_pages.get()) is not None:
+            results, prepared = prepared_page
+            _tally(
+                summary,
+                await _post_prepared_batch(results, prepared, wallet_cfg, access_token, tenant_id, synced_hashes),
+            )
+        await producer
+    finally:
+        producer.cancel()
+
+    if push_fees:
+        await _push_fees_into_summary(wallet_cfg, access_token, tenant_id, summary)
+    return summary
+
+
+async def _push_fees_into_summary(wallet_cfg: Wallets, access_token: str, tenant_id: str, summary: SyncSummary) -> None:
+    if not wallet_cfg.fee_handling:
+        return
+    try:
+        await push_wallet_fees(wallet_cfg, access_token, tenant_id)
+    except Exception as exc:
+        logger.error(f"Xero Sync: failed to push routing fees for wallet {wallet_cfg.wallet}: {exc}")
+        summary["errors"].append(str(exc))
+
+
+def _timestamp(val: datetime | None) -> int | None:
+    return int(val.timestamp()) if val else None
 
-        offset += page_size
-        if offset >= page.total:
-            break
+
+def _partition_bounds(
+    starts_after: datetime | None, first_payment: datetime, now: datetime
+) -> list[tuple[datetime | None, datetime | None]]:
+    """
+    Consecutive (starts_after, ends_at] ranges of BACKFILL_PARTITION_SPAN from the first payment;
+    the last one is open-ended.
+    """
+    bounds: list[tuple[datetime | None, datetime | None]] = []
+    lower = starts_after
+    edge = first_payment.replace(microsecond=0) + BACKFILL_PARTITION_SPAN
+    while edge < now:
+        bounds.append((lower, edge))
+        lower = edge
+        edge += BACKFILL_PARTITION_SPAN
+    bounds.append((lower, None))
+    return bounds
+
+
+async def _get_or_create_sync_job(wallet_cfg: Wallets, since: int | None) -> tuple[SyncJob, list[SyncPartition]]:
+    """
+    Resume the wallet's unfinished sync job for the same start, or plan a new one.
+    A resumed job syncs its open-ended last partition again, for payments settled since it was planned.
+    """
+    job = await get_running_sync_job(wallet_cfg.wallet)
+    if job and _timestamp(job.starts_after) == since:
+        await reopen_sync_job_tail(job.id)
+        return job, await get_unfinished_sync_partitions(job.id)
+    if job:
+        job.status = SYNC_JOB_SUPERSEDED
+        await update_sync_job(job)
+
+    starts_after = datetime.fromtimestamp(since, timezone.utc) if since is not None else None
+    job = SyncJob(
+        id=urlsafe_short_hash(), user_id=wallet_cfg.user_id, wallet_id=wallet_cfg.wallet, starts_after=starts_after
+    )
+    first = await get_payments_paginated(
+        wallet_id=wallet_cfg.wallet,
+        complete=True,
+        since=since,
+        filters=Filters(limit=1, sortby="time", direction="asc", model=PaymentFilters),
+    )
+    partitions = []
+    if first.data:
+        bounds = _partition_bounds(starts_after, _as_datetime(first.data[0].time), datetime.now(timezone.utc))
+        partitions = [
+            SyncPartition(id=urlsafe_short_hash(), job_id=job.id, starts_after=lower, ends_at=upper)
+            for lower, upper in bounds
+        ]
+    try:
+        await create_sync_job(job, partitions)
+    except Exception as exc:
+        if not _is_unique_violation(exc):
+            raise
+        # Another worker planned this wallet's sync at the same moment; join it instead.
+        await delete_sync_partitions(job.id)
+        running = await get_running_sync_job(wallet_cfg.wallet)
+        if not running:
+            raise
+        return running, await get_unfinished_sync_partitions(running.id)
+    return job, partitions
+
+
+async def _run_sync_job(
+    wallet_cfg: Wallets,
+    settings: ExtensionSettings,
+    access_token: str,
+    tenant_id: str,
+    job: SyncJob,
+    partitions: list[SyncPartition],
+) -> tuple[SyncSummary, int]:
+    """
+    Sync the job's partitions concurrently, checkpointing each as it finishes.
+    Partitions are leased one at a time, so workers running the same job split them
+    instead of syncing them twice; each is tried at most once per run.
+    Returns the summary and the number of partitions left for a later resume.
+    """
+    summary: SyncSummary = {"pushed": 0, "skipped": 0, "failed": 0, "errors": []}
+    synced_hashes = await get_synced_payment_hashes(wallet_cfg.wallet)
+    fee_hashes = await get_fee_entry_hashes(wallet_cfg.wallet) if wallet_cfg.fee_handling else set()
+    untried = {partition.id for partition in partitions}
+
+    async def _run_partitions() -> None:
+        while True:
+            partition = await claim_sync_partition(job.id, sorted(untried), PARTITION_LEASE)
+            if not partition:
+                return
+            untried.discard(partition.id)
+            await _run_partition(partition)
+
+    async def _run_partition(partition: SyncPartition) -> None:
+        try:
+            result = await _sync_payment_history(
+                wallet_cfg,
+                settings,
+                access_token,
+                tenant_id,
+                _timestamp(partition.starts_after),
+                until=partition.ends_at,
+                synced_hashes=synced_hashes,
+                fee_hashes=fee_hashes,
+                push_fees=False,
+            )
+        except Exception as exc:
+            logger.error(f"Xero Sync: sync partition {partition.id} of job {job.id} failed: {exc}")
+            result = {"pushed": 0, "skipped": 0, "failed": 0, "errors": [str(exc)]}
+        # Partitions with failures are retried on resume, up to PARTITION_MAX_ATTEMPTS runs;
+        # failed rows are free to be reclaimed by a later sync either way.
+        partition.attempts += 1
+        partition.status = PARTITION_FAILED if result["failed"] or result["errors"] else PARTITION_DONE
+        partition.pushed += result["pushed"]
+        partition.skipped += result["skipped"]
+        partition.failed = result["failed"]
+        partition.error = "; ".join(result["errors"])[:500] or None
+        if partition.status == PARTITION_FAILED and partition.attempts >= PARTITION_MAX_ATTEMPTS:
+            logger.warning(
+                f"Xero Sync: giving up on sync partition {partition.id} of job {job.id} "
+                f"after {partition.attempts} attempts: {partition.error or f'{partition.failed} failed'}"
+            )
+            partition.status = PARTITION_ABANDONED
+        await update_sync_partition(partition)
+        for key in ("pushed", "skipped", "failed"):
+            summary[key] += result[key]
+        summary["errors"].extend(result["errors"])
+
+    await asyncio.gather(*(_run_partitions() for _ in range(BACKFILL_CONCURRENCY)))
+    # Includes partitions other workers are still syncing; the last one to finish closes the job.
+    left = len(await get_unfinished_sync_partitions(job.id))
+    if not left:
+        job.status = SYNC_JOB_DONE
+    await update_sync_job(job)
+
+    await _push_fees_into_summary(wallet_cfg, access_token, tenant_id, summary)
+    return summary, left
+
+
+async def sync_wallet_payments(wallet_cfg: Wallets, start_date: date | None = None) -> SyncSummary:
+    """
+    Push all current successful payments for a wallet to Xero.
+    The history is synced in date partitions; an interrupted sync with the same
+    start date resumes with the partitions that did not finish.
+    """
+    conn = await get_xero_connection(wallet_cfg.user_id)
+    if not conn:
+        raise RuntimeError("Xero Sync: no Xero connection for this user.")
+
+    settings = await get_settings(wallet_cfg.user_id)
+    access_token, tenant_id = await ensure_xero_access_token(conn, settings)
+
+    since, horizon = await _clamp_to_horizon(wallet_cfg, _start_date_to_since(start_date))
+    job, partitions = await _get_or_create_sync_job(wallet_cfg, since)
+    summary, left = await _run_sync_job(wallet_cfg, settings, access_token, tenant_id, job, partitions)
 
     now = datetime.now(timezone.utc)
     wallet_cfg.last_synced = now
     start_note = f" from {start_date.isoformat()}" if start_date else ""
+    if horizon:
+        start_note = f" from {horizon.date().isoformat()} (older history is compacted)"
+    left_note = f", {left} partition(s) left, push again to resume" if left else ""
     wallet_cfg.status = (
         f"Synced {summary['pushed']}{start_note} (skipped {summary['skipped']}, "
-        f"errors {summary['failed']}) at {now.isoformat()}"
+        f"errors {summary['failed']}{left_note}) at {now.isoformat()}"
     )
     await update_wallets(wallet_cfg)
     return summary
 
 
+def _idle_admin_sync() -> AdminSyncProgress:
+    return {
+        "running": False,
+        "started_at": None,
+        "finished_at": None,
+        "tenants": 0,
+        "tenants_done": 0,
+        "wallets": 0,
+        "wallets_done": 0,
+        "pushed": 0,
+        "skipped": 0,
+        "failed": 0,
+        "errors": [],
+    }
+
+
+_admin_sync: AdminSyncProgress = _idle_admin_sync()
+_admin_sync_task: asyncio.Task | None = None
+
+
+def get_admin_sync_progress() -> AdminSyncProgress:
+    return {**_admin_sync, "errors": list(_admin_sync["errors"])}
+
+
+def start_admin_sync() -> AdminSyncProgress:
+    """
+    Start syncing every wallet with auto-push enabled, across all users, in the background.
+    """
+    global _admin_sync, _admin_sync_task
+    if _admin_sync["running"]:
+        raise RuntimeError("Xero Sync: a sync of all wallets is already running.")
+    _admin_sync = _idle_admin_sync()
+    _admin_sync["running"] = True
+    _admin_sync["started_at"] = datetime.now(timezone.utc).isoformat()
+    _admin_sync_task = asyncio.create_task(_sync_all_wallets(_admin_sync))
+    return get_admin_sync_progress()
+
+
+async def _sync_all_wallets(progress: AdminSyncProgress) -> None:
+    """
+    Tenants (one Xero connection per user) are synced concurrently, their wallets one after
+    another, so each tenant's calls stay within its own rate limit.
+    """
+    try:
+        by_user: dict[str, list[Wallets]] = {}
+        for wallet_cfg in await get_push_wallets():
+            by_user.setdefault(wallet_cfg.user_id, []).append(wallet_cfg)
+        progress["tenants"] = len(by_user)
+        progress["wallets"] = sum(len(wallets) for wallets in by_user.values())
+        semaphore = asyncio.Semaphore(ADMIN_SYNC_CONCURRENCY)
+
+        async def _sync_tenant(wallets: list[Wallets]) -> None:
+            async with semaphore:
+                for wallet_cfg in wallets:
+                    try:
+                        summary = await sync_wallet_payments(wallet_cfg)
+                        errors = summary["errors"]
+                        progress["pushed"] += summary["pushed"]
+                        progress["skipped"] += summary["skipped"]
+                        progress["failed"] += summary["failed"]
+                    except Exception as exc:
+                        errors = [str(exc)]
+                    room = ADMIN_SYNC_MAX_ERRORS - len(progress["errors"])
+                    progress["errors"].extend(f"{wallet_cfg.wallet}: {error}" for error in errors[:room])
+                    progress["wallets_done"] += 1
+            progress["tenants_done"] += 1
+
+        await asyncio.gather(*(_sync_tenant(wallets) for wallets in by_user.values()))
+    except Exception as exc:
+        logger.error(f"Xero Sync: sync of all wallets failed: {exc}")
+        progress["errors"].append(str(exc))
+    finally:
+        progress["running"] = False
+        progress["finished_at"] = datetime.now(timezone.utc).isoformat()
+        logger.info(
+            f"Xero Sync: synced {progress['wallets_done']} wallet(s) of {progress['tenants']} tenant(s): "
+            f"pushed {progress['pushed']}, skipped {progress['skipped']}, failed {progress['failed']}"
+        )
+
+
+async def sync_outgoing_payments(wallet_cfg: Wallets, since: int | None = None) -> SyncSummary | None:
+    """
+    Push recent outgoing payments and routing fees for a wallet.
+    Outgoing payments are not delivered to invoice listeners, so they are swept from history.
+    """
+    conn = await get_xero_connection(wallet_cfg.user_id)
+    if not conn:
+        return None
+    settings = await get_settings(wallet_cfg.user_id)
+    access_token, tenant_id = await ensure_xero_access_token(conn, settings)
+    return await _sync_payment_history(wallet_cfg, settings, access_token, tenant_id, since, outgoing_only=True)
+
+
+async def plan_wallet_sync(wallet_cfg: Wallets, start_date: date | None = None) -> SyncPlan:
+    """
+    Dry run of `sync_wallet_payments`: build every payload without reserving or posting.
+    Only aggregates are kept, so memory stays bounded regardless of history size.
+    """
+    settings = await get_settings(wallet_cfg.user_id)
+    synced_hashes = await get_synced_payment_hashes(wallet_cfg.wallet)
+    semaphore = asyncio.Semaphore(PAYLOAD_CONCURRENCY)
+    plan: SyncPlan = {
+        "scanned": 0,
+        "would_push": 0,
+        "skipped": 0,
+        "skip_reasons": {},
+        "totals": {},
+        "spend_totals": {},
+    }
+
+    since, _ = await _clamp_to_horizon(wallet_cfg, _start_date_to_since(start_date))
+    async for payments in _iter_payment_pages(wallet_cfg, since):
+        plan["scanned"] += len(payments)
+        pending = []
+        for payment in payments:
+            if payment.payment_hash in synced_hashes:
+                _count_skip(plan, "already synced")
+            else:
+                pending.append(payment)
+        snapshots = await get_fiat_snapshots(wallet_cfg.wallet, [payment.payment_hash for payment in pending])
+        built = await _build_payloads(pending, wallet_cfg, settings, snapshots, semaphore)
+        for payment, (_, amount_major, fiat_currency, skip_reason) in zip(pending, built, strict=True):
+            if skip_reason or amount_major is None or not fiat_currency:
+                _count_skip(plan, skip_reason or "no payload")
+                continue
+            currency = fiat_currency.upper()
+            totals = plan["spend_totals"] if payment.amount < 0 else plan["totals"]
+            plan["would_push"] += 1
+            totals[currency] = round(totals.get(currency, 0) + amount_major, 2)
+    return plan
+
+
+def _count_skip(plan: SyncPlan, reason: str) -> None:
+    plan["skipped"] += 1
+    plan["skip_reasons"][reason] = plan["skip_reasons"].get(reason, 0) + 1
+
+
+# -- Fiat snapshots -----------------------------------------------------------
+async def capture_fiat_snapshot(payment: Payment, wallet_cfg: Wallets) -> FiatSnapshot | None:
+    """
+    Record the fiat value of a payment at settlement so later pushes and backfills
+    use the rate of the day instead of the rate at sync time.
+    Payments that carry fiat data in `extra` need no snapshot.
+    """
+    fiat_currency, fiat_amount = _get_fiat_amount_from_extra(payment)
+    if (fiat_currency and fiat_amount is not None) or not payment.amount:
+        return None
+    try:
+        fiat_currency, fiat_amount = await _get_fiat_amount_for_payment(payment, wallet_cfg)
+    except Exception as exc:
+        logger.warning(f"Xero Sync: failed to snapshot fiat amount for {payment.payment_hash}: {exc}")
+        return None
+    if not fiat_currency or fiat_amount is None:
+        return None
+
+    btc_amount = abs(payment.amount) / 1000 / 100_000_000
+    snapshot = FiatSnapshot(
+        payment_hash=payment.payment_hash,
+        wallet_id=wallet_cfg.wallet,
+        currency=fiat_currency.upper(),
+        rate=abs(fiat_amount) / btc_amount,
+        amount=fiat_amount,
+    )
+    try:
+        return await create_fiat_snapshot(snapshot)
+    except Exception as exc:
+        if _is_unique_violation(exc):
+            return None
+        raise
+
+
+async def capture_fiat_snapshots(payments: list[Payment], wallet_cfg: Wallets) -> dict[str, FiatSnapshot]:
+    """
+    Snapshot a batch of payments, reusing snapshots that already exist.
+    """
+    snapshots = await get_fiat_snapshots(wallet_cfg.wallet, [payment.payment_hash for payment in payments])
+    for payment in payments:
+        if payment.payment_hash in snapshots:
+            continue
+        snapshot = await capture_fiat_snapshot(payment, wallet_cfg)
+        if snapshot:
+            snapshots[payment.payment_hash] = snapshot
+    return snapshots
+
+
+# -- Routing fees -------------------------------------------------------------
+def _fee_period(val) -> str:
+    return _as_datetime(val).astimezone(timezone.utc).date().isoformat()
+
+
+async def _get_fiat_fee_for_payment(
+    payment: Payment, wallet_cfg: Wallets, snapshot: FiatSnapshot | None = None
+) -> tuple[str | None, float | None]:
+    """
+    Value the routing fee at the same rate as the payment itself.
+    """
+    fiat_currency, fiat_amount = await _get_fiat_amount_for_payment(payment, wallet_cfg, snapshot)
+    if not fiat_currency or fiat_amount is None or not payment.amount:
+        return fiat_currency, None
+    return fiat_currency, abs(fiat_amount) * abs(payment.fee) / abs(payment.amount)
+
+
+async def record_payment_fee(
+    payment: Payment, wallet_cfg: Wallets, snapshot: FiatSnapshot | None = None
+) -> FeeEntry | None:
+    """
+    Store the routing fee of an outgoing payment for the next per-period fee push.
+    """
+    if not wallet_cfg.fee_handling or payment.amount >= 0 or not payment.fee or not payment.success:
+        return None
+
+    try:
+        fiat_currency, fee_amount = await _get_fiat_fee_for_payment(payment, wallet_cfg, snapshot)
+    except Exception as exc:
+        logger.warning(f"Xero Sync: failed to calculate fiat fee for {payment.payment_hash}: {exc}")
+        return None
+    if not fiat_currency or fee_amount is None:
+        return None
+
+    entry = FeeEntry(
+        id=urlsafe_short_hash(),
+        user_id=wallet_cfg.user_id,
+        wallet_id=wallet_cfg.wallet,
+        payment_hash=payment.payment_hash,
+        period=_fee_period(payment.time),
+        fee_msat=abs(payment.fee),
+        currency=fiat_currency.upper(),
+        amount=fee_amount,
+    )
+    try:
+        return await create_fee_entry(entry)
+    except Exception as exc:
+        if _is_unique_violation(exc):
+            return None
+        raise
+
+
+async def _record_fees(
+    payments: list[Payment],
+    wallet_cfg: Wallets,
+    known_hashes: set[str],
+    fiat_snapshots: dict[str, FiatSnapshot],
+) -> int:
+    recorded = 0
+    for pay in payments:
+        if pay.payment_hash in known_hashes:
+            continue
+        if await record_payment_fee(pay, wallet_cfg, fiat_snapshots.get(pay.payment_hash)):
+            known_hashes.add(pay.payment_hash)
+            recorded += 1
+    return recorded
+
+
+def _build_fee_bank_transaction(wallet_cfg: Wallets, period: str, currency: str, amount: float, count: int) -> dict:
+    description = f"Lightning routing fees {period} ({count} payment(s))"
+    bank_tx: dict[str, Any] = {
+        "Type": "SPEND",
+        "Contact": {"Name": FEE_CONTACT_NAME},
+        "BankAccount": {"AccountID": wallet_cfg.xero_bank_account_id},
+        "LineItems": [
+            {
+                "Description": description,
+                "Quantity": 1,
+                "UnitAmount": amount,
+                "AccountCode": wallet_cfg.fee_account_code or DEFAULT_FEE_ACCOUNT_CODE,
+            }
+        ],
+        "Reference": description,
+        "CurrencyCode": currency,
+        "Date": f"{period}T00:00:00",
+    }
+    if wallet_cfg.auto_reconcile:
+        bank_tx["IsReconciled"] = True
+    return bank_tx
+
+
+async def push_wallet_fees(wallet_cfg: Wallets, access_token: str, tenant_id: str) -> int:
+    """
+    Push one SPEND BankTransaction per closed period and currency, batched into as few calls as possible.
+    Returns the number of fee transactions created.
+    """
+    if not wallet_cfg.xero_bank_account_id or wallet_cfg.xero_bank_account_id == EMPTY_ACCOUNT_ID:
+        return 0
+
+    current_period = _fee_period(datetime.now(timezone.utc))
+    entries = await get_unposted_fee_entries(wallet_cfg.wallet, current_period)
+    groups: dict[tuple[str, str], list[FeeEntry]] = {}
+    for entry in entries:
+        groups.setdefault((entry.period, entry.currency), []).append(entry)
+
+    bank_txs: list[dict] = []
+    keys: list[str] = []
+    posted_groups: list[list[FeeEntry]] = []
+    for (period, currency), group in groups.items():
+        amount = round(sum(entry.amount for entry in group), 2)
+        if amount <= 0:
+            await mark_fee_entries_posted([entry.id for entry in group], FEE_BELOW_MINIMUM)
+            continue
+        bank_txs.append(_build_fee_bank_transaction(wallet_cfg, period, currency, amount, len(group)))
+        # Keyed by the entries as well: fees arriving late for a posted period are a new transaction.
+        keys.append(idempotency_key(wallet_cfg.wallet, "fees", period, currency, *sorted(e.id for e in group)))
+        posted_groups.append(group)
+
+    if not bank_txs:
+        return 0
+
+    created = 0
+    await apply_contact_ids(access_token, tenant_id, bank_txs)
+    results = await post_bank_transactions(access_token, tenant_id, bank_txs, keys)
+    for group, result in zip(posted_groups, results, strict=True):
+        if result["status"] != "ok" or not result.get("bank_transaction_id"):
+            reason = result.get("reason") or "no BankTransactionID returned"
+            logger.error(f"Xero Sync: failed to push fees for {group[0].period}: {reason}")
+            continue
+        await mark_fee_entries_posted([entry.id for entry in group], result["bank_transaction_id"])
+        created += 1
+    return created
+
+
 async def get_settings(user_id: str) -> ExtensionSettings:
     settings = await get_extension_settings(user_id)
     if not settings:
@@ -11,12 +11,17 @@ window.app = Vue.createApp({
           xero_client_secret: null,
           xero_tax_standard: null,
           xero_tax_zero: null,
-          xero_tax_exempt: null
+          xero_tax_exempt: null,
+          xero_webhook_key: null
         }
       },
       keysFormDialog: {
         show: false
       },
+      postingModeOptions: [
+        {label: 'Receive Money', value: 'bank_transaction'},
+        {label: 'Invoice + Payment', value: 'invoice'}
+      ],
       walletsFormDialog: {
         show: false,
         data: {
@@ -24,11 +29,17 @@ window.app = Vue.createApp({
           push_payments: true,
           push_bitcoin: true,
           push_fiat: true,
+          push_outgoing: false,
           auto_reconcile: false,
           reconcile_name: null,
           reconcile_mode: null,
+          spend_account_code: null,
+          spend_contact_name: null,
           xero_bank_account_id: null,
           tax_rate: null,
+          posting_mode: 'bank_transaction',
+          fee_handling: false,
+          fee_account_code: null,
           notes: null
         }
       },
@@ -36,7 +47,8 @@ window.app = Vue.createApp({
         show: false,
         loading: false,
         wallet: null,
-        startDate: null
+        startDate: null,
+        plan: null
       },
       walletsList: [],
       taxRateList: [
@@ -47,8 +59,10 @@ window.app = Vue.createApp({
       ],
       taxTypeList: [],
       accountCodeList: [],
+      expenseAccountList: [],
       bankAccountList: [],
       xeroConnected: false,
+      xeroMetadataFetchedAt: null,
       walletsTable: {
         search: '',
         loading: false,
@@ -193,11 +207,17 @@ window.app = Vue.createApp({
         push_payments: true,
         push_bitcoin: true,
         push_fiat: true,
+        push_outgoing: false,
         auto_reconcile: false,
         reconcile_name: null,
         reconcile_mode: null,
+        spend_account_code: null,
+        spend_contact_name: null,
         xero_bank_account_id: null,
         tax_rate: null,
+        posting_mode: 'bank_transaction',
+        fee_handling: false,
+        fee_account_code: null,
         notes: null
       }
       await this.refreshXeroMetadata()
@@ -262,8 +282,28 @@ window.app = Vue.createApp({
     showSyncWalletDialog(wallet) {
       this.syncWalletDialog.wallet = wallet
       this.syncWalletDialog.startDate = null
+      this.syncWalletDialog.plan = null
       this.syncWalletDialog.show = true
     },
+    async planWallet() {
+      const wallet = this.syncWalletDialog.wallet
+      const startDate = this.syncWalletDialog.startDate
+      if (!wallet || !startDate) return
+
+      try {
+        this.syncWalletDialog.loading = true
+        const {data} = await LNbits.api.request(
+          'GET',
+          `/xerosync/api/v1/wallets/${wallet.id}/plan?start_date=${encodeURIComponent(startDate)}`,
+          null
+        )
+        this.syncWalletDialog.plan = data
+      } catch (error) {
+        LNbits.utils.notifyApiError(error)
+      } finally {
+        this.syncWalletDialog.loading = false
+      }
+    },
     async syncWallet() {
       const wallet = this.syncWalletDialog.wallet
       const startDate = this.syncWalletDialog.startDate
@@ -295,7 +335,11 @@ window.app = Vue.createApp({
 
     //////////////// Xero metadata ////////////////////////
     async refreshXeroMetadata() {
-      await Promise.all([this.getXeroAccounts(), this.getXeroBankAccounts()])
+      await Promise.all([
+        this.getXeroAccounts(),
+        this.getXeroExpenseAccounts(),
+        this.getXeroBankAccounts()
+      ])
     },
     async getXeroAccounts() {
       try {
@@ -303,7 +347,8 @@ window.app = Vue.createApp({
           'GET',
           '/xerosync/api/v1/accounts'
         )
-        this.accountCodeList = data
+        this.accountCodeList = data.data
+        this.xeroMetadataFetchedAt = data.fetched_at
       } catch (error) {
         // User may not have connected to Xero yet; fail soft
         LNbits.utils.notifyError(
@@ -312,13 +357,24 @@ window.app = Vue.createApp({
         this.accountCodeList = []
       }
     },
+    async getXeroExpenseAccounts() {
+      try {
+        const {data} = await LNbits.api.request(
+          'GET',
+          '/xerosync/api/v1/accounts?expense=true'
+        )
+        this.expenseAccountList = data.data
+      } catch (error) {
+        this.expenseAccountList = []
+      }
+    },
     async getXeroBankAccounts() {
       try {
         const {data} = await LNbits.api.request(
           'GET',
           '/xerosync/api/v1/bank_accounts'
         )
-        this.bankAccountList = data
+        this.bankAccountList = data.data
       } catch (error) {
         LNbits.utils.notifyError(
           'Could not load Xero bank accounts. Connect to Xero and try again.'
@@ -332,7 +388,7 @@ window.app = Vue.createApp({
           'GET',
           '/xerosync/api/v1/tax_rates'
         )
-        this.taxTypeList = data
+        this.taxTypeList = data.data
       } catch (error) {
         LNbits.utils.notifyError(
           'Could not load Xero tax rates. Connect to Xero and try again.'
@@ -352,6 +408,35 @@ window.app = Vue.createApp({
       }
     },
 
+    //////////////// Bootstrap ////////////////////////
+    async bootstrap() {
+      try {
+        this.walletsTable.loading = true
+        const params = LNbits.utils.prepareFilterQuery(this.walletsTable)
+        const {data} = await LNbits.api.request(
+          'GET',
+          `/xerosync/api/v1/bootstrap?${params}`,
+          null
+        )
+        this.xeroConnected = !!data.connected
+        this.settingsFormDialog.data = {
+          ...this.settingsFormDialog.data,
+          ...data.settings
+        }
+        this.walletsList = data.wallets.data
+        this.walletsTable.pagination.rowsNumber = data.wallets.total
+        this.accountCodeList = data.accounts
+        this.expenseAccountList = data.expense_accounts
+        this.bankAccountList = data.bank_accounts
+        this.taxTypeList = data.tax_rates
+        this.xeroMetadataFetchedAt = data.xero_fetched_at
+      } catch (error) {
+        LNbits.utils.notifyApiError(error)
+      } finally {
+        this.walletsTable.loading = false
+      }
+    },
+
     //////////////// Utils ////////////////////////
     dateFromNow(date) {
       return moment(date).fromNow()
@@ -365,9 +450,6 @@ window.app = Vue.createApp({
     }
   },
   async created() {
-    this.getWallets()
-    this.getSettings()
-    this.refreshXeroMetadata()
-    this.getXeroConnectionStatus()
+    await this.bootstrap()
   }
 })
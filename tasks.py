@@ -1,30 +1,226 @@
 import asyncio
+import random
+from datetime import datetime, timedelta, timezone
 
 from lnbits.core.models import Payment
 from lnbits.tasks import register_invoice_listener
 from loguru import logger
 
-from .crud import get_wallet_by_wallet_id, get_xero_connection
-from .services import payment_received_for_client_data
+from .bloom import refresh_payment_filters
+from .crud import (
+    count_spilled_payments,
+    get_deferred_user_ids,
+    get_expiring_xero_connections,
+    get_mapped_wallet,
+    get_outgoing_sync_wallets,
+    get_xero_connection,
+)
+from .intake import IntakeQueue
+from .recovery import recover_orphaned_reservations
+from .retention import compact_synced_history
+from .services import (
+    capture_fiat_snapshots,
+    payments_received_for_client_data,
+    push_deferred_payments,
+    refresh_xero_connection,
+    sync_outgoing_payments,
+)
+from .tracing import push_trace, span
+from .transport import XERO_BATCH_SIZE
+from .webhooks import process_xero_event, webhook_queue
+
+OUTGOING_SWEEP_INTERVAL_SECONDS = 10 * 60
+# Sweep more than one fee period back so a closed period is always complete when pushed.
+OUTGOING_SWEEP_LOOKBACK = timedelta(days=2)
+DEFERRED_DRAIN_INTERVAL_SECONDS = 30
+TOKEN_REFRESH_INTERVAL_SECONDS = 60
+# Refresh tokens this far ahead of expiry; must exceed the interval plus the jitter.
+TOKEN_REFRESH_AHEAD = timedelta(minutes=10)
+TOKEN_REFRESH_JITTER_SECONDS = 30
+TOKEN_REFRESH_BATCH_SIZE = 20
+# Connections that have failed to refresh for this long are left to the push path.
+TOKEN_REFRESH_GIVE_UP = timedelta(days=1)
+RETENTION_INTERVAL_SECONDS = 6 * 60 * 60
+# How long shutdown waits for running pushes before cancelling them; cut-off pushes are
+# left to the orphaned reservation recovery.
+SHUTDOWN_DRAIN_SECONDS = 10
+RECOVERY_INTERVAL_SECONDS = 30 * 60
+PAYMENT_FILTER_INTERVAL_SECONDS = 5 * 60
+
+
+intake_queue = IntakeQueue()
+# The queue lnbits delivers into; it is unbounded, so it is emptied straight into the intake.
+_listener_queue: asyncio.Queue[Payment] = asyncio.Queue()
+# The live batch being pushed, checkpointed with the queue if shutdown cuts it off.
+_current_batch: list[Payment] = []
 
 
 async def wait_for_paid_invoices():
-    invoice_queue = asyncio.Queue()
-    register_invoice_listener(invoice_queue, "ext_xerosync")
+    global _listener_queue
+    _listener_queue = asyncio.Queue()
+    register_invoice_listener(_listener_queue, "ext_xerosync")
+    await intake_queue.restore()
+    forwarder = asyncio.create_task(_forward_to_intake(_listener_queue))
+    try:
+        while True:
+            payments = [await intake_queue.get()]
+            # Batch whatever is already queued; never wait for more.
+            while len(payments) < XERO_BATCH_SIZE and not intake_queue.empty():
+                payments.append(intake_queue.get_nowait())
+            _current_batch[:] = payments
+            await on_invoices_paid(payments)
+            _current_batch.clear()
+    finally:
+        forwarder.cancel()
+
+
+async def checkpoint_intake() -> None:
+    """
+    Spill the live batch cut off by shutdown and every payment still queued, to be pushed after
+    a restart. Payments that did get pushed are skipped as already synced when replayed.
+    """
+    await intake_queue.checkpoint(_current_batch)
+    _current_batch.clear()
+    while not _listener_queue.empty():
+        await intake_queue.put(_listener_queue.get_nowait())
+
+
+async def _forward_to_intake(listener_queue: asyncio.Queue[Payment]) -> None:
     while True:
-        payment = await invoice_queue.get()
-        await on_invoice_paid(payment)
+        payment = await listener_queue.get()
+        try:
+            await intake_queue.put(payment)
+        except Exception as e:
+            logger.error(f"Error queueing payment for xerosync: {e}")
 
 
-async def on_invoice_paid(payment: Payment) -> None:
-    wallet_cfg = await get_wallet_by_wallet_id(payment.wallet_id)
+async def get_intake_metrics() -> dict:
+    return {
+        "listener": _listener_queue.qsize(),
+        "queued": intake_queue.qsize(),
+        "spilled": await count_spilled_payments(),
+        "spilling": intake_queue.spilling,
+        "high_watermark": intake_queue.high_watermark,
+        "low_watermark": intake_queue.low_watermark,
+    }
+
+
+async def on_invoices_paid(payments: list[Payment]) -> None:
+    by_wallet: dict[str, list[Payment]] = {}
+    for payment in payments:
+        by_wallet.setdefault(payment.wallet_id, []).append(payment)
+
+    for wallet_id, wallet_payments in by_wallet.items():
+        with push_trace("live_push", wallet=wallet_id, payments=len(wallet_payments)):
+            await _on_wallet_payments_paid(wallet_id, wallet_payments)
+
+
+async def _on_wallet_payments_paid(wallet_id: str, wallet_payments: list[Payment]) -> None:
+    with span("wallet_lookup"):
+        wallet_cfg = await get_mapped_wallet(wallet_id)
     if not wallet_cfg:
         return
-    conn = await get_xero_connection(wallet_cfg.user_id)
+    # Capture the settlement-time fiat value first, so a later backfill is accurate
+    # even if this push is skipped or fails.
+    try:
+        with span("fiat_snapshots"):
+            snapshots = await capture_fiat_snapshots(wallet_payments, wallet_cfg)
+    except Exception as e:
+        logger.warning(f"Error capturing fiat snapshot for xerosync: {e}")
+        snapshots = None
+    if not wallet_cfg.push_payments:
+        return
+    with span("connection"):
+        conn = await get_xero_connection(wallet_cfg.user_id)
     if not conn:
         logger.warning("Xero Sync: no Xero connection for user, skipping")
         return
     try:
-        await payment_received_for_client_data(payment, conn, wallet_cfg)
+        await payments_received_for_client_data(wallet_payments, conn, wallet_cfg, snapshots)
     except Exception as e:
         logger.error(f"Error processing payment for xerosync: {e}")
+
+
+async def on_invoice_paid(payment: Payment) -> None:
+    await on_invoices_paid([payment])
+
+
+async def wait_for_outgoing_payments():
+    while True:
+        since = int((datetime.now(timezone.utc) - OUTGOING_SWEEP_LOOKBACK).timestamp())
+        for wallet_cfg in await get_outgoing_sync_wallets():
+            try:
+                await sync_outgoing_payments(wallet_cfg, since)
+            except Exception as e:
+                logger.error(f"Error pushing outgoing payments for xerosync: {e}")
+        await asyncio.sleep(OUTGOING_SWEEP_INTERVAL_SECONDS)
+
+
+async def wait_for_deferred_payments():
+    while True:
+        for user_id in await get_deferred_user_ids():
+            conn = await get_xero_connection(user_id)
+            if not conn:
+                continue
+            try:
+                # Keep draining while every retried batch goes through.
+                while await push_deferred_payments(conn, XERO_BATCH_SIZE):
+                    pass
+            except Exception as e:
+                logger.error(f"Error pushing deferred payments for xerosync: {e}")
+        await asyncio.sleep(DEFERRED_DRAIN_INTERVAL_SECONDS)
+
+
+async def wait_for_token_refresh():
+    while True:
+        now = datetime.now(timezone.utc)
+        connections = await get_expiring_xero_connections(now - TOKEN_REFRESH_GIVE_UP, now + TOKEN_REFRESH_AHEAD)
+        for start in range(0, len(connections), TOKEN_REFRESH_BATCH_SIZE):
+            batch = connections[start : start + TOKEN_REFRESH_BATCH_SIZE]
+            await asyncio.gather(*(_refresh_with_jitter(conn) for conn in batch))
+        await asyncio.sleep(TOKEN_REFRESH_INTERVAL_SECONDS)
+
+
+async def _refresh_with_jitter(conn) -> None:
+    # Spread refreshes so tokens issued together are not refreshed in one burst.
+    await asyncio.sleep(random.uniform(0, TOKEN_REFRESH_JITTER_SECONDS))
+    try:
+        await refresh_xero_connection(conn, TOKEN_REFRESH_AHEAD)
+    except Exception as e:
+        logger.warning(f"Xero Sync: background token refresh failed for user {conn.user_id}: {e}")
+
+
+async def wait_for_retention():
+    while True:
+        try:
+            await compact_synced_history()
+        except Exception as e:
+            logger.error(f"Error compacting sync history for xerosync: {e}")
+        await asyncio.sleep(RETENTION_INTERVAL_SECONDS)
+
+
+async def wait_for_orphan_recovery():
+    while True:
+        try:
+            await recover_orphaned_reservations()
+        except Exception as e:
+            logger.error(f"Error recovering orphaned reservations for xerosync: {e}")
+        await asyncio.sleep(RECOVERY_INTERVAL_SECONDS)
+
+
+async def wait_for_xero_webhooks():
+    while True:
+        user_id, event = await webhook_queue.get()
+        try:
+            await process_xero_event(user_id, event)
+        except Exception as e:
+            logger.error(f"Error processing Xero webhook event for xerosync: {e}")
+
+
+async def wait_for_payment_filters():
+    while True:
+        try:
+            await refresh_payment_filters()
+        except Exception as e:
+            logger.error(f"Error refreshing payment filters for xerosync: {e}")
+        await asyncio.sleep(PAYMENT_FILTER_INTERVAL_SECONDS)
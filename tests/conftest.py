@@ -0,0 +1,30 @@
+import asyncio
+import inspect
+
+import pytest
+import pytest_asyncio
+from lnbits.db import SQLITE, Database
+from lnbits.settings import settings
+
+from .. import migrations
+from ..crud import db
+
+
+@pytest_asyncio.fixture
+async def database(tmp_path, monkeypatch):
+    """
+    The extension's tables, migrated into a fresh SQLite database for each test.
+    """
+    if db.type != SQLITE:
+        pytest.skip("database tests run on SQLite")
+    engine, path, lock = db.engine, db.path, db.lock
+    monkeypatch.setattr(settings, "lnbits_data_folder", str(tmp_path))
+    fresh = Database(db.name)
+    db.engine, db.path, db.lock = fresh.engine, fresh.path, asyncio.Lock()
+    async with db.connect() as conn:
+        for name, migration in sorted(inspect.getmembers(migrations, inspect.iscoroutinefunction)):
+            if name.startswith("m0"):
+                await migration(conn)
+    yield db
+    await db.engine.dispose()
+    db.engine, db.path, db.lock = engine, path, lock
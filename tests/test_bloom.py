@@ -0,0 +1,65 @@
+import pytest
+
+from .. import bloom
+from ..bloom import PaymentHashFilter, load_payment_filter
+
+HASHES = [f"{i:064x}" for i in range(2000)]
+
+
+def test_no_false_negatives():
+    payment_filter = PaymentHashFilter(len(HASHES))
+    for payment_hash in HASHES:
+        payment_filter.add(payment_hash)
+    assert all(payment_filter.might_contain(payment_hash) for payment_hash in HASHES)
+    assert not payment_filter.full
+
+
+def test_no_false_negatives_after_persist_and_reload():
+    payment_filter = PaymentHashFilter(len(HASHES))
+    for payment_hash in HASHES:
+        payment_filter.add(payment_hash)
+
+    reloaded = PaymentHashFilter.from_model(payment_filter.to_model("wallet1"))
+    assert reloaded.same_geometry(payment_filter)
+    assert reloaded.entries == payment_filter.entries
+    assert all(reloaded.might_contain(payment_hash) for payment_hash in HASHES)
+
+
+@pytest.mark.asyncio
+async def test_load_catches_up_with_later_reservations(monkeypatch):
+    saved = PaymentHashFilter(len(HASHES))
+    for payment_hash in HASHES[:1000]:
+        saved.add(payment_hash)
+
+    async def get_payment_filter(wallet_id):
+        return saved.to_model(wallet_id)
+
+    async def iter_synced_payment_hashes(wallet_id, since=None):
+        # Reserved around and after the save.
+        yield HASHES[900:]
+
+    monkeypatch.setattr(bloom, "get_payment_filter", get_payment_filter)
+    monkeypatch.setattr(bloom, "iter_synced_payment_hashes", iter_synced_payment_hashes)
+    loaded = await load_payment_filter("wallet1")
+    assert all(loaded.might_contain(payment_hash) for payment_hash in HASHES)
+
+
+def test_no_false_negatives_after_merge():
+    ours, theirs = PaymentHashFilter(len(HASHES)), PaymentHashFilter(len(HASHES))
+    for payment_hash in HASHES[::2]:
+        ours.add(payment_hash)
+    for payment_hash in HASHES[1::2]:
+        theirs.add(payment_hash)
+
+    ours.merge(PaymentHashFilter.from_model(theirs.to_model("wallet1")))
+    assert all(ours.might_contain(payment_hash) for payment_hash in HASHES)
+
+
+def test_false_positive_rate():
+    payment_filter = PaymentHashFilter(len(HASHES))
+    for payment_hash in HASHES:
+        payment_filter.add(payment_hash)
+    others = [f"{i:064x}" for i in range(len(HASHES), len(HASHES) + 10000)]
+    false_positives = sum(payment_filter.might_contain(payment_hash) for payment_hash in others)
+    # About 1% at capacity.
+    assert false_positives < len(others) * 0.03
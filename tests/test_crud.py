@@ -0,0 +1,115 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from .. import crud
+from ..crud import (
+    claim_deferred_payments,
+    claim_spilled_payments,
+    claim_sync_partition,
+    create_sync_job,
+    defer_payments,
+    delete_claimed_deferred_payments,
+    extend_synced_payment_leases,
+    get_orphaned_synced_payments,
+    reserve_synced_payments,
+    spill_payment,
+    update_sync_partition,
+)
+from ..models import SyncJob, SyncPartition
+
+LEASE = timedelta(minutes=5)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    Move the time leases are taken and checked at; lease times are stored in whole seconds.
+    """
+    offset = [timedelta(0)]
+
+    class ShiftedDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return datetime.now(tz) + offset[0]
+
+    monkeypatch.setattr(crud, "datetime", ShiftedDatetime)
+    return offset
+
+
+@pytest.mark.asyncio
+async def test_live_lease_blocks_a_second_claimer(database, clock):
+    await defer_payments("user1", "wallet1", ["hash1", "hash2"])
+    first, second = await asyncio.gather(
+        claim_deferred_payments("user1", 10, LEASE), claim_deferred_payments("user1", 10, LEASE)
+    )
+    claimed = [[row.payment_hash for row in rows] for _, rows in (first, second)]
+    assert sorted(claimed) == [[], ["hash1", "hash2"]]
+
+    clock[0] = LEASE - timedelta(seconds=5)
+    _, rows = await claim_deferred_payments("user1", 10, LEASE)
+    assert rows == []
+
+
+@pytest.mark.asyncio
+async def test_expired_lease_is_reclaimed(database, clock):
+    await defer_payments("user1", "wallet1", ["hash1"])
+    first_token, rows = await claim_deferred_payments("user1", 10, LEASE)
+    assert [row.payment_hash for row in rows] == ["hash1"]
+
+    # The first worker died: once its lease runs out another takes over.
+    clock[0] = LEASE + timedelta(seconds=5)
+    second_token, rows = await claim_deferred_payments("user1", 10, LEASE)
+    assert [row.payment_hash for row in rows] == ["hash1"]
+    assert second_token != first_token
+
+    # The first worker's late cleanup no longer touches what the second one holds.
+    await delete_claimed_deferred_payments(first_token)
+    clock[0] += LEASE + timedelta(seconds=5)
+    _, rows = await claim_deferred_payments("user1", 10, LEASE)
+    assert [row.payment_hash for row in rows] == ["hash1"]
+
+
+@pytest.mark.asyncio
+async def test_spilled_payments_are_split_between_claimers(database, clock):
+    for i in range(4):
+        await spill_payment(f"hash{i}", "{}")
+    first = await claim_spilled_payments(2, LEASE)
+    second = await claim_spilled_payments(10, LEASE)
+    assert [row["payment_hash"] for row in first] == ["hash0", "hash1"]
+    assert [row["payment_hash"] for row in second] == ["hash2", "hash3"]
+    assert await claim_spilled_payments(10, LEASE) == []
+
+    clock[0] = LEASE + timedelta(seconds=5)
+    assert len(await claim_spilled_payments(10, LEASE)) == 4
+
+
+@pytest.mark.asyncio
+async def test_sync_partition_is_claimed_once_until_checkpointed_or_expired(database, clock):
+    job = SyncJob(id="job1", user_id="user1", wallet_id="wallet1")
+    await create_sync_job(job, [SyncPartition(id="partition1", job_id="job1")])
+    partition = await claim_sync_partition("job1", ["partition1"], LEASE)
+    assert partition and partition.leased_by
+    assert await claim_sync_partition("job1", ["partition1"], LEASE) is None
+
+    clock[0] = LEASE + timedelta(seconds=5)
+    reclaimed = await claim_sync_partition("job1", ["partition1"], LEASE)
+    assert reclaimed and reclaimed.leased_by != partition.leased_by
+
+    # Checkpointing releases the lease straight away.
+    await update_sync_partition(reclaimed)
+    assert await claim_sync_partition("job1", ["partition1"], LEASE)
+
+
+@pytest.mark.asyncio
+async def test_reservation_lease_keeps_it_from_recovery(database):
+    await reserve_synced_payments("user1", "wallet1", [("hash1", "USD", 1.0, None)], LEASE)
+    now = datetime.now(timezone.utc)
+    assert await get_orphaned_synced_payments(now, 10) == []
+    later = now + LEASE + timedelta(seconds=5)
+    assert [row.payment_hash for row in await get_orphaned_synced_payments(later, 10)] == ["hash1"]
+
+    # A push still posting renews the lease.
+    await extend_synced_payment_leases("wallet1", ["hash1"], LEASE * 3)
+    assert await get_orphaned_synced_payments(later, 10) == []
@@ -0,0 +1,104 @@
+from datetime import datetime, timezone
+
+import pytest
+from lnbits.core.models import Payment
+
+from .. import intake
+from ..intake import IntakeQueue
+
+
+@pytest.fixture
+def spill(monkeypatch):
+    """
+    The spill table in memory, oldest first.
+    """
+    rows: dict[str, str] = {}
+
+    async def spill_payment(payment_hash, payment):
+        rows.setdefault(payment_hash, payment)
+
+    async def count_spilled_payments():
+        return len(rows)
+
+    async def claim_spilled_payments(limit, lease):
+        return [{"payment_hash": key, "payment": value} for key, value in list(rows.items())[:limit]]
+
+    async def delete_spilled_payments(payment_hashes):
+        for payment_hash in payment_hashes:
+            rows.pop(payment_hash, None)
+
+    monkeypatch.setattr(intake, "spill_payment", spill_payment)
+    monkeypatch.setattr(intake, "count_spilled_payments", count_spilled_payments)
+    monkeypatch.setattr(intake, "claim_spilled_payments", claim_spilled_payments)
+    monkeypatch.setattr(intake, "delete_spilled_payments", delete_spilled_payments)
+    return rows
+
+
+def payment(i: int) -> Payment:
+    return Payment(
+        checking_id=f"checking{i}",
+        payment_hash=f"hash{i}",
+        wallet_id="wallet1",
+        amount=1000,
+        fee=0,
+        bolt11="lnbc",
+        status="success",
+        time=datetime.now(timezone.utc),
+    )
+
+
+async def drain(queue: IntakeQueue, count: int) -> list[str]:
+    return [(await queue.get()).payment_hash for _ in range(count)]
+
+
+@pytest.mark.asyncio
+async def test_spills_above_high_watermark(spill):
+    queue = IntakeQueue(high_watermark=3, low_watermark=1)
+    for i in range(5):
+        await queue.put(payment(i))
+    assert queue.qsize() == 3
+    assert queue.spilling
+    assert list(spill) == ["hash3", "hash4"]
+
+
+@pytest.mark.asyncio
+async def test_reload_keeps_arrival_order(spill):
+    queue = IntakeQueue(high_watermark=3, low_watermark=1)
+    for i in range(5):
+        await queue.put(payment(i))
+    assert await drain(queue, 2) == ["hash0", "hash1"]
+    # Room in memory again, but the backlog is still spilled: later payments go behind it.
+    await queue.put(payment(5))
+    assert list(spill) == ["hash3", "hash4", "hash5"]
+    assert await drain(queue, 4) == ["hash2", "hash3", "hash4", "hash5"]
+    assert not queue.spilling
+    assert not spill
+
+    await queue.put(payment(6))
+    assert not spill
+    assert await drain(queue, 1) == ["hash6"]
+
+
+@pytest.mark.asyncio
+async def test_reload_in_watermark_sized_chunks(spill):
+    queue = IntakeQueue(high_watermark=2, low_watermark=0)
+    for i in range(7):
+        await queue.put(payment(i))
+    assert await drain(queue, 7) == [f"hash{i}" for i in range(7)]
+    assert not queue.spilling
+
+
+@pytest.mark.asyncio
+async def test_checkpoint_spills_batch_then_queue(spill):
+    queue = IntakeQueue(high_watermark=3, low_watermark=1)
+    for i in range(2, 4):
+        await queue.put(payment(i))
+    assert await queue.checkpoint([payment(0), payment(1)]) == 4
+    assert list(spill) == ["hash0", "hash1", "hash2", "hash3"]
+    assert queue.empty()
+
+    restarted = IntakeQueue(high_watermark=3, low_watermark=1)
+    await restarted.restore()
+    assert restarted.spilling
+    await restarted.put(payment(4))
+    assert await drain(restarted, 5) == [f"hash{i}" for i in range(5)]
@@ -0,0 +1,177 @@
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import httpx
+import pytest
+import pytest_asyncio
+from lnbits.core.models import Payment
+
+from .. import recovery
+from ..crud import claim_deferred_payments, create_wallets, get_synced_payment, reserve_synced_payments
+from ..models import SYNC_STATUS_FAILED, SYNC_STATUS_OK, SYNC_STATUS_PENDING, CreateWallets, ExtensionSettings
+from ..recovery import RECOVERED_REASON, recover_orphaned_reservations
+
+PAID_AT = datetime(2025, 3, 1, 12, 0, 0, tzinfo=timezone.utc)
+
+
+def payment(payment_hash: str, memo: str) -> Payment:
+    return Payment(
+        checking_id=payment_hash,
+        payment_hash=payment_hash,
+        wallet_id="wallet1",
+        amount=1_000_000,
+        fee=0,
+        bolt11="lnbc",
+        status="success",
+        memo=memo,
+        time=PAID_AT,
+    )
+
+
+def bank_transaction(bank_transaction_id: str, reference: str, total: float = 1.5, day: str = "2025-03-01") -> dict:
+    return {
+        "BankTransactionID": bank_transaction_id,
+        "Reference": reference,
+        "DateString": f"{day}T00:00:00",
+        "SubTotal": total,
+        "Total": total,
+        "Status": "AUTHORISED",
+    }
+
+
+@pytest_asyncio.fixture
+async def xero(monkeypatch, database):
+    """
+    A connected wallet whose cut-off pushes are looked up in `xero.bank_transactions`.
+    """
+    state = SimpleNamespace(bank_transactions=[], payments={})
+
+    async def xero_request(method, path, access_token, tenant_id, params=None, **kwargs):
+        return httpx.Response(
+            200,
+            json={path: state.bank_transactions if path == "BankTransactions" else []},
+            request=httpx.Request(method, path),
+        )
+
+    async def get_standalone_payment(payment_hash, wallet_id=None):
+        return state.payments.get(payment_hash)
+
+    async def get_xero_connection(user_id):
+        return SimpleNamespace(user_id=user_id)
+
+    async def get_settings(user_id):
+        return ExtensionSettings()
+
+    async def ensure_xero_access_token(conn, settings):
+        return "token", "tenant1"
+
+    monkeypatch.setattr(recovery, "xero_request", xero_request)
+    monkeypatch.setattr(recovery, "get_standalone_payment", get_standalone_payment)
+    monkeypatch.setattr(recovery, "get_xero_connection", get_xero_connection)
+    monkeypatch.setattr(recovery, "get_settings", get_settings)
+    monkeypatch.setattr(recovery, "ensure_xero_access_token", ensure_xero_access_token)
+    await create_wallets(
+        "user1",
+        CreateWallets(
+            wallet="wallet1",
+            pull_payments=False,
+            push_payments=True,
+            reconcile_name=None,
+            reconcile_mode=None,
+            xero_bank_account_id="account1",
+            fee_handling=False,
+            last_synced=None,
+            status=None,
+            notes=None,
+        ),
+    )
+    return state
+
+
+async def cut_off(state, *payments: Payment) -> None:
+    # Reserved with a lease that has already run out, as if the push had crashed.
+    for cut_off_payment in payments:
+        state.payments[cut_off_payment.payment_hash] = cut_off_payment
+    await reserve_synced_payments(
+        "user1", "wallet1", [(p.payment_hash, "USD", 1.5, PAID_AT) for p in payments], timedelta(0)
+    )
+
+
+async def recover() -> int:
+    return await recover_orphaned_reservations(datetime.now(timezone.utc) + timedelta(seconds=1))
+
+
+async def deferred_hashes() -> list[str]:
+    _, deferred = await claim_deferred_payments("user1", 10, timedelta(minutes=1))
+    return [row.payment_hash for row in deferred]
+
+
+@pytest.mark.asyncio
+async def test_live_lease_is_left_alone(xero):
+    xero.payments["hash1"] = payment("hash1", "coffee")
+    await reserve_synced_payments("user1", "wallet1", [("hash1", "USD", 1.5, PAID_AT)], timedelta(minutes=5))
+    assert await recover() == 0
+    row = await get_synced_payment("wallet1", "hash1")
+    assert row and row.status == SYNC_STATUS_PENDING
+
+
+@pytest.mark.asyncio
+async def test_match_by_reference_is_recorded_as_pushed(xero):
+    xero.bank_transactions = [
+        bank_transaction("bt-other-day", "coffee", day="2025-03-02"),
+        bank_transaction("bt-other-amount", "coffee", total=2.5),
+        bank_transaction("bt-coffee", "coffee"),
+    ]
+    await cut_off(xero, payment("hash1", "coffee"))
+    assert await recover() == 1
+    row = await get_synced_payment("wallet1", "hash1")
+    assert row and row.status == SYNC_STATUS_OK
+    assert row.xero_bank_transaction_id == "bt-coffee"
+    assert await deferred_hashes() == []
+
+
+@pytest.mark.asyncio
+async def test_ambiguous_match_is_not_adopted(xero):
+    xero.bank_transactions = [bank_transaction("bt-1", "coffee"), bank_transaction("bt-2", "coffee")]
+    await cut_off(xero, payment("hash1", "coffee"))
+    assert await recover() == 0
+    row = await get_synced_payment("wallet1", "hash1")
+    assert row and row.status == SYNC_STATUS_PENDING
+    assert row.xero_bank_transaction_id is None
+    assert await deferred_hashes() == []
+    # Held back for a while rather than checked again on every run.
+    assert await recover() == 0
+
+
+@pytest.mark.asyncio
+async def test_match_shared_by_two_payments_is_not_adopted(xero):
+    xero.bank_transactions = [bank_transaction("bt-1", "coffee")]
+    await cut_off(xero, payment("hash1", "coffee"), payment("hash2", "coffee"))
+    assert await recover() == 0
+    for payment_hash in ("hash1", "hash2"):
+        row = await get_synced_payment("wallet1", payment_hash)
+        assert row and row.status == SYNC_STATUS_PENDING
+
+
+@pytest.mark.asyncio
+async def test_transaction_of_another_payment_is_not_adopted(xero):
+    xero.bank_transactions = [bank_transaction("bt-1", "coffee")]
+    await cut_off(xero, payment("hash1", "coffee"))
+    assert await recover() == 1
+    await cut_off(xero, payment("hash2", "coffee"))
+    assert await recover() == 1
+    row = await get_synced_payment("wallet1", "hash2")
+    assert row and row.status == SYNC_STATUS_FAILED
+    assert await deferred_hashes() == ["hash2"]
+
+
+@pytest.mark.asyncio
+async def test_no_match_goes_back_to_the_deferred_queue(xero):
+    xero.bank_transactions = [bank_transaction("bt-tea", "tea")]
+    await cut_off(xero, payment("hash1", "coffee"))
+    assert await recover() == 1
+    row = await get_synced_payment("wallet1", "hash1")
+    assert row and row.status == SYNC_STATUS_FAILED
+    assert row.xero_bank_transaction_id is None
+    _, deferred = await claim_deferred_payments("user1", 10, timedelta(minutes=1))
+    assert [(row.payment_hash, row.reason) for row in deferred] == [("hash1", RECOVERED_REASON)]
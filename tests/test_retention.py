@@ -0,0 +1,143 @@
+from datetime import date, datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from .. import retention, services
+from ..crud import (
+    db,
+    get_compaction_horizon,
+    get_synced_payment,
+    reserve_synced_payments,
+    set_compaction_horizon,
+    update_synced_payment,
+)
+from ..models import SYNC_STATUS_PENDING, ExtensionSettings, Wallets
+from ..retention import HORIZON_MARGIN, compact_wallet_history
+from ..services import _clamp_to_horizon, sync_wallet_payments
+
+NOW = datetime(2025, 6, 1, 12, 0, 0, tzinfo=timezone.utc)
+OLD = datetime(2025, 2, 1, 10, 0, 0, tzinfo=timezone.utc)
+
+
+def wallet_config() -> Wallets:
+    return Wallets(
+        id="config1",
+        user_id="user1",
+        wallet="wallet1",
+        pull_payments=False,
+        push_payments=True,
+        reconcile_name=None,
+        reconcile_mode=None,
+        xero_bank_account_id="account1",
+        fee_handling=False,
+        last_synced=NOW,
+        status=None,
+        notes=None,
+    )
+
+
+async def pushed(payment_hash: str, paid_at: datetime, amount: float = 1.5, currency: str = "USD") -> None:
+    await reserve_synced_payments("user1", "wallet1", [(payment_hash, currency, amount, paid_at)], timedelta(0))
+    await update_synced_payment("wallet1", payment_hash, f"bt-{payment_hash}", currency, amount)
+
+
+async def days() -> list[tuple[str, str, int, float]]:
+    rows: list[dict] = await db.fetchall(
+        "SELECT day, currency, payments, amount FROM xerosync.synced_payment_days ORDER BY day, currency"
+    )
+    return [(row["day"], row["currency"], row["payments"], row["amount"]) for row in rows]
+
+
+@pytest.mark.asyncio
+async def test_old_rows_are_folded_into_days_exactly_once(database):
+    await pushed("hash1", OLD)
+    await pushed("hash2", OLD + timedelta(hours=1), amount=2.25)
+    await pushed("hash3", OLD + timedelta(days=1), currency="EUR")
+    await pushed("recent", NOW - timedelta(days=10))
+    # Never pushed: kept so it can still be synced.
+    await reserve_synced_payments("user1", "wallet1", [("pending", "USD", 1.0, OLD)], timedelta(0))
+
+    assert await compact_wallet_history(wallet_config(), NOW) == 3
+    folded = [("2025-02-01", "USD", 2, 3.75), ("2025-02-02", "EUR", 1, 1.5)]
+    assert await days() == folded
+    for payment_hash in ("hash1", "hash2", "hash3"):
+        assert await get_synced_payment("wallet1", payment_hash) is None
+    assert await get_synced_payment("wallet1", "recent")
+    row = await get_synced_payment("wallet1", "pending")
+    assert row and row.status == SYNC_STATUS_PENDING
+    assert await get_compaction_horizon("wallet1") == OLD + timedelta(days=1) + HORIZON_MARGIN
+
+    # Compacting again adds nothing to the totals.
+    assert await compact_wallet_history(wallet_config(), NOW) == 0
+    assert await days() == folded
+
+
+@pytest.mark.asyncio
+async def test_rows_are_folded_once_across_chunks(database, monkeypatch):
+    monkeypatch.setattr(retention, "COMPACTION_CHUNK", 2)
+    monkeypatch.setattr(retention, "COMPACTION_PAUSE_SECONDS", 0)
+    for i in range(5):
+        await pushed(f"hash{i}", OLD + timedelta(minutes=i))
+    assert await compact_wallet_history(wallet_config(), NOW) == 5
+    assert await days() == [("2025-02-01", "USD", 5, 7.5)]
+    assert await get_compaction_horizon("wallet1") == OLD + timedelta(minutes=4) + HORIZON_MARGIN
+
+
+@pytest.mark.asyncio
+async def test_nothing_is_compacted_before_the_first_sync(database):
+    await pushed("hash1", OLD)
+    wallet_cfg = wallet_config()
+    wallet_cfg.last_synced = None
+    assert await compact_wallet_history(wallet_cfg, NOW) == 0
+    assert await get_synced_payment("wallet1", "hash1")
+    assert await get_compaction_horizon("wallet1") is None
+
+
+@pytest.mark.asyncio
+async def test_bulk_sync_since_is_clamped_to_the_horizon(database):
+    wallet_cfg = wallet_config()
+    since = int(OLD.timestamp())
+    assert await _clamp_to_horizon(wallet_cfg, since) == (since, None)
+
+    horizon = OLD + timedelta(days=1)
+    await set_compaction_horizon("wallet1", horizon)
+    # Payments are listed after `since`, so the first one reached is at the horizon itself.
+    horizon_since = int(horizon.timestamp()) - 1
+    assert await _clamp_to_horizon(wallet_cfg, None) == (horizon_since, horizon)
+    assert await _clamp_to_horizon(wallet_cfg, since) == (horizon_since, horizon)
+    later = int((horizon + timedelta(days=1)).timestamp())
+    assert await _clamp_to_horizon(wallet_cfg, later) == (later, None)
+
+
+@pytest.mark.asyncio
+async def test_bulk_sync_does_not_reach_past_the_horizon(database, monkeypatch):
+    horizon = OLD + timedelta(days=1)
+    await set_compaction_horizon("wallet1", horizon)
+    listed: list[int | None] = []
+
+    async def get_payments_paginated(since=None, **kwargs):
+        listed.append(since)
+        return SimpleNamespace(data=[])
+
+    async def get_xero_connection(user_id):
+        return SimpleNamespace(user_id=user_id)
+
+    async def get_settings(user_id):
+        return ExtensionSettings()
+
+    async def ensure_xero_access_token(conn, settings):
+        return "token", "tenant1"
+
+    async def update_wallets(wallet_cfg):
+        return wallet_cfg
+
+    monkeypatch.setattr(services, "get_payments_paginated", get_payments_paginated)
+    monkeypatch.setattr(services, "get_xero_connection", get_xero_connection)
+    monkeypatch.setattr(services, "get_settings", get_settings)
+    monkeypatch.setattr(services, "ensure_xero_access_token", ensure_xero_access_token)
+    monkeypatch.setattr(services, "update_wallets", update_wallets)
+    wallet_cfg = wallet_config()
+    await sync_wallet_payments(wallet_cfg, start_date=date(2025, 1, 1))
+    assert listed == [int(horizon.timestamp()) - 1]
+    assert "older history is compacted" in (wallet_cfg.status or "")
@@ -0,0 +1,252 @@
+from datetime import datetime, timezone
+from itertools import pairwise
+from types import SimpleNamespace
+
+import pytest
+from lnbits.core.models import Payment
+
+from .. import services
+from ..crud import (
+    get_running_sync_job,
+    mark_synced_payments_failed,
+    requeue_synced_payment,
+    reserve_synced_payments,
+)
+from ..models import ExtensionSettings, Wallets
+from ..push_plan import INVOICE_TYPE
+from ..services import (
+    BACKFILL_PARTITION_SPAN,
+    PARTITION_MAX_ATTEMPTS,
+    PUSH_LEASE,
+    _idle_admin_sync,
+    _partition_bounds,
+    _post_invoices_with_payments,
+    _sync_all_wallets,
+    push_payments_to_xero,
+    sync_wallet_payments,
+)
+from ..transport import idempotency_key
+
+FIRST = datetime(2025, 1, 1, 12, 0, 0, tzinfo=timezone.utc)
+
+
+def test_single_open_partition_when_history_is_short():
+    assert _partition_bounds(None, FIRST, FIRST + BACKFILL_PARTITION_SPAN / 2) == [(None, None)]
+
+
+def test_partitions_are_contiguous_and_cover_everything():
+    now = FIRST + BACKFILL_PARTITION_SPAN * 3.5
+    bounds = _partition_bounds(None, FIRST, now)
+    assert bounds == [
+        (None, FIRST + BACKFILL_PARTITION_SPAN),
+        (FIRST + BACKFILL_PARTITION_SPAN, FIRST + BACKFILL_PARTITION_SPAN * 2),
+        (FIRST + BACKFILL_PARTITION_SPAN * 2, FIRST + BACKFILL_PARTITION_SPAN * 3),
+        (FIRST + BACKFILL_PARTITION_SPAN * 3, None),
+    ]
+    # Each (starts_after, ends_at] range starts where the previous one ended.
+    for (_, ends_at), (starts_after, _) in pairwise(bounds):
+        assert starts_after == ends_at
+
+
+def test_edge_at_now_stays_in_the_open_partition():
+    # An edge not before now would leave an empty closed range; the open one takes it.
+    now = FIRST + BACKFILL_PARTITION_SPAN * 2
+    assert _partition_bounds(None, FIRST, now) == [
+        (None, FIRST + BACKFILL_PARTITION_SPAN),
+        (FIRST + BACKFILL_PARTITION_SPAN, None),
+    ]
+
+
+def test_first_partition_starts_after_the_sync_start():
+    starts_after = FIRST.replace(hour=0)
+    bounds = _partition_bounds(starts_after, FIRST, FIRST + BACKFILL_PARTITION_SPAN * 1.5)
+    assert bounds == [(starts_after, FIRST + BACKFILL_PARTITION_SPAN), (FIRST + BACKFILL_PARTITION_SPAN, None)]
+
+
+def test_edges_fall_on_whole_seconds():
+    # Edges are stored and compared as timestamps in whole seconds.
+    first = FIRST.replace(microsecond=750000)
+    bounds = _partition_bounds(None, first, first + BACKFILL_PARTITION_SPAN * 2.5)
+    assert all(edge.microsecond == 0 for bound in bounds for edge in bound if edge)
+    assert bounds[0][1] == FIRST + BACKFILL_PARTITION_SPAN
+
+
+def wallet_config() -> Wallets:
+    return Wallets(
+        id="config1",
+        user_id="user1",
+        wallet="wallet1",
+        pull_payments=False,
+        push_payments=True,
+        reconcile_name=None,
+        reconcile_mode=None,
+        xero_bank_account_id="account1",
+        fee_handling=False,
+        last_synced=None,
+        status=None,
+        notes=None,
+    )
+
+
+@pytest.fixture
+def history(monkeypatch, database):
+    """
+    Two partitions of history: the closed one always has a payment Xero rejects, the open-ended one succeeds.
+    Returns the (since, until) of every partition synced.
+    """
+    calls: list[tuple[int | None, datetime | None]] = []
+    first_payment = SimpleNamespace(time=datetime.now(timezone.utc) - BACKFILL_PARTITION_SPAN * 1.5)
+
+    async def get_payments_paginated(**kwargs):
+        return SimpleNamespace(data=[first_payment])
+
+    async def sync_payment_history(wallet_cfg, settings, access_token, tenant_id, since, until=None, **kwargs):
+        calls.append((since, until))
+        if until:
+            return {"pushed": 0, "skipped": 0, "failed": 1, "errors": []}
+        return {"pushed": 1, "skipped": 0, "failed": 0, "errors": []}
+
+    async def get_xero_connection(user_id):
+        return SimpleNamespace(user_id=user_id)
+
+    async def get_settings(user_id):
+        return ExtensionSettings()
+
+    async def ensure_xero_access_token(conn, settings):
+        return "token", "tenant1"
+
+    async def update_wallets(wallet_cfg):
+        return wallet_cfg
+
+    monkeypatch.setattr(services, "get_payments_paginated", get_payments_paginated)
+    monkeypatch.setattr(services, "_sync_payment_history", sync_payment_history)
+    monkeypatch.setattr(services, "get_xero_connection", get_xero_connection)
+    monkeypatch.setattr(services, "get_settings", get_settings)
+    monkeypatch.setattr(services, "ensure_xero_access_token", ensure_xero_access_token)
+    monkeypatch.setattr(services, "update_wallets", update_wallets)
+    return calls
+
+
+@pytest.mark.asyncio
+async def test_resume_sweeps_new_payments_and_gives_up_on_failing_partition(history):
+    wallet_cfg = wallet_config()
+    summary = await sync_wallet_payments(wallet_cfg)
+    assert summary["failed"] == 1
+    assert len(history) == 2
+    job = await get_running_sync_job("wallet1")
+    assert job
+
+    for _ in range(PARTITION_MAX_ATTEMPTS - 1):
+        history.clear()
+        summary = await sync_wallet_payments(wallet_cfg)
+        # The failed partition is retried and the finished open-ended one synced again.
+        assert [until is None for _, until in history] == [False, True]
+        assert summary["pushed"] == 1
+
+    # The failing partition has had all its attempts; the job is finished, not pinned open.
+    assert await get_running_sync_job("wallet1") is None
+    assert "left" not in (wallet_cfg.status or "")
+
+    history.clear()
+    await sync_wallet_payments(wallet_cfg)
+    new_job = await get_running_sync_job("wallet1")
+    assert new_job and new_job.id != job.id
+    assert len(history) == 2
+
+
+@pytest.mark.asyncio
+async def test_admin_sync_keeps_picking_up_new_payments(history, monkeypatch):
+    async def get_push_wallets():
+        return [wallet_config()]
+
+    monkeypatch.setattr(services, "get_push_wallets", get_push_wallets)
+    for _ in range(PARTITION_MAX_ATTEMPTS + 1):
+        history.clear()
+        progress = _idle_admin_sync()
+        await _sync_all_wallets(progress)
+        assert progress["wallets_done"] == 1
+        assert progress["pushed"] == 1
+        # Every run syncs the open-ended partition, however the old one fares.
+        assert any(until is None for _, until in history)
+
+
+def payment(i: int) -> Payment:
+    return Payment(
+        checking_id=f"checking{i}",
+        payment_hash=f"hash{i}",
+        wallet_id="wallet1",
+        amount=1_000_000,
+        fee=0,
+        bolt11="lnbc",
+        status="success",
+        time=datetime.now(timezone.utc),
+        extra={"wallet_fiat_currency": "USD", "wallet_fiat_amount": 1.5},
+    )
+
+
+@pytest.fixture
+def posted(monkeypatch, database):
+    """
+    Books every bank transaction, collecting the keys and retried keys of each post.
+    """
+    posts: list[tuple[list[str], set[str]]] = []
+
+    async def post_bank_transactions(access_token, tenant_id, bank_txs, keys=None, retried=None):
+        posts.append((list(keys or []), set(retried or ())))
+        return [{"status": "ok", "bank_transaction_id": f"bt{i}"} for i, _ in enumerate(bank_txs)]
+
+    async def apply_contact_ids(access_token, tenant_id, payloads):
+        pass
+
+    monkeypatch.setattr(services, "post_bank_transactions", post_bank_transactions)
+    monkeypatch.setattr(services, "apply_contact_ids", apply_contact_ids)
+    return posts
+
+
+@pytest.mark.asyncio
+async def test_failed_payment_is_posted_again_as_retried(posted):
+    wallet_cfg = wallet_config()
+    payments = [payment(1), payment(2)]
+    results = await push_payments_to_xero(payments, wallet_cfg, ExtensionSettings(), "token", "tenant1")
+    assert [result["status"] for result in results] == ["ok", "ok"]
+    assert posted[0][1] == set()
+
+    await mark_synced_payments_failed("wallet1", ["hash1"])
+    posted.clear()
+    results = await push_payments_to_xero(
+        [payments[0], payment(3)], wallet_cfg, ExtensionSettings(), "token", "tenant1"
+    )
+    assert [result["status"] for result in results] == ["ok", "ok"]
+    keys, retried = posted[0]
+    assert keys == [idempotency_key("wallet1", "hash1"), idempotency_key("wallet1", "hash3")]
+    # Sent alone under its own key, never in a batch whose key the first attempt did not use.
+    assert retried == {idempotency_key("wallet1", "hash1")}
+
+
+@pytest.mark.asyncio
+async def test_repushed_invoice_is_posted_under_a_new_key(monkeypatch, database):
+    posts: dict[str, tuple[list[str], set[str]]] = {}
+
+    def fake_post(kind: str, id_key: str):
+        async def post(access_token, tenant_id, items, keys=None, retried=None):
+            posts[kind] = (list(keys or []), set(retried or ()))
+            return [{"status": "ok", id_key: f"{kind}{i}"} for i, _ in enumerate(items)]
+
+        return post
+
+    monkeypatch.setattr(services, "post_invoices", fake_post("invoice", "invoice_id"))
+    monkeypatch.setattr(services, "post_payments", fake_post("payment", "payment_id"))
+    await reserve_synced_payments("user1", "wallet1", [("hash1", "USD", 1.5, None)], PUSH_LEASE)
+    # Xero voided the first invoice: the payment is queued to be posted again.
+    await requeue_synced_payment("wallet1", "hash1", keep_invoice=False)
+
+    invoice = {"Type": INVOICE_TYPE, "Date": "2025-01-01", "Reference": "LNbits payment hash1"}
+    results = await _post_invoices_with_payments(
+        [(0, payment(1), invoice, 1.5, "USD")], wallet_config(), "token", "tenant1", {"hash1"}
+    )
+    assert results[0]["status"] == "ok"
+    for kind in ("invoice", "payment"):
+        keys, retried = posts[kind]
+        assert keys == [idempotency_key("wallet1", "hash1", kind, "1")]
+        assert keys[0] != idempotency_key("wallet1", "hash1", kind)
+        assert retried == set(keys)
@@ -0,0 +1,242 @@
+import json
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+from .. import transport
+from ..transport import (
+    CIRCUIT_CLOSED,
+    CIRCUIT_HALF_OPEN,
+    CIRCUIT_OPEN,
+    XERO_BATCH_SIZE_STEP,
+    XERO_INITIAL_BATCH_SIZE,
+    XERO_MIN_BATCH_SIZE,
+    XERO_TARGET_LATENCY_SECONDS,
+    XeroBatchTuner,
+    XeroCircuitBreaker,
+    XeroCircuitOpenError,
+    idempotency_key,
+    post_bank_transactions,
+)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(transport.time, "monotonic", lambda: now[0])
+    return now
+
+
+def open_breaker(breaker: XeroCircuitBreaker) -> None:
+    for _ in range(breaker.failure_threshold):
+        breaker.acquire()
+        breaker.record_failure()
+
+
+def test_circuit_opens_after_threshold(clock):
+    breaker = XeroCircuitBreaker(failure_threshold=3, reset_timeout=60)
+    for _ in range(2):
+        breaker.acquire()
+        breaker.record_failure()
+    assert breaker.state == CIRCUIT_CLOSED
+    breaker.acquire()
+    breaker.record_failure()
+    assert breaker.state == CIRCUIT_OPEN
+    with pytest.raises(XeroCircuitOpenError):
+        breaker.acquire()
+
+
+def test_success_resets_failure_count(clock):
+    breaker = XeroCircuitBreaker(failure_threshold=3, reset_timeout=60)
+    for _ in range(2):
+        breaker.record_failure()
+    breaker.record_success()
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == CIRCUIT_CLOSED
+
+
+def test_half_open_lets_one_probe_through(clock):
+    breaker = XeroCircuitBreaker(failure_threshold=3, reset_timeout=60)
+    open_breaker(breaker)
+    clock[0] += 59
+    assert breaker.state == CIRCUIT_OPEN
+    clock[0] += 1
+    assert breaker.state == CIRCUIT_HALF_OPEN
+    assert not breaker.is_open
+
+    breaker.acquire()
+    assert breaker.state == CIRCUIT_HALF_OPEN
+    assert breaker.is_open
+    with pytest.raises(XeroCircuitOpenError):
+        breaker.acquire()
+
+
+def test_half_open_probe_success_closes(clock):
+    breaker = XeroCircuitBreaker(failure_threshold=3, reset_timeout=60)
+    open_breaker(breaker)
+    clock[0] += 60
+    breaker.acquire()
+    breaker.record_success()
+    assert breaker.state == CIRCUIT_CLOSED
+    # Failures count from zero again.
+    breaker.record_failure()
+    assert breaker.state == CIRCUIT_CLOSED
+
+
+def test_half_open_probe_failure_reopens(clock):
+    breaker = XeroCircuitBreaker(failure_threshold=3, reset_timeout=60)
+    open_breaker(breaker)
+    clock[0] += 60
+    breaker.acquire()
+    breaker.record_failure()
+    assert breaker.state == CIRCUIT_OPEN
+    # The reset timeout starts over from the failed probe.
+    clock[0] += 59
+    assert breaker.state == CIRCUIT_OPEN
+    clock[0] += 1
+    assert breaker.state == CIRCUIT_HALF_OPEN
+
+
+def test_half_open_probe_released_lets_another_through(clock):
+    breaker = XeroCircuitBreaker(failure_threshold=3, reset_timeout=60)
+    open_breaker(breaker)
+    clock[0] += 60
+    breaker.acquire()
+    breaker.release()
+    assert not breaker.is_open
+    breaker.acquire()
+    assert breaker.is_open
+
+
+def test_tuner_grows_batches_additively_up_to_ceiling():
+    tuner = XeroBatchTuner(max_batch_size=30, max_concurrency=3)
+    assert (tuner.batch_size, tuner.concurrency) == (XERO_INITIAL_BATCH_SIZE, 1)
+    tuner.record_healthy(0.1)
+    assert tuner.batch_size == XERO_INITIAL_BATCH_SIZE + XERO_BATCH_SIZE_STEP
+    for _ in range(100):
+        tuner.record_healthy(0.1)
+    assert (tuner.batch_size, tuner.concurrency) == (30, 3)
+
+
+def test_tuner_adds_concurrency_only_at_full_batch_size():
+    tuner = XeroBatchTuner(max_batch_size=XERO_INITIAL_BATCH_SIZE + XERO_BATCH_SIZE_STEP, max_concurrency=3)
+    tuner.record_healthy(0.1)
+    assert tuner.concurrency == 1
+    tuner.record_healthy(0.1)
+    assert tuner.concurrency == 2
+
+
+def test_tuner_halves_down_to_floor():
+    tuner = XeroBatchTuner(max_batch_size=50, max_concurrency=5)
+    for _ in range(100):
+        tuner.record_healthy(0.1)
+    tuner.record_congestion()
+    assert (tuner.batch_size, tuner.concurrency) == (25, 2)
+    for _ in range(20):
+        tuner.record_congestion()
+    assert (tuner.batch_size, tuner.concurrency) == (XERO_MIN_BATCH_SIZE, 1)
+
+
+def test_tuner_treats_slow_batches_as_congestion():
+    tuner = XeroBatchTuner(max_batch_size=50, max_concurrency=5)
+    tuner.record_healthy(XERO_TARGET_LATENCY_SECONDS + 1)
+    assert tuner.batch_size == XERO_INITIAL_BATCH_SIZE // 2
+    assert (tuner.healthy, tuner.congested) == (0, 1)
+
+
+def test_tuner_starts_within_a_small_ceiling():
+    tuner = XeroBatchTuner(max_batch_size=3, max_concurrency=1)
+    assert tuner.batch_size == 3
+    for _ in range(10):
+        tuner.record_healthy(0.1)
+    assert (tuner.batch_size, tuner.concurrency) == (3, 1)
+
+
+@pytest.fixture
+def xero_api(monkeypatch):
+    """
+    A mock Xero API answering each POST from `responses` in turn, then by booking every item.
+    Collects the requests it was sent.
+    """
+    api = SimpleNamespace(requests=[], responses=[])
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        api.requests.append(request)
+        if api.responses:
+            return api.responses.pop(0)
+        items = json.loads(request.content)["BankTransactions"]
+        return httpx.Response(
+            200, json={"BankTransactions": [{"BankTransactionID": f"bt-{item['Reference']}"} for item in items]}
+        )
+
+    monkeypatch.setattr(transport, "_http_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    monkeypatch.setattr(transport, "XERO_TRANSIENT_RETRY_DELAY", 0)
+    for registry in ("_rate_limiters", "_circuit_breakers", "_batch_tuners"):
+        monkeypatch.setattr(transport, registry, {})
+    return api
+
+
+def sent(request: httpx.Request) -> tuple[str | None, list[str]]:
+    items = json.loads(request.content)["BankTransactions"]
+    return request.headers.get("Idempotency-Key"), [item["Reference"] for item in items]
+
+
+def bank_txs(*references: str) -> tuple[list[dict], list[str]]:
+    return [{"Reference": reference} for reference in references], [
+        idempotency_key("wallet1", reference) for reference in references
+    ]
+
+
+@pytest.mark.asyncio
+async def test_batch_retry_reuses_its_idempotency_key(xero_api):
+    xero_api.responses.append(httpx.Response(503, text="busy"))
+    txs, keys = bank_txs("a", "b", "c")
+    results = await post_bank_transactions("token", "tenant1", txs, keys)
+    assert [result["bank_transaction_id"] for result in results] == ["bt-a", "bt-b", "bt-c"]
+    assert len(xero_api.requests) == 2
+    first, retry = (sent(request) for request in xero_api.requests)
+    assert first == retry
+    assert first[0] not in keys
+
+
+@pytest.mark.asyncio
+async def test_uncertain_batch_failure_is_flagged(xero_api):
+    xero_api.responses.extend(httpx.Response(503, text="busy") for _ in range(transport.XERO_MAX_TRANSIENT_RETRIES + 1))
+    txs, keys = bank_txs("a", "b")
+    results = await post_bank_transactions("token", "tenant1", txs, keys)
+    assert all(result["status"] == "error" and result["uncertain"] for result in results)
+    assert len({sent(request)[0] for request in xero_api.requests}) == 1
+
+
+@pytest.mark.asyncio
+async def test_retried_item_is_sent_alone_under_its_own_key(xero_api):
+    txs, keys = bank_txs("a", "b", "c")
+    await post_bank_transactions("token", "tenant1", txs, keys)
+    assert len(xero_api.requests) == 1
+    batch_key = sent(xero_api.requests[0])[0]
+
+    xero_api.requests.clear()
+    txs, keys = bank_txs("b", "d", "e")
+    results = await post_bank_transactions("token", "tenant1", txs, keys, {keys[0]})
+    assert [result["bank_transaction_id"] for result in results] == ["bt-b", "bt-d", "bt-e"]
+    alone, rest = (sent(request) for request in xero_api.requests)
+    assert alone == (keys[0], ["b"])
+    assert alone[0] != batch_key
+    assert rest[1] == ["d", "e"]
+    assert rest[0] not in (batch_key, keys[0])
+
+
+@pytest.mark.asyncio
+async def test_batch_key_does_not_depend_on_order(xero_api):
+    txs, keys = bank_txs("a", "b", "c")
+    await post_bank_transactions("token", "tenant1", txs, keys)
+    await post_bank_transactions("token", "tenant1", txs[::-1], keys[::-1])
+    forward, backward = (sent(request) for request in xero_api.requests)
+    assert forward[0] == backward[0]
+    assert backward[1] == ["c", "b", "a"]
+
+    txs, keys = bank_txs("a", "b", "d")
+    await post_bank_transactions("token", "tenant1", txs, keys)
+    assert sent(xero_api.requests[-1])[0] != forward[0]
@@ -0,0 +1,71 @@
+import json
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from .. import webhooks, xerosync_ext
+from ..models import UserExtensionSettings
+from ..webhooks import verify_xero_webhook, webhook_queue, xero_signature
+
+WEBHOOK_KEY = "test-webhook-key"
+
+
+@pytest.fixture(autouse=True)
+def webhook_settings(monkeypatch):
+    async def get_webhook_settings():
+        return [UserExtensionSettings(id="user1", xero_webhook_key=WEBHOOK_KEY)]
+
+    monkeypatch.setattr(webhooks, "get_webhook_settings", get_webhook_settings)
+    yield
+    while not webhook_queue.empty():
+        webhook_queue.get_nowait()
+
+
+async def post_webhook(body: bytes, signature: str | None) -> httpx.Response:
+    app = FastAPI()
+    app.include_router(xerosync_ext)
+    headers = {"x-xero-signature": signature} if signature is not None else {}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        return await client.post("/xerosync/webhooks/xero", content=body, headers=headers)
+
+
+@pytest.mark.asyncio
+async def test_verify_valid_signature():
+    body = b'{"events": []}'
+    assert await verify_xero_webhook(body, xero_signature(body, WEBHOOK_KEY)) == "user1"
+
+
+@pytest.mark.asyncio
+async def test_verify_bad_signature():
+    body = b'{"events": []}'
+    assert await verify_xero_webhook(body, xero_signature(body, "another-key")) is None
+    assert await verify_xero_webhook(body, xero_signature(b'{"events": [{}]}', WEBHOOK_KEY)) is None
+    assert await verify_xero_webhook(body, None) is None
+
+
+@pytest.mark.asyncio
+async def test_intent_to_receive_handshake():
+    # Xero sends a delivery with no events and expects an empty 200 only when it is correctly signed.
+    body = json.dumps({"events": [], "firstEventSequence": 0, "lastEventSequence": 0, "entropy": "ABC"}).encode()
+    resp = await post_webhook(body, xero_signature(body, WEBHOOK_KEY))
+    assert resp.status_code == 200
+    assert resp.content == b""
+    assert webhook_queue.empty()
+
+    resp = await post_webhook(body, xero_signature(body, "another-key"))
+    assert resp.status_code == 401
+    assert resp.content == b""
+
+    resp = await post_webhook(body, None)
+    assert resp.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_signed_events_are_queued():
+    event = {"resourceId": "inv1", "tenantId": "tenant1", "eventCategory": "INVOICE"}
+    body = json.dumps({"events": [event, event]}).encode()
+    resp = await post_webhook(body, xero_signature(body, WEBHOOK_KEY))
+    assert resp.status_code == 200
+    assert webhook_queue.get_nowait() == ("user1", event)
+    assert webhook_queue.empty()
@@ -0,0 +1,127 @@
+import os
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import TextIO
+
+from loguru import logger
+
+# Set XEROSYNC_TRACE_EXPORTER to "console" or to a file path to export push spans through
+# OpenTelemetry (requires the opentelemetry-sdk package). Unset, only timings are kept.
+TRACE_EXPORTER = os.getenv("XEROSYNC_TRACE_EXPORTER", "")
+# Log a structured line for pushes slower than this; 0 disables the log.
+SLOW_PUSH_MS = float(os.getenv("XEROSYNC_SLOW_PUSH_MS", "2000"))
+
+_current_trace: ContextVar["PushTrace | None"] = ContextVar("xerosync_push_trace", default=None)
+_tracer = None
+_tracer_loaded = False
+_provider = None
+_trace_file: TextIO | None = None
+
+
+class PushTrace:
+    """
+    Per-stage timings of one push. Stages entered more than once are summed.
+    """
+
+    def __init__(self, name: str, **attributes):
+        self.name = name
+        self.attributes = attributes
+        self.stages: dict[str, float] = {}
+        self.started = time.perf_counter()
+
+    def add(self, stage: str, elapsed_ms: float) -> None:
+        self.stages[stage] = self.stages.get(stage, 0.0) + elapsed_ms
+
+    @property
+    def total_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def log_if_slow(self) -> None:
+        total = self.total_ms
+        if not SLOW_PUSH_MS or total < SLOW_PUSH_MS:
+            return
+        fields = {**self.attributes, "total_ms": round(total), **{k: round(v) for k, v in self.stages.items()}}
+        logger.warning(f"Xero Sync: slow push {self.name} " + " ".join(f"{k}={v}" for k, v in fields.items()))
+
+
+def _get_tracer():
+    global _tracer, _tracer_loaded, _provider, _trace_file
+    if _tracer_loaded:
+        return _tracer
+    _tracer_loaded = True
+    if not TRACE_EXPORTER:
+        return None
+    try:
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+    except ImportError:
+        logger.warning("Xero Sync: XEROSYNC_TRACE_EXPORTER is set but opentelemetry-sdk is not installed")
+        return None
+
+    if TRACE_EXPORTER == "console":
+        exporter = ConsoleSpanExporter()
+    else:
+        _trace_file = open(TRACE_EXPORTER, "a")
+        exporter = ConsoleSpanExporter(out=_trace_file)
+    _provider = TracerProvider()
+    _provider.add_span_processor(BatchSpanProcessor(exporter))
+    _tracer = _provider.get_tracer("xerosync")
+    return _tracer
+
+
+def shutdown_tracing() -> None:
+    """
+    Flush pending spans and close the trace file; the tracer is set up again on the next push.
+    """
+    global _tracer, _tracer_loaded, _provider, _trace_file
+    if _provider:
+        _provider.shutdown()
+    if _trace_file:
+        _trace_file.close()
+    _tracer, _tracer_loaded, _provider, _trace_file = None, False, None, None
+
+
+def _otel_span(name: str, attributes: dict | None = None):
+    tracer = _get_tracer()
+    if not tracer:
+        return nullcontext()
+    return tracer.start_as_current_span(name, attributes=attributes)
+
+
+@contextmanager
+def push_trace(name: str, **attributes):
+    """
+    Trace one push. Nested inside another push trace it is recorded as a stage of that trace.
+    """
+    if _current_trace.get() is not None:
+        with span(name):
+            yield
+        return
+
+    trace = PushTrace(name, **attributes)
+    token = _current_trace.set(trace)
+    try:
+        with _otel_span(f"xerosync.{name}", {k: str(v) for k, v in attributes.items()}):
+            yield
+    finally:
+        _current_trace.reset(token)
+        trace.log_if_slow()
+
+
+@contextmanager
+def span(stage: str):
+    """
+    Time one stage of the current push trace; a no-op outside a push.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+
+    started = time.perf_counter()
+    try:
+        with _otel_span(f"xerosync.{stage}"):
+            yield
+    finally:
+        trace.add(stage, (time.perf_counter() - started) * 1000)
@@ -0,0 +1,516 @@
+import asyncio
+import hashlib
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+import httpx
+from loguru import logger
+
+XERO_API_BASE = "https://api.xero.com/api.xro/2.0"
+XERO_TOKEN_URL = "https://identity.xero.com/connect/token"
+# Xero accepts arrays of BankTransactions; keep each request well below the payload limit.
+XERO_BATCH_SIZE = 50
+# Batch size and parallel batches adapt per tenant (AIMD): they grow by a step after each healthy
+# batch and are halved on 429, 5xx, timeouts or a batch slower than the target latency.
+XERO_MIN_BATCH_SIZE = 1
+XERO_INITIAL_BATCH_SIZE = 10
+XERO_BATCH_SIZE_STEP = 5
+XERO_TARGET_LATENCY_SECONDS = 5.0
+# Xero limits each tenant to 60 calls per minute and 5 concurrent calls.
+XERO_CALLS_PER_MINUTE = 60
+XERO_MAX_CONCURRENT_CALLS = 5
+XERO_MAX_RATE_LIMIT_RETRIES = 3
+# Timeouts and 5xx on BankTransactions posts are retried with the same Idempotency-Key,
+# so Xero replays the original response instead of creating the transactions twice.
+XERO_MAX_TRANSIENT_RETRIES = 2
+XERO_TRANSIENT_RETRY_DELAY = 1.0
+# Open a tenant's circuit after this many consecutive failures (timeouts, connection errors, 5xx)
+# and keep it open this long before letting a probe call through.
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_SECONDS = 60
+
+# All Xero calls share one pooled client, so connections are reused across tenants.
+XERO_HTTP_LIMITS = httpx.Limits(max_connections=50, max_keepalive_connections=20)
+XERO_HTTP_TIMEOUT = 10
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half-open"
+
+
+class XeroCircuitOpenError(RuntimeError):
+    """
+    Raised instead of calling Xero while the tenant's circuit is open.
+    """
+
+
+class XeroRateLimiter:
+    """
+    Per-tenant limiter: a sliding one-minute call window plus a concurrency cap.
+    """
+
+    def __init__(
+        self,
+        calls_per_minute: int = XERO_CALLS_PER_MINUTE,
+        max_concurrent: int = XERO_MAX_CONCURRENT_CALLS,
+    ):
+        self.calls_per_minute = calls_per_minute
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._calls: deque[float] = deque()
+        self._lock = asyncio.Lock()
+
+    async def _wait_for_window(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                while self._calls and now - self._calls[0] >= 60:
+                    self._calls.popleft()
+                if len(self._calls) < self.calls_per_minute:
+                    self._calls.append(now)
+                    return
+                await asyncio.sleep(60 - (now - self._calls[0]))
+
+    @asynccontextmanager
+    async def slot(self):
+        async with self._semaphore:
+            await self._wait_for_window()
+            yield
+
+
+class XeroCircuitBreaker:
+    """
+    Per-tenant circuit breaker. Opens after `failure_threshold` consecutive failures and
+    rejects calls for `reset_timeout` seconds; then one half-open probe is let through,
+    which closes the circuit on success or re-opens it on failure.
+    """
+
+    def __init__(
+        self,
+        tenant_id: str = "",
+        failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+        reset_timeout: float = CIRCUIT_RESET_SECONDS,
+    ):
+        self.tenant_id = tenant_id
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: float | None = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return CIRCUIT_CLOSED
+        if self._probing or time.monotonic() - self._opened_at >= self.reset_timeout:
+            return CIRCUIT_HALF_OPEN
+        return CIRCUIT_OPEN
+
+    @property
+    def is_open(self) -> bool:
+        """
+        True while a call would be rejected: open, or half-open with the probe already in flight.
+        """
+        state = self.state
+        return state == CIRCUIT_OPEN or (state == CIRCUIT_HALF_OPEN and self._probing)
+
+    def acquire(self) -> None:
+        if self.is_open:
+            raise XeroCircuitOpenError("Xero Sync: Xero is unavailable, circuit open")
+        if self.state == CIRCUIT_HALF_OPEN:
+            self._probing = True
+
+    def release(self) -> None:
+        """
+        End a call that neither proved nor disproved Xero's health (e.g. cancelled).
+        """
+        self._probing = False
+
+    def record_success(self) -> None:
+        if self._opened_at is not None:
+            logger.info(f"Xero Sync: circuit closed for tenant {self.tenant_id}")
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        self._probing = False
+        if self._opened_at is None and self._failures < self.failure_threshold:
+            return
+        if self._opened_at is None:
+            logger.warning(f"Xero Sync: circuit opened for tenant {self.tenant_id} after {self._failures} failures")
+        self._opened_at = time.monotonic()
+
+
+class XeroBatchTuner:
+    """
+    Per-tenant batch size and batch concurrency, tuned from each batch's outcome:
+    additive increase while Xero answers quickly, multiplicative decrease when it pushes back.
+    """
+
+    def __init__(
+        self,
+        max_batch_size: int = XERO_BATCH_SIZE,
+        max_concurrency: int = XERO_MAX_CONCURRENT_CALLS,
+    ):
+        self.max_batch_size = max_batch_size
+        self.max_concurrency = max_concurrency
+        self.batch_size = min(XERO_INITIAL_BATCH_SIZE, max_batch_size)
+        self.concurrency = 1
+        self.latency: float | None = None
+        self.healthy = 0
+        self.congested = 0
+
+    def record_healthy(self, latency: float) -> None:
+        self._observe(latency)
+        if latency > XERO_TARGET_LATENCY_SECONDS:
+            self.record_congestion()
+            return
+        self.healthy += 1
+        if self.batch_size < self.max_batch_size:
+            self.batch_size = min(self.batch_size + XERO_BATCH_SIZE_STEP, self.max_batch_size)
+        else:
+            # Only add parallel batches once batches are as large as they go.
+            self.concurrency = min(self.concurrency + 1, self.max_concurrency)
+
+    def record_congestion(self) -> None:
+        self.congested += 1
+        self.batch_size = max(self.batch_size // 2, XERO_MIN_BATCH_SIZE)
+        self.concurrency = max(self.concurrency // 2, 1)
+
+    def _observe(self, latency: float) -> None:
+        # Exponentially weighted, for the metrics only.
+        self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+
+    def metrics(self) -> dict:
+        return {
+            "batch_size": self.batch_size,
+            "concurrency": self.concurrency,
+            "latency_ms": round(self.latency * 1000) if self.latency is not None else None,
+            "healthy_batches": self.healthy,
+            "congested_batches": self.congested,
+        }
+
+
+_rate_limiters: dict[str, XeroRateLimiter] = {}
+_circuit_breakers: dict[str, XeroCircuitBreaker] = {}
+_batch_tuners: dict[str, XeroBatchTuner] = {}
+_http_client: httpx.AsyncClient | None = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(limits=XERO_HTTP_LIMITS, timeout=XERO_HTTP_TIMEOUT)
+    return _http_client
+
+
+async def close_http_client() -> None:
+    global _http_client
+    if _http_client is not None:
+        client, _http_client = _http_client, None
+        await client.aclose()
+
+
+def get_rate_limiter(tenant_id: str) -> XeroRateLimiter:
+    limiter = _rate_limiters.get(tenant_id)
+    if not limiter:
+        limiter = XeroRateLimiter()
+        _rate_limiters[tenant_id] = limiter
+    return limiter
+
+
+def get_circuit_breaker(tenant_id: str) -> XeroCircuitBreaker:
+    breaker = _circuit_breakers.get(tenant_id)
+    if not breaker:
+        breaker = XeroCircuitBreaker(tenant_id)
+        _circuit_breakers[tenant_id] = breaker
+    return breaker
+
+
+def get_batch_tuner(tenant_id: str) -> XeroBatchTuner:
+    tuner = _batch_tuners.get(tenant_id)
+    if not tuner:
+        tuner = XeroBatchTuner()
+        _batch_tuners[tenant_id] = tuner
+    return tuner
+
+
+def get_transport_metrics() -> dict:
+    """
+    Current batch tuning and circuit state per tenant.
+    """
+    return {
+        tenant_id: {**tuner.metrics(), "circuit": get_circuit_breaker(tenant_id).state}
+        for tenant_id, tuner in _batch_tuners.items()
+    }
+
+
+async def _guarded_send(tenant_id: str, method: str, url: str, **kwargs) -> httpx.Response:
+    """
+    Send one HTTP call through the tenant's circuit breaker.
+    """
+    breaker = get_circuit_breaker(tenant_id)
+    breaker.acquire()
+    try:
+        resp = await get_http_client().request(method, url, **kwargs)
+    except httpx.TransportError:
+        breaker.record_failure()
+        raise
+    except BaseException:
+        breaker.release()
+        raise
+    if resp.status_code >= 500:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    return resp
+
+
+async def xero_token_request(tenant_id: str, data: dict) -> httpx.Response:
+    """
+    Refresh grant against Xero's identity service, through the tenant's circuit breaker.
+    """
+    return await _guarded_send(tenant_id, "POST", XERO_TOKEN_URL, data=data)
+
+
+async def xero_request(
+    method: str,
+    path: str,
+    access_token: str,
+    tenant_id: str,
+    json: dict | None = None,
+    params: dict | None = None,
+    idempotency_key: str | None = None,
+) -> httpx.Response:
+    """
+    Send one call to the Xero accounting API within the tenant's rate budget.
+    Retries on HTTP 429, honouring Retry-After.
+    Pass `idempotency_key` on writes so a repeated call cannot create duplicates.
+    Raises XeroCircuitOpenError without any network I/O while the tenant's circuit is open.
+    """
+    limiter = get_rate_limiter(tenant_id)
+    headers = {
+        "Authorization": f"Bearer {access_token}",
+        "xero-tenant-id": tenant_id,
+        "Accept": "application/json",
+    }
+    if json is not None:
+        headers["Content-Type"] = "application/json"
+    if idempotency_key:
+        headers["Idempotency-Key"] = idempotency_key
+
+    for attempt in range(XERO_MAX_RATE_LIMIT_RETRIES + 1):
+        # Fail fast rather than queue for a rate-limit slot behind an open circuit.
+        if get_circuit_breaker(tenant_id).is_open:
+            raise XeroCircuitOpenError("Xero Sync: Xero is unavailable, circuit open")
+        async with limiter.slot():
+            resp = await _guarded_send(
+                tenant_id, method, f"{XERO_API_BASE}/{path}", json=json, params=params, headers=headers
+            )
+        if resp.status_code != 429:
+            return resp
+        get_batch_tuner(tenant_id).record_congestion()
+        if attempt == XERO_MAX_RATE_LIMIT_RETRIES:
+            return resp
+        retry_after = _retry_after_seconds(resp)
+        logger.warning(f"Xero Sync: rate limited by Xero, retrying in {retry_after}s")
+        await asyncio.sleep(retry_after)
+    return resp
+
+
+def idempotency_key(*parts: str) -> str:
+    """
+    Stable Idempotency-Key for a write, e.g. idempotency_key(wallet_id, payment_hash).
+    """
+    return hashlib.sha256(":".join(parts).encode()).hexdigest()
+
+
+def _batch_idempotency_key(keys: list[str]) -> str:
+    # A single item keeps its own key; a batch is keyed by its membership, not its order.
+    if len(keys) == 1:
+        return keys[0]
+    return idempotency_key(*sorted(keys))
+
+
+def _retry_after_seconds(resp: httpx.Response) -> float:
+    try:
+        return max(float(resp.headers.get("Retry-After", "1")), 1.0)
+    except ValueError:
+        return 1.0
+
+
+def _parse_batch_results(
+    resp: httpx.Response, collection: str, id_field: str, id_key: str, expected: int
+) -> list[dict]:
+    """
+    Map a `summarizeErrors=false` batch response to one result per posted item.
+    """
+    try:
+        body = resp.json()
+    except Exception:
+        body = None
+    items = body.get(collection) if isinstance(body, dict) else None
+    if not isinstance(items, list) or len(items) != expected:
+        # Xero accepted the call, so the items may well be booked.
+        return [{"status": "error", "reason": "unexpected Xero response", "uncertain": True} for _ in range(expected)]
+
+    results = []
+    for item in items:
+        if item.get("StatusAttributeString") == "ERROR" or item.get("HasValidationErrors") or item.get("HasErrors"):
+            messages = [err.get("Message") for err in item.get("ValidationErrors") or [] if err.get("Message")]
+            results.append({"status": "error", "reason": "; ".join(messages) or "validation error"})
+        else:
+            results.append({"status": "ok", id_key: item.get(id_field)})
+    return results
+
+
+async def post_bank_transactions(
+    access_token: str,
+    tenant_id: str,
+    bank_txs: list[dict],
+    keys: list[str] | None = None,
+    retried: set[str] | None = None,
+) -> list[dict]:
+    """
+    Post BankTransactions in batches (one rate-limited API call per batch), sized and run
+    in parallel as the tenant's `XeroBatchTuner` currently allows, up to XERO_BATCH_SIZE each.
+    `keys` are per-transaction idempotency keys (see `idempotency_key`); each batch is sent
+    with a key derived from its members, and retried with that key on timeouts and 5xx.
+    Batches are cut differently from one push to the next, so transactions whose key is in
+    `retried` (posted before) are each sent alone, under their own key.
+    Returns one result dict per transaction, in input order:
+    {"status": "ok", "bank_transaction_id": ...} or {"status": "error", "reason": ..., "code": ...}.
+    Errors that may clear on their own (open circuit, timeouts, 429/5xx) carry "retryable": True;
+    those of batches Xero may have booked anyway (timeouts, 5xx) also carry "uncertain": True.
+    """
+    return await _post_batches(
+        access_token, tenant_id, "BankTransactions", "BankTransactionID", "bank_transaction_id", bank_txs, keys, retried
+    )
+
+
+async def post_invoices(
+    access_token: str,
+    tenant_id: str,
+    invoices: list[dict],
+    keys: list[str] | None = None,
+    retried: set[str] | None = None,
+) -> list[dict]:
+    """
+    Post Invoices in batches, like `post_bank_transactions`; ok results carry "invoice_id".
+    """
+    return await _post_batches(access_token, tenant_id, "Invoices", "InvoiceID", "invoice_id", invoices, keys, retried)
+
+
+async def post_payments(
+    access_token: str,
+    tenant_id: str,
+    payments: list[dict],
+    keys: list[str] | None = None,
+    retried: set[str] | None = None,
+) -> list[dict]:
+    """
+    Post invoice Payments in batches, like `post_bank_transactions`; ok results carry "payment_id".
+    """
+    return await _post_batches(access_token, tenant_id, "Payments", "PaymentID", "payment_id", payments, keys, retried)
+
+
+async def _post_batches(
+    access_token: str,
+    tenant_id: str,
+    collection: str,
+    id_field: str,
+    id_key: str,
+    items: list[dict],
+    keys: list[str] | None,
+    retried: set[str] | None = None,
+) -> list[dict]:
+    tuner = get_batch_tuner(tenant_id)
+    # An item posted before may have been booked under its earlier batch's key: a new batch
+    # would carry a new key, so it goes alone under its own.
+    alone = [index for index in range(len(items)) if keys and keys[index] in (retried or ())]
+    grouped = [index for index in range(len(items)) if not (keys and keys[index] in (retried or ()))]
+    results: list[dict] = [{} for _ in items]
+    while alone or grouped:
+        # Each round is cut with the tuner's current values, so it adapts to the previous round.
+        batches: list[list[int]] = []
+        while len(batches) < tuner.concurrency and (alone or grouped):
+            if alone:
+                batches.append([alone.pop(0)])
+            else:
+                batches.append(grouped[: tuner.batch_size])
+                del grouped[: tuner.batch_size]
+        outcomes = await asyncio.gather(
+            *(
+                _post_batch(
+                    access_token,
+                    tenant_id,
+                    collection,
+                    id_field,
+                    id_key,
+                    [items[index] for index in batch],
+                    _batch_idempotency_key([keys[index] for index in batch]) if keys else None,
+                )
+                for batch in batches
+            )
+        )
+        for batch, batch_results in zip(batches, outcomes, strict=True):
+            for index, result in zip(batch, batch_results, strict=True):
+                results[index] = result
+    return results
+
+
+async def _post_batch(
+    access_token: str,
+    tenant_id: str,
+    collection: str,
+    id_field: str,
+    id_key: str,
+    chunk: list[dict],
+    key: str | None,
+) -> list[dict]:
+    # Without an idempotency key a retry after a timeout could create the batch twice.
+    attempts = XERO_MAX_TRANSIENT_RETRIES + 1 if key else 1
+    tuner = get_batch_tuner(tenant_id)
+    error: dict = {}
+    # Set once an attempt may have reached Xero without an answer: the batch may be booked.
+    uncertain = False
+
+    def failed(error: dict) -> list[dict]:
+        return [{**error, "uncertain": True} if uncertain else dict(error) for _ in chunk]
+
+    for attempt in range(attempts):
+        if attempt:
+            await asyncio.sleep(XERO_TRANSIENT_RETRY_DELAY * attempt)
+        started = time.monotonic()
+        try:
+            resp = await xero_request(
+                "POST",
+                collection,
+                access_token,
+                tenant_id,
+                json={collection: chunk},
+                params={"summarizeErrors": "false"},
+                idempotency_key=key,
+            )
+        except XeroCircuitOpenError as exc:
+            return failed({"status": "error", "reason": str(exc), "retryable": True})
+        except Exception as exc:
+            logger.error(f"Xero Sync: batch of {len(chunk)} {collection} failed: {exc}")
+            tuner.record_congestion()
+            error = {"status": "error", "reason": str(exc), "retryable": True}
+            uncertain = True
+            continue
+        if resp.status_code >= 300:
+            logger.error(f"Xero Sync: batch of {len(chunk)} {collection} failed ({resp.status_code}): {resp.text}")
+            error = {"status": "error", "reason": resp.text, "code": resp.status_code}
+            error["retryable"] = resp.status_code == 429 or resp.status_code >= 500
+            if resp.status_code >= 500:
+                uncertain = True
+                tuner.record_congestion()
+                continue
+            return failed(error)
+        tuner.record_healthy(time.monotonic() - started)
+        return _parse_batch_results(resp, collection, id_field, id_key, len(chunk))
+    return failed(error)
@@ -1,10 +1,11 @@
+import json
 import secrets
 from datetime import datetime, timedelta, timezone
 from urllib.parse import urlencode
 
 import httpx
 from fastapi import APIRouter, Depends, Request
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, Response
 from lnbits.core.models import User
 from lnbits.decorators import check_user_exists
 from lnbits.helpers import template_renderer
@@ -12,7 +13,9 @@ from loguru import logger
 
 from .crud import update_extension_settings, upsert_xero_connection
 from .models import CreateXeroConnection, ExtensionSettings
-from .services import XERO_API_BASE, XERO_TOKEN_URL, get_settings
+from .services import get_settings
+from .transport import XERO_API_BASE, XERO_TOKEN_URL
+from .webhooks import enqueue_xero_events, verify_xero_webhook
 
 xerosync_generic_router = APIRouter()
 
@@ -117,6 +120,26 @@ async def xero_oauth_callback(request: Request, code: str | None = None, state:
     return HTMLResponse(html)
 
 
+@xerosync_generic_router.post("/webhooks/xero")
+async def xero_webhook(request: Request):
+    """
+    Xero event notifications, including the intent-to-receive handshake (a delivery with no events).
+    Xero expects an empty 200 for a valid signature and 401 otherwise; events are processed later.
+    """
+    body = await request.body()
+    user_id = await verify_xero_webhook(body, request.headers.get("x-xero-signature"))
+    if not user_id:
+        return Response(status_code=401)
+    try:
+        events = json.loads(body).get("events") or []
+    except (ValueError, AttributeError):
+        return Response(status_code=400)
+    if not enqueue_xero_events(user_id, events):
+        logger.warning(f"Xero Sync: webhook queue full, refusing {len(events)} event(s) for user {user_id}")
+        return Response(status_code=503)
+    return Response(status_code=200)
+
+
 def _consume_oauth_state(request: Request, state: str) -> str | None:
     stored_state = request.session.get("xero_oauth_state")
     user_id = request.session.get("xero_oauth_user_id")
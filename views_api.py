@@ -1,44 +1,61 @@
-from datetime import date
+import asyncio
+import csv
+import io
+from collections.abc import AsyncIterator
+from datetime import date, datetime
 from http import HTTPStatus
 
 from fastapi import APIRouter, Depends
 from fastapi.exceptions import HTTPException
-
+from fastapi.responses import StreamingResponse
 from lnbits.core.models import SimpleStatus, User
 from lnbits.db import Filters, Page
 from lnbits.decorators import (
     check_account_id_exists,
+    check_admin,
     check_user_exists,
     parse_filters,
 )
 from lnbits.helpers import generate_filter_params_openapi
+from loguru import logger
 
+from .bloom import get_payment_filter_metrics
 from .crud import (
     create_wallets,
     delete_synced_payments_by_wallet,
     delete_wallets,
+    get_synced_payments_paginated,
     get_wallets,
     get_wallets_paginated,
     get_xero_connection,
+    iter_synced_payments,
     update_wallets,
 )
+from .metadata import METADATA_ACCOUNTS, METADATA_TAX_RATES, get_xero_metadata
 from .models import (
     CreateWallets,
     ExtensionSettings,  #
+    SyncedPayment,
+    SyncedPaymentsFilters,
     Wallets,
     WalletsFilters,
 )
+from .push_plan import invalidate_push_plan
 from .services import (
-    ensure_xero_access_token,
-    fetch_xero_accounts,
-    fetch_xero_bank_accounts,
-    fetch_xero_tax_rates_raw,
+    AdminSyncProgress,
+    SyncPlan,
+    get_admin_sync_progress,
     get_settings,  #
+    plan_wallet_sync,
+    start_admin_sync,
     sync_wallet_payments,
     update_settings,  #
 )
+from .tasks import get_intake_metrics
+from .transport import get_transport_metrics
 
 wallets_filters = parse_filters(WalletsFilters)
+synced_payments_filters = parse_filters(SyncedPaymentsFilters)
 
 xerosync_api_router = APIRouter()
 
@@ -65,6 +82,7 @@ async def api_update_wallets(
     if wallets.user_id != user.id:
         raise HTTPException(HTTPStatus.FORBIDDEN, "You do not own this wallets.")
     wallets = await update_wallets(Wallets(**{**wallets.dict(), **data.dict()}))
+    invalidate_push_plan(wallets.id)
     return wallets
 
 
@@ -120,6 +138,7 @@ async def api_delete_wallets(
     if not wallets:
         raise HTTPException(HTTPStatus.NOT_FOUND, "Wallets not found.")
     await delete_wallets(user.id, wallets_id)
+    invalidate_push_plan(wallets_id)
     if clear_client_data is True:
         await delete_synced_payments_by_wallet(wallets.wallet)
     return SimpleStatus(success=True, message="Wallets Deleted")
@@ -128,7 +147,7 @@ async def api_delete_wallets(
 @xerosync_api_router.post(
     "/api/v1/wallets/{wallets_id}/push",
     name="Push Wallet Payments",
-    summary="Push all current successful incoming payments to Xero.",
+    summary="Push all current successful payments to Xero.",
     response_description="Push status summary.",
     response_model=SimpleStatus,
 )
@@ -156,6 +175,86 @@ async def api_push_wallets(
     return SimpleStatus(success=True, message=message)
 
 
+@xerosync_api_router.get(
+    "/api/v1/wallets/{wallets_id}/plan",
+    name="Plan Wallet Push",
+    summary="Dry run of a wallet push: count and value the payments that would be pushed, without posting.",
+    response_description="Push plan with counts, skip reasons and fiat totals per currency.",
+)
+async def api_plan_wallets(
+    wallets_id: str,
+    start_date: date | None = None,
+    user: User = Depends(check_account_id_exists),
+) -> SyncPlan:
+    wallets = await get_wallets(user.id, wallets_id)
+    if not wallets:
+        raise HTTPException(HTTPStatus.NOT_FOUND, "Wallets not found.")
+    return await plan_wallet_sync(wallets, start_date=start_date)
+
+
+######################### Synced Payments #########################
+SYNCED_PAYMENTS_CSV_COLUMNS = [
+    "created_at",
+    "wallet_id",
+    "payment_hash",
+    "status",
+    "currency",
+    "amount",
+    "xero_bank_transaction_id",
+    "xero_invoice_id",
+    "xero_payment_id",
+]
+
+
+@xerosync_api_router.get(
+    "/api/v1/synced_payments",
+    name="Synced Payments List",
+    summary="get paginated list of payments pushed to Xero",
+    response_description="list of synced payments",
+    openapi_extra=generate_filter_params_openapi(SyncedPaymentsFilters),
+    response_model=Page[SyncedPayment],
+)
+async def api_get_synced_payments(
+    has_xero_id: bool | None = None,
+    user: User = Depends(check_account_id_exists),
+    filters: Filters = Depends(synced_payments_filters),
+) -> Page[SyncedPayment]:
+    return await get_synced_payments_paginated(user.id, filters, has_xero_id)
+
+
+@xerosync_api_router.get(
+    "/api/v1/synced_payments/csv",
+    name="Export Synced Payments",
+    summary="Stream all matching synced payments as CSV, oldest first.",
+    openapi_extra=generate_filter_params_openapi(SyncedPaymentsFilters),
+    response_class=StreamingResponse,
+)
+async def api_export_synced_payments(
+    has_xero_id: bool | None = None,
+    user: User = Depends(check_account_id_exists),
+    filters: Filters = Depends(synced_payments_filters),
+) -> StreamingResponse:
+    async def rows() -> AsyncIterator[str]:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(SYNCED_PAYMENTS_CSV_COLUMNS)
+        async for chunk in iter_synced_payments(user.id, filters, has_xero_id):
+            for payment in chunk:
+                record = payment.dict()
+                record["created_at"] = payment.created_at.isoformat()
+                writer.writerow([record[column] for column in SYNCED_PAYMENTS_CSV_COLUMNS])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+    return StreamingResponse(
+        rows(),
+        media_type="text/csv",
+        headers={"Content-Disposition": 'attachment; filename="xerosync_synced_payments.csv"'},
+    )
+
+
 ############################ Xero Metadata #############################
 @xerosync_api_router.get(
     "/api/v1/connection",
@@ -170,16 +269,54 @@ async def api_get_connection_status(user: User = Depends(check_account_id_exists
 @xerosync_api_router.get(
     "/api/v1/accounts",
     name="List Xero Accounts",
-    summary="Fetch chart of accounts from Xero for this user.",
+    summary="Chart of accounts from the last Xero snapshot for this user, refreshed in the background.",
 )
-async def api_get_accounts(user: User = Depends(check_account_id_exists)):
+async def api_get_accounts(
+    expense: bool = False,
+    refresh: bool = False,
+    user: User = Depends(check_account_id_exists),
+):
     conn = await get_xero_connection(user.id)
     if not conn:
         raise HTTPException(HTTPStatus.BAD_REQUEST, "No Xero connection configured for this user.")
     settings = await get_settings(user.id)
-    access_token, tenant_id = await ensure_xero_access_token(conn, settings)
-    accounts = await fetch_xero_accounts(access_token, tenant_id)
-    allowed_types = {"REVENUE", "SALES", "OTHERINCOME"}
+    accounts, fetched_at = await get_xero_metadata(conn, settings, METADATA_ACCOUNTS, refresh)
+    return {"data": account_options(accounts, expense), "fetched_at": fetched_at}
+
+
+@xerosync_api_router.get(
+    "/api/v1/bank_accounts",
+    name="List Xero Bank Accounts",
+    summary="Bank accounts from the last Xero snapshot for this user, refreshed in the background.",
+)
+async def api_get_bank_accounts(refresh: bool = False, user: User = Depends(check_account_id_exists)):
+    conn = await get_xero_connection(user.id)
+    if not conn:
+        raise HTTPException(HTTPStatus.BAD_REQUEST, "No Xero connection configured for this user.")
+    settings = await get_settings(user.id)
+    accounts, fetched_at = await get_xero_metadata(conn, settings, METADATA_ACCOUNTS, refresh)
+    return {"data": bank_account_options(accounts), "fetched_at": fetched_at}
+
+
+@xerosync_api_router.get(
+    "/api/v1/tax_rates",
+    name="List Xero Tax Rates",
+    summary="Tax rates from the last Xero snapshot for this user, refreshed in the background.",
+)
+async def api_get_tax_rates(refresh: bool = False, user: User = Depends(check_account_id_exists)):
+    conn = await get_xero_connection(user.id)
+    if not conn:
+        return {"data": [], "fetched_at": None}
+    settings = await get_settings(user.id)
+    tax_rates, fetched_at = await get_xero_metadata(conn, settings, METADATA_TAX_RATES, refresh)
+    return {"data": tax_rate_options(tax_rates), "fetched_at": fetched_at}
+
+
+def account_options(accounts: list[dict], expense: bool = False) -> list[dict]:
+    if expense:
+        allowed_types = {"EXPENSE", "OVERHEADS", "DIRECTCOSTS"}
+    else:
+        allowed_types = {"REVENUE", "SALES", "OTHERINCOME"}
     accounts = [acc for acc in accounts if acc.get("Type") in allowed_types]
     # Return minimal shape for selects
     return [
@@ -192,39 +329,18 @@ async def api_get_accounts(user: User = Depends(check_account_id_exists)):
     ]
 
 
-@xerosync_api_router.get(
-    "/api/v1/bank_accounts",
-    name="List Xero Bank Accounts",
-    summary="Fetch bank accounts from Xero for this user.",
-)
-async def api_get_bank_accounts(user: User = Depends(check_account_id_exists)):
-    conn = await get_xero_connection(user.id)
-    if not conn:
-        raise HTTPException(HTTPStatus.BAD_REQUEST, "No Xero connection configured for this user.")
-    settings = await get_settings(user.id)
-    access_token, tenant_id = await ensure_xero_access_token(conn, settings)
-    banks = await fetch_xero_bank_accounts(access_token, tenant_id)
+def bank_account_options(accounts: list[dict]) -> list[dict]:
     return [
         {
             "value": acc.get("AccountID"),
             "label": f"{acc.get('Name') or ''} ({acc.get('AccountNumber') or ''})".strip(),
         }
-        for acc in banks
+        for acc in accounts
+        if acc.get("Type") == "BANK"
     ]
 
 
-@xerosync_api_router.get(
-    "/api/v1/tax_rates",
-    name="List Xero Tax Rates",
-    summary="Fetch tax rates from Xero for this user.",
-)
-async def api_get_tax_rates(user: User = Depends(check_account_id_exists)):
-    conn = await get_xero_connection(user.id)
-    if not conn:
-        return []
-    settings = await get_settings(user.id)
-    access_token, tenant_id = await ensure_xero_access_token(conn, settings)
-    tax_rates = await fetch_xero_tax_rates_raw(access_token, tenant_id)
+def tax_rate_options(tax_rates: list[dict]) -> list[dict]:
     options = []
     for rate in tax_rates:
         if rate.get("Status") == "DELETED":
@@ -248,6 +364,95 @@ async def api_get_tax_rates(user: User = Depends(check_account_id_exists)):
     return options
 
 
+############################ Bootstrap ############################
+@xerosync_api_router.get(
+    "/api/v1/bootstrap",
+    name="UI Bootstrap",
+    summary="Everything the extension page needs on load, in one call.",
+    response_description="Connection status, settings, the first page of wallets and Xero options.",
+)
+async def api_get_bootstrap(
+    user: User = Depends(check_account_id_exists),
+    filters: Filters = Depends(wallets_filters),
+) -> dict:
+    settings_user_id = "admin" if ExtensionSettings.is_admin_only() else user.id
+    conn, settings, wallets = await asyncio.gather(
+        get_xero_connection(user.id),
+        get_settings(settings_user_id),
+        get_wallets_paginated(user_id=user.id, filters=filters),
+    )
+    accounts: list[dict] = []
+    tax_rates: list[dict] = []
+    fetched_at = None
+    if conn:
+        # Share one connection and settings lookup (and at most one token refresh) between both lists.
+        xero_settings = settings if settings_user_id == user.id else await get_settings(user.id)
+        account_result, tax_rate_result = await asyncio.gather(
+            _xero_metadata_or_empty(conn, xero_settings, METADATA_ACCOUNTS),
+            _xero_metadata_or_empty(conn, xero_settings, METADATA_TAX_RATES),
+        )
+        accounts, fetched_at = account_result
+        tax_rates, _ = tax_rate_result
+    return {
+        "connected": bool(conn),
+        "settings": settings,
+        "wallets": wallets,
+        "accounts": account_options(accounts),
+        "expense_accounts": account_options(accounts, expense=True),
+        "bank_accounts": bank_account_options(accounts),
+        "tax_rates": tax_rate_options(tax_rates),
+        "xero_fetched_at": fetched_at,
+    }
+
+
+async def _xero_metadata_or_empty(conn, settings: ExtensionSettings, kind: str) -> tuple[list[dict], datetime | None]:
+    # The page must load even when Xero cannot be reached for a first snapshot.
+    try:
+        return await get_xero_metadata(conn, settings, kind)
+    except Exception as exc:
+        logger.warning(f"Xero Sync: could not load Xero {kind}: {exc}")
+        return [], None
+
+
+############################# Metrics #############################
+@xerosync_api_router.get(
+    "/api/v1/metrics",
+    name="Sync Metrics",
+    summary="Live intake queue depth, spill backlog, per-tenant Xero batch tuning and payment filter size.",
+    dependencies=[Depends(check_admin)],
+)
+async def api_get_metrics() -> dict:
+    return {
+        "intake": await get_intake_metrics(),
+        "xero": get_transport_metrics(),
+        "payment_filters": get_payment_filter_metrics(),
+    }
+
+
+@xerosync_api_router.post(
+    "/api/v1/admin/sync",
+    name="Sync All Wallets",
+    summary="Start pushing every auto-push wallet of every user to Xero, in the background.",
+    response_description="Progress of the started sync.",
+    dependencies=[Depends(check_admin)],
+)
+async def api_start_admin_sync() -> AdminSyncProgress:
+    try:
+        return start_admin_sync()
+    except RuntimeError as exc:
+        raise HTTPException(HTTPStatus.CONFLICT, str(exc)) from exc
+
+
+@xerosync_api_router.get(
+    "/api/v1/admin/sync",
+    name="Sync All Wallets Progress",
+    summary="Progress of the latest sync of all wallets.",
+    dependencies=[Depends(check_admin)],
+)
+async def api_get_admin_sync() -> AdminSyncProgress:
+    return get_admin_sync_progress()
+
+
 ############################ Settings #############################
 @xerosync_api_router.get(
     "/api/v1/settings",
@@ -0,0 +1,89 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+
+from loguru import logger
+
+from .contacts import forget_xero_contact
+from .crud import (
+    defer_payments,
+    get_synced_payment_by_invoice,
+    get_webhook_settings,
+    get_xero_connection,
+    requeue_synced_payment,
+)
+from .models import SYNC_STATUS_OK, XeroConnection
+from .services import ensure_xero_access_token, get_settings
+from .transport import xero_request
+
+# Events waiting to be processed; when full, deliveries are refused and Xero retries them later.
+WEBHOOK_QUEUE_SIZE = 1000
+# A payment whose invoice reaches one of these statuses in Xero is posted again on a new invoice.
+VOIDED_INVOICE_STATUSES = ("DELETED", "VOIDED")
+
+webhook_queue: asyncio.Queue[tuple[str, dict]] = asyncio.Queue(WEBHOOK_QUEUE_SIZE)
+
+
+def xero_signature(body: bytes, webhook_key: str) -> str:
+    return base64.b64encode(hmac.new(webhook_key.encode(), body, hashlib.sha256).digest()).decode()
+
+
+async def verify_xero_webhook(body: bytes, signature: str | None) -> str | None:
+    """
+    The user whose webhook key signed `body`, or None if no configured key did.
+    """
+    if not signature:
+        return None
+    for settings in await get_webhook_settings():
+        expected = xero_signature(body, settings.xero_webhook_key or "")
+        if hmac.compare_digest(expected, signature):
+            return settings.id
+    return None
+
+
+def enqueue_xero_events(user_id: str, events: list[dict]) -> bool:
+    """
+    Queue a delivery's events, once per resource. Returns False if the queue has no room for them.
+    """
+    unique = {(event.get("eventCategory"), event.get("resourceId")): event for event in events}
+    if webhook_queue.maxsize - webhook_queue.qsize() < len(unique):
+        return False
+    for event in unique.values():
+        webhook_queue.put_nowait((user_id, event))
+    return True
+
+
+async def process_xero_event(user_id: str, event: dict) -> None:
+    conn = await get_xero_connection(user_id)
+    resource_id = event.get("resourceId")
+    if not conn or not resource_id or conn.tenant_id != event.get("tenantId"):
+        return
+    category = event.get("eventCategory")
+    if category == "CONTACT":
+        await forget_xero_contact(conn.tenant_id, resource_id)
+    elif category == "INVOICE":
+        await _check_synced_invoice(conn, resource_id)
+
+
+async def _check_synced_invoice(conn: XeroConnection, invoice_id: str) -> None:
+    synced = await get_synced_payment_by_invoice(invoice_id)
+    if not synced or synced.user_id != conn.user_id or synced.status != SYNC_STATUS_OK:
+        return
+    settings = await get_settings(conn.user_id)
+    access_token, tenant_id = await ensure_xero_access_token(conn, settings)
+    resp = await xero_request("GET", f"Invoices/{invoice_id}", access_token, tenant_id)
+    resp.raise_for_status()
+    invoices = resp.json().get("Invoices") or []
+    if not invoices:
+        return
+    status = invoices[0].get("Status")
+    if status in VOIDED_INVOICE_STATUSES:
+        keep_invoice, reason = False, f"invoice {status.lower()} in Xero"
+    elif status == "AUTHORISED" and synced.xero_payment_id and not invoices[0].get("AmountPaid"):
+        keep_invoice, reason = True, "payment removed in Xero"
+    else:
+        return
+    logger.info(f"Xero Sync: re-pushing payment {synced.payment_hash}: {reason}")
+    await requeue_synced_payment(synced.wallet_id, synced.payment_hash, keep_invoice)
+    await defer_payments(synced.user_id, synced.wallet_id, [synced.payment_hash], reason)